@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Compares the default windows (lists of VEKG events) against the columnar windows
+(`{"aggregation": "columnar", "columns": [...]}`) of a TUMBLING_COUNT_WINDOW:
+ - memory: bytes allocated per buffered frame (tracemalloc), with the windows of every buffer stream open.
+ - append: cost of decoding each frame json and adding it to its window (the columnar one extracts the
+   numeric attributes).
+ - filter: cost, per window, of a window-level filter over the numeric node attributes (the nodes with a
+   confidence over 0.8 and a bounding box area over 2000), with per-node loops over the frames for the
+   default windows, and vectorized over the columns for the columnar ones.
+The frames are decoded from json (as in the service), so they don't share objects.
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+
+from window_manager.columnar import get_numpy
+from window_manager.window_controllers import TumblingCountWindowController
+
+COLUMNS = ['confidence', 'bounding_box', 'color']
+
+
+def make_event_json(index, num_nodes, num_buffer_streams):
+    nodes = [
+        [
+            f'object-{n}',
+            {
+                'label': random.choice(['car', 'person', 'bus']),
+                'confidence': random.random(),
+                'bounding_box': [random.randint(0, 640), random.randint(0, 480), random.randint(10, 100),
+                                 random.randint(10, 100)],
+                'color': [random.randint(0, 255) for _ in range(3)],
+            }
+        ]
+        for n in range(num_nodes)
+    ]
+    edges = [[f'object-{n}', f'object-{n + 1}', {'relation': 'near'}] for n in range(num_nodes - 1)]
+    return json.dumps({
+        'id': f'event-{index}',
+        'buffer_stream_key': f'buffer-{index % num_buffer_streams}',
+        'query_ids': ['query-1'],
+        'timestamp': index / 30,
+        'vekg': {'nodes': nodes, 'edges': edges},
+    })
+
+
+def filter_list_window(window):
+    matches = 0
+    for frame in window:
+        for node in frame['vekg']['nodes']:
+            attributes = node[1]
+            bounding_box = attributes['bounding_box']
+            if attributes['confidence'] > 0.8 and bounding_box[2] * bounding_box[3] > 2000:
+                matches += 1
+    return matches
+
+
+def filter_columnar_window(window):
+    bounding_boxes = window.get_column('bounding_box')
+    mask = (window.get_column('confidence') > 0.8) & (bounding_boxes[:, 2] * bounding_boxes[:, 3] > 2000)
+    return int(mask.sum())
+
+
+def fill_windows(event_jsons, window_size, window_options):
+    window_controller = TumblingCountWindowController('query-1', window_size, *window_options)
+    for event_json in event_jsons:
+        window_controller.update_windows(json.loads(event_json))
+    return window_controller
+
+
+def measure(event_jsons, window_size, window_options, window_filter):
+    # timings (json decode included, as in the service) and memory are measured in separate runs,
+    # since tracemalloc slows down the allocations
+    start_time = time.perf_counter()
+    window_controller = fill_windows(event_jsons, window_size, window_options)
+    append_time = (time.perf_counter() - start_time) / len(event_jsons)
+    windows = list(window_controller.bufferstream_to_window_map.values())
+    matches = sum(window_filter(window) for window in windows)
+    start_time = time.perf_counter()
+    for window in windows:
+        window_filter(window)
+    filter_time = (time.perf_counter() - start_time) / len(windows)
+    del window_controller, windows
+
+    tracemalloc.start()
+    window_controller = fill_windows(event_jsons, window_size, window_options)
+    buffered_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return buffered_memory / window_controller.buffered_events_count, append_time, filter_time, matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--window-size', type=int, default=30)
+    parser.add_argument('--buffer-streams', type=int, default=20)
+    args = parser.parse_args()
+    random.seed(0)
+    # numpy is imported with the first columnar window otherwise, which would be timed
+    get_numpy()
+
+    print(
+        f'{"nodes":>6} {"list KB/frame":>14} {"col KB/frame":>13} {"list append us":>15} {"col append us":>14} '
+        f'{"list filter us":>15} {"col filter us":>14}'
+    )
+    for num_nodes in args.nodes:
+        # one frame short of a full window for every buffer stream
+        num_events = (args.window_size - 1) * args.buffer_streams
+        event_jsons = [make_event_json(i, num_nodes, args.buffer_streams) for i in range(num_events)]
+        list_results = measure(event_jsons, args.window_size, [], filter_list_window)
+        columnar_options = [{'aggregation': 'columnar', 'columns': COLUMNS}]
+        columnar_results = measure(event_jsons, args.window_size, columnar_options, filter_columnar_window)
+        assert list_results[3] == columnar_results[3]
+        print(
+            f'{num_nodes:>6} {list_results[0] / 1024:>14.1f} {columnar_results[0] / 1024:>13.1f} '
+            f'{list_results[1] * 1e6:>15.1f} {columnar_results[1] * 1e6:>14.1f} '
+            f'{list_results[2] * 1e6:>15.1f} {columnar_results[2] * 1e6:>14.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+Reproducible throughput and latency benchmark suite for the windowing hot path.
+
+Runs the real WindowManager.process_data loop against in-memory streams (no Redis or Jaeger needed),
+fed with synthetic VEKG events, and reports for each scenario:
+ - events/sec: events processed (read, windowed and written to the matcher) per second.
+ - window-close latency (p50/p99): time between reading the batch with the event that closed a
+   window and writing that window to the matcher stream.
+ - average size of the windows written to the matcher stream.
+ - peak RSS of the process running the scenario (each scenario runs in a fresh process).
+
+The events are generated with a fixed seed, and the results can be written as JSON (--output) and
+compared against the results of another commit (--compare), eg:
+    $ python benchmarks/hot_path_suite.py --output before.json
+    $ git checkout other-branch
+    $ python benchmarks/hot_path_suite.py --output after.json --compare before.json
+
+Custom scenarios can be given as a JSON list (--scenarios), where each scenario overrides the
+fields of DEFAULT_SCENARIO.
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import deque
+from unittest.mock import patch
+
+from event_service_utils.streams.base import BasicStream, StreamFactory
+from opentracing import Tracer
+
+from window_manager.service import WindowManager
+
+DATA_STREAM_KEY = 'wm-data'
+MATCHER_STREAM_KEY = 'ma-data'
+
+DEFAULT_SCENARIO = {
+    'name': 'default',
+    'events': 20000,
+    # VEKG graph size of each event
+    'nodes': 10,
+    'edges': 10,
+    # publishers are the buffer streams (one per camera)
+    'publishers': 10,
+    'queries': 10,
+    # number of query_ids in each event, the same queries for all the events of a publisher
+    'fan_out': 3,
+    # window specs, assigned to the queries in round-robin
+    'windows': [{'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [10]}],
+    # event time between two frames of the same publisher
+    'fps': 30,
+    'batch_size': 1,
+    'raw_passthrough': False,
+    'seed': 42,
+}
+
+DEFAULT_SCENARIOS = [
+    {'name': 'tumbling-count'},
+    {'name': 'tumbling-count-batched', 'batch_size': 100},
+    {'name': 'tumbling-count-raw-passthrough', 'raw_passthrough': True},
+    {'name': 'high-fan-out', 'queries': 100, 'fan_out': 30},
+    {'name': 'large-graph', 'nodes': 100, 'edges': 200, 'events': 5000},
+    {
+        'name': 'large-graph-merged',
+        'nodes': 100,
+        'edges': 200,
+        'events': 5000,
+        'windows': [{'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [10, {'aggregation': 'merged_graph'}]}],
+    },
+    {'name': 'many-publishers', 'publishers': 1000},
+    {
+        'name': 'mixed-windows',
+        'queries': 40,
+        'fan_out': 8,
+        'windows': [
+            {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [10]},
+            {'window_type': 'SLIDING_COUNT_WINDOW', 'args': [10, 2]},
+            {'window_type': 'TUMBLING_TIME_WINDOW', 'args': [1]},
+            {'window_type': 'HOPPING_TIME_WINDOW', 'args': [2, 1]},
+        ],
+    },
+]
+
+NODE_LABELS = ['car', 'person', 'bus', 'truck', 'bike']
+NODE_COLORS = ['blue', 'white', 'red', 'black']
+EDGE_RELATIONS = ['near', 'left_of', 'right_of', 'behind']
+
+
+class InMemoryStream(BasicStream):
+    # stand-in for the redis streams: reads never block, and writes are kept in a list
+
+    def __init__(self, key, clock=time.perf_counter):
+        BasicStream.__init__(self, key)
+        self.clock = clock
+        self.pending_events = deque()
+        self.written_events = []
+        self.last_read_time = None
+        self.write_times = []
+
+    def read_events(self, count=1):
+        self.last_read_time = self.clock()
+        event_list = []
+        while self.pending_events and len(event_list) < count:
+            event_list.append(self.pending_events.popleft())
+        return event_list
+
+    def read_stream_events_list(self, count=1):
+        return [(self.key.encode('utf-8'), self.read_events(count=count))]
+
+    def write_events(self, *events):
+        now = self.clock()
+        for event in events:
+            self.written_events.append(event)
+            self.write_times.append(now)
+
+    def ack(self, event_id):
+        pass
+
+
+class InMemoryStreamFactory(StreamFactory):
+
+    def __init__(self):
+        self.streams = {}
+
+    def create(self, key, stype=None, cg_id=None):
+        if not isinstance(key, str):
+            key = ','.join(key)
+        if key not in self.streams:
+            self.streams[key] = InMemoryStream(key)
+        return self.streams[key]
+
+
+def make_vekg(rand, num_nodes, num_edges):
+    nodes = [
+        [
+            f'object-{n}',
+            {
+                'id': f'object-{n}',
+                'label': rand.choice(NODE_LABELS),
+                'color': rand.choice(NODE_COLORS),
+                'confidence': round(rand.random(), 4),
+                'bounding_box': [rand.randint(0, 640) for _ in range(4)],
+            }
+        ]
+        for n in range(num_nodes)
+    ]
+    edges = []
+    if num_nodes > 1:
+        edges = [
+            [f'object-{e % num_nodes}', f'object-{(e + 1) % num_nodes}', {'relation': rand.choice(EDGE_RELATIONS)}]
+            for e in range(num_edges)
+        ]
+    return {'nodes': nodes, 'edges': edges}
+
+
+def get_publisher_query_ids(publisher_index, num_queries, fan_out):
+    fan_out = min(fan_out, num_queries)
+    return [f'query-{(publisher_index + k) % num_queries}' for k in range(fan_out)]
+
+
+def generate_data_events(scenario):
+    # (event id, json msg) tuples, with the same format as the ones read from redis
+    rand = random.Random(scenario['seed'])
+    num_publishers = scenario['publishers']
+    publisher_query_ids = [
+        get_publisher_query_ids(p, scenario['queries'], scenario['fan_out']) for p in range(num_publishers)
+    ]
+    start_timestamp = 1600000000.0
+    frame_interval = 1.0 / scenario['fps']
+    event_tuples = []
+    for i in range(scenario['events']):
+        publisher_index = i % num_publishers
+        frame_index = i // num_publishers
+        event_data = {
+            'id': f'event-{i}',
+            'vekg': make_vekg(rand, scenario['nodes'], scenario['edges']),
+            'query_ids': publisher_query_ids[publisher_index],
+            'buffer_stream_key': f'publisher-{publisher_index}',
+            'timestamp': start_timestamp + frame_index * frame_interval,
+        }
+        event_tuples.append((f'{i}-0'.encode('utf-8'), {b'event': json.dumps(event_data).encode('utf-8')}))
+    return event_tuples
+
+
+def build_service(scenario, stream_factory):
+    with patch('window_manager.service.init_tracer', return_value=Tracer()):
+        service = WindowManager(
+            service_stream_key=DATA_STREAM_KEY,
+            service_cmd_key_list=[],
+            pub_event_list=[],
+            service_details=None,
+            matcher_stream_key=MATCHER_STREAM_KEY,
+            stream_factory=stream_factory,
+            logging_level='ERROR',
+            tracer_configs={},
+            raw_passthrough=scenario['raw_passthrough'],
+            batch_configs={'max_size': scenario['batch_size'], 'max_linger_ms': 0},
+        )
+    windows = scenario['windows']
+    for i in range(scenario['queries']):
+        service.add_query_window_action(f'query-{i}', windows[i % len(windows)])
+    return service
+
+
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))
+    return sorted_values[index]
+
+
+def run_scenario(scenario):
+    stream_factory = InMemoryStreamFactory()
+    service = build_service(scenario, stream_factory)
+    data_stream = stream_factory.create(DATA_STREAM_KEY)
+    matcher_stream = stream_factory.create(MATCHER_STREAM_KEY)
+    data_stream.pending_events.extend(generate_data_events(scenario))
+
+    # every window written to the matcher is timed from the read of the batch that closed it
+    window_close_latencies = []
+    original_write_events = matcher_stream.write_events
+
+    def timed_write_events(*events):
+        original_write_events(*events)
+        latency = matcher_stream.write_times[-1] - data_stream.last_read_time
+        window_close_latencies.extend([latency] * len(events))
+
+    matcher_stream.write_events = timed_write_events
+
+    start = time.perf_counter()
+    while data_stream.pending_events:
+        service.process_data()
+    elapsed = time.perf_counter() - start
+
+    window_close_latencies.sort()
+    p50 = get_percentile(window_close_latencies, 50)
+    p99 = get_percentile(window_close_latencies, 99)
+    # ru_maxrss is in KB on linux (and bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss_mb = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    window_sizes = [len(event['event']) for event in matcher_stream.written_events]
+    return {
+        'name': scenario['name'],
+        'params': scenario,
+        'elapsed_secs': elapsed,
+        'events_per_sec': scenario['events'] / elapsed,
+        'windows': len(matcher_stream.written_events),
+        'window_close_latency_p50_us': p50 * 1e6 if p50 is not None else None,
+        'window_close_latency_p99_us': p99 * 1e6 if p99 is not None else None,
+        'window_kb_avg': sum(window_sizes) / len(window_sizes) / 1024 if window_sizes else None,
+        'peak_rss_mb': peak_rss_mb,
+    }
+
+
+def run_scenario_in_new_process(scenario):
+    # a fresh process per scenario, so that the peak RSS isn't carried over from the previous ones
+    mp_context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=mp_context) as executor:
+        return executor.submit(run_scenario, scenario).result()
+
+
+def get_git_commit():
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=repo_dir, stderr=subprocess.DEVNULL
+        ).decode().strip()
+        is_dirty = bool(subprocess.check_output(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo_dir, stderr=subprocess.DEVNULL
+        ).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{commit}-dirty' if is_dirty else commit
+
+
+def get_scenarios(args):
+    if args.scenarios:
+        with open(args.scenarios) as scenarios_file:
+            scenarios = json.load(scenarios_file)
+    else:
+        scenarios = DEFAULT_SCENARIOS
+    scenarios = [dict(DEFAULT_SCENARIO, **scenario) for scenario in scenarios]
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if scenario['name'] in args.only]
+    if args.events is not None:
+        for scenario in scenarios:
+            scenario['events'] = args.events
+    return scenarios
+
+
+def format_value(value, fmt):
+    return format(value, fmt) if value is not None else '-'
+
+
+def print_results(results):
+    print(
+        f'{"scenario":<32} {"events/s":>10} {"windows":>8} {"p50 us":>9} {"p99 us":>9} '
+        f'{"window KB":>10} {"peak RSS MB":>12}'
+    )
+    for result in results:
+        print(
+            f'{result["name"]:<32} {result["events_per_sec"]:>10.0f} {result["windows"]:>8} '
+            f'{format_value(result["window_close_latency_p50_us"], ">9.1f")} '
+            f'{format_value(result["window_close_latency_p99_us"], ">9.1f")} '
+            f'{format_value(result.get("window_kb_avg"), ">10.1f")} '
+            f'{result["peak_rss_mb"]:>12.1f}'
+        )
+
+
+def get_change(new_value, old_value):
+    if new_value is None or not old_value:
+        return '-'
+    return f'{(new_value - old_value) / old_value * 100:+.1f}%'
+
+
+def print_comparison(results, baseline):
+    baseline_results = {result['name']: result for result in baseline['results']}
+    print(f'\nChanges against {baseline["metadata"].get("git_commit")}:')
+    print(f'{"scenario":<32} {"events/s":>10} {"p50 us":>9} {"p99 us":>9} {"window KB":>10} {"peak RSS MB":>12}')
+    for result in results:
+        old_result = baseline_results.get(result['name'])
+        if old_result is None:
+            continue
+        if old_result['params'] != result['params']:
+            print(f'{result["name"]:<32} (different params, not compared)')
+            continue
+        changes = [
+            get_change(result.get(field), old_result.get(field))
+            for field in [
+                'events_per_sec', 'window_close_latency_p50_us', 'window_close_latency_p99_us', 'window_kb_avg',
+                'peak_rss_mb'
+            ]
+        ]
+        print(
+            f'{result["name"]:<32} {changes[0]:>10} {changes[1]:>9} {changes[2]:>9} {changes[3]:>10} {changes[4]:>12}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', help='JSON file with the list of scenarios to run')
+    parser.add_argument('--only', nargs='+', help='names of the scenarios to run')
+    parser.add_argument('--events', type=int, help='overrides the number of events of every scenario')
+    parser.add_argument('--output', help='JSON file where the results are written')
+    parser.add_argument('--compare', help='JSON results file of a previous run to compare against')
+    args = parser.parse_args()
+
+    results = [run_scenario_in_new_process(scenario) for scenario in get_scenarios(args)]
+    print_results(results)
+
+    output = {
+        'metadata': {
+            'git_commit': get_git_commit(),
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print_comparison(results, json.load(baseline_file))
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
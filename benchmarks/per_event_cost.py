@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Measures the per-event cost of WindowManager.process_data_event while the number
+of registered queries grows. Each event only carries a fixed number of query ids,
+so the cost should stay flat regardless of how many queries are registered.
+
+Runs without Redis/Jaeger, using the mocked streams from event_service_utils.
+"""
+import argparse
+import time
+from unittest.mock import patch
+
+from event_service_utils.tests.mocked_streams import MockedStreamFactory
+from opentracing import Tracer
+
+from window_manager.service import WindowManager
+
+
+def build_service(num_queries, window_size):
+    mocked_dict = {'wm-data': [], 'cg-WindowManager': {}}
+    with patch('window_manager.service.init_tracer', return_value=Tracer()):
+        service = WindowManager(
+            service_stream_key='wm-data',
+            service_cmd_key_list=[],
+            pub_event_list=[],
+            service_details=None,
+            matcher_stream_key='ma-data',
+            stream_factory=MockedStreamFactory(mocked_dict=mocked_dict),
+            logging_level='ERROR',
+            tracer_configs={},
+        )
+    for i in range(num_queries):
+        # distinct window specs, so that every query gets its own controller
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [window_size + i]}
+        service.add_query_window_action(f'query-{i}', window)
+    return service, mocked_dict
+
+
+def run(num_queries, num_events, fan_out, num_buffer_streams, window_size):
+    service, mocked_dict = build_service(num_queries, window_size)
+    query_ids = [f'query-{i}' for i in range(min(fan_out, num_queries))]
+    events = [
+        {
+            'id': f'event-{i}',
+            'vekg': {},
+            'query_ids': query_ids,
+            'buffer_stream_key': f'buffer-{i % num_buffer_streams}',
+        }
+        for i in range(num_events)
+    ]
+    start = time.perf_counter()
+    for event_data in events:
+        service.process_data_event(event_data, None)
+    elapsed = time.perf_counter() - start
+    windows_sent = len(mocked_dict['ma-data'])
+    return elapsed / num_events, windows_sent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--queries', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--fan-out', type=int, default=3)
+    parser.add_argument('--buffer-streams', type=int, default=10)
+    parser.add_argument('--window-size', type=int, default=10)
+    args = parser.parse_args()
+
+    print(f'{"queries":>10} {"us/event":>10} {"windows":>10}')
+    for num_queries in args.queries:
+        per_event, windows_sent = run(
+            num_queries, args.events, args.fan_out, args.buffer_streams, args.window_size
+        )
+        print(f'{num_queries:>10} {per_event * 1e6:>10.2f} {windows_sent:>10}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+Compares the per-frame CPU cost of the default decode/encode path against the raw passthrough path:
+ - default: the whole VEKG event is decoded with json.loads, and encoded again with json.dumps
+   inside the window sent to the matcher.
+ - raw passthrough: only the routing fields are decoded, and the original event json is spliced
+   into the window message.
+"""
+import argparse
+import json
+import random
+import time
+
+from window_manager.lazy_events import parse_routing_fields
+
+ROUTING_FIELDS = ['id', 'query_ids', 'buffer_stream_key', 'timestamp', 'tracer']
+
+
+def make_vekg_event_json(index, num_nodes):
+    nodes = [
+        [
+            f'object-{n}',
+            {
+                'label': random.choice(['car', 'person', 'bus']),
+                'confidence': random.random(),
+                'bounding_box': [random.randint(0, 640) for _ in range(4)],
+                'color': random.choice(['blue', 'white', 'red']),
+            }
+        ]
+        for n in range(num_nodes)
+    ]
+    edges = [[f'object-{n}', f'object-{n + 1}', {'relation': 'near'}] for n in range(num_nodes - 1)]
+    event_data = {
+        'id': f'event-{index}',
+        'publisher_id': 'publisher-1',
+        'buffer_stream_key': 'buffer-1',
+        'query_ids': ['query-1', 'query-2'],
+        'timestamp': time.time(),
+        'vekg': {'nodes': nodes, 'edges': edges},
+    }
+    return json.dumps(event_data)
+
+
+def default_path(event_jsons, window_size):
+    window = []
+    for event_json in event_jsons:
+        window.append(json.loads(event_json))
+        if len(window) == window_size:
+            json.dumps({'id': 'window', 'query_id': 'query-1', 'vekg_stream': window})
+            window = []
+
+
+def raw_passthrough_path(event_jsons, window_size):
+    window = []
+    for event_json in event_jsons:
+        window.append(parse_routing_fields(event_json, ROUTING_FIELDS))
+        if len(window) == window_size:
+            envelope = json.dumps({'id': 'window', 'query_id': 'query-1'})
+            encoded_frames = ', '.join(frame.raw_json for frame in window)
+            f'{envelope[:-1]}, "vekg_stream": [{encoded_frames}]}}'
+            window = []
+
+
+def measure(path, event_jsons, window_size, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        path(event_jsons, window_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(event_jsons)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--frames', type=int, default=500)
+    parser.add_argument('--window-size', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"nodes":>8} {"event KB":>10} {"default us":>12} {"raw us":>10} {"speedup":>8}')
+    for num_nodes in args.nodes:
+        event_jsons = [make_vekg_event_json(i, num_nodes) for i in range(args.frames)]
+        default_cost = measure(default_path, event_jsons, args.window_size, args.repeat)
+        raw_cost = measure(raw_passthrough_path, event_jsons, args.window_size, args.repeat)
+        event_kb = len(event_jsons[0]) / 1024
+        print(
+            f'{num_nodes:>8} {event_kb:>10.1f} {default_cost * 1e6:>12.1f} '
+            f'{raw_cost * 1e6:>10.1f} {default_cost / raw_cost:>7.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
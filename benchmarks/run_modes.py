@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Compares the "threads" and "asyncio" run modes of the WindowManager: the latency between an event
+being written to the data stream and its window being written to the matcher stream (with windows of
+a single event), and the number of context switches of the process while the events are processed.
+
+Both modes run the real service loops (a query is created through the cmd stream, so its reader is
+also blocked during the run), against in-memory streams instead of Redis, so this measures the
+wakeup and scheduling overhead of each mode, not the network round trips.
+"""
+import argparse
+import asyncio
+import json
+import queue
+import resource
+import statistics
+import threading
+import time
+from unittest.mock import patch
+
+from event_service_utils.streams.base import BasicStream, StreamFactory
+from opentracing import Tracer
+
+from window_manager.service import WindowManager
+
+QUERY_CREATED_EVENT = json.dumps({
+    'id': 'query-created-1',
+    'query_id': 'query-1',
+    'parsed_query': {'window': {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [1]}},
+})
+
+
+class BlockingQueueStream(BasicStream):
+    # thread mode stream: reading blocks until an event is written (or the stream is closed)
+
+    def __init__(self, key, on_write=None):
+        BasicStream.__init__(self, key)
+        self.queue = queue.Queue()
+        self.on_write = on_write
+        self.is_closed = False
+
+    def read_events(self, count=1):
+        while True:
+            try:
+                event_list = [self.queue.get(timeout=0.1)]
+                break
+            except queue.Empty:
+                if self.is_closed:
+                    # ends the run_forever thread of the service
+                    raise SystemExit()
+        while len(event_list) < count and not self.queue.empty():
+            event_list.append(self.queue.get_nowait())
+        return event_list
+
+    def read_stream_events_list(self, count=1):
+        return [(self.key.encode('utf-8'), self.read_events(count=count))]
+
+    def write_events(self, *events):
+        for event in events:
+            if self.on_write is not None:
+                self.on_write(event)
+            else:
+                self.queue.put(event)
+
+    def ack(self, event_id):
+        pass
+
+
+class BlockingQueueStreamFactory(StreamFactory):
+
+    def __init__(self, matcher_stream_key, on_matcher_write):
+        self.matcher_stream_key = matcher_stream_key
+        self.on_matcher_write = on_matcher_write
+        self.streams = {}
+
+    def create(self, key, stype=None, cg_id=None):
+        if not isinstance(key, str):
+            key = key[0]
+        if key not in self.streams:
+            on_write = self.on_matcher_write if key == self.matcher_stream_key else None
+            self.streams[key] = BlockingQueueStream(key, on_write=on_write)
+        return self.streams[key]
+
+
+class AsyncQueueStream(object):
+    # asyncio mode stream, with the same interface as AsyncConsumerGroupStream/AsyncStreamWriter
+
+    def __init__(self, key, on_write=None):
+        self.key = key
+        self.queue = asyncio.Queue()
+        self.on_write = on_write
+
+    async def create_group(self):
+        pass
+
+    async def read_events(self, count=1, block=None):
+        event_list = [await self.queue.get()]
+        while len(event_list) < count and not self.queue.empty():
+            event_list.append(self.queue.get_nowait())
+        return event_list
+
+    async def read_stream_events_list(self, count=1, block=None):
+        return [(self.key.encode('utf-8'), await self.read_events(count=count))]
+
+    async def ack(self, *event_ids):
+        pass
+
+    async def write_events(self, key, event_msgs, **write_kwargs):
+        for event_msg in event_msgs:
+            self.on_write(event_msg)
+
+
+class RunModeBenchmark(object):
+
+    def __init__(self, run_mode, num_events, interval_ms):
+        self.run_mode = run_mode
+        self.num_events = num_events
+        self.interval = interval_ms / 1000
+        self.sent_times = {}
+        self.received_windows = []
+        self.all_received = threading.Event()
+        self.stream_factory = BlockingQueueStreamFactory('ma-data', self.on_matcher_write)
+        with patch('window_manager.service.init_tracer', return_value=Tracer()):
+            self.service = WindowManager(
+                service_stream_key='wm-data',
+                service_cmd_key_list=['QueryCreated'],
+                pub_event_list=[],
+                service_details=None,
+                matcher_stream_key='ma-data',
+                stream_factory=self.stream_factory,
+                logging_level='ERROR',
+                tracer_configs={},
+                run_mode=run_mode,
+            )
+
+    def on_matcher_write(self, event_msg):
+        self.received_windows.append((time.perf_counter(), event_msg))
+        if len(self.received_windows) == self.num_events:
+            self.all_received.set()
+
+    def produce_events(self, write_event):
+        write_event(('0-1', {'event': QUERY_CREATED_EVENT}), is_cmd=True)
+        # gives some time for the query to be created
+        time.sleep(0.2)
+        for i in range(self.num_events):
+            event_data = {'id': f'event-{i}', 'vekg': {}, 'query_ids': ['query-1'], 'buffer_stream_key': 'buffer-1'}
+            self.sent_times[event_data['id']] = time.perf_counter()
+            write_event((f'{i}-0', {'event': json.dumps(event_data)}), is_cmd=False)
+            time.sleep(self.interval)
+
+    def run_threads(self):
+        data_stream = self.stream_factory.streams['wm-data']
+        cmd_stream = self.stream_factory.streams['QueryCreated']
+
+        def write_event(event_tuple, is_cmd):
+            (cmd_stream if is_cmd else data_stream).queue.put(event_tuple)
+
+        threads = [
+            threading.Thread(target=self.service.run_forever, args=(self.service.process_cmd,)),
+            threading.Thread(target=self.service.run_forever, args=(self.service.process_data,)),
+        ]
+        for thread in threads:
+            thread.start()
+        self.produce_events(write_event)
+        self.all_received.wait()
+        data_stream.is_closed = cmd_stream.is_closed = True
+        for thread in threads:
+            thread.join()
+
+    async def run_asyncio_until_all_received(self):
+        loop = asyncio.get_event_loop()
+        data_stream = AsyncQueueStream('wm-data')
+        cmd_stream = AsyncQueueStream('QueryCreated')
+        stream_writer = AsyncQueueStream('ma-data', on_write=self.on_matcher_write)
+        self.service.create_async_streams = lambda: (data_stream, {'default': cmd_stream}, stream_writer)
+
+        def write_event(event_tuple, is_cmd):
+            stream = cmd_stream if is_cmd else data_stream
+            loop.call_soon_threadsafe(stream.queue.put_nowait, event_tuple)
+
+        service_task = asyncio.ensure_future(self.service.run_async())
+        producer_thread = threading.Thread(target=self.produce_events, args=(write_event,))
+        producer_thread.start()
+        await loop.run_in_executor(None, self.all_received.wait)
+        service_task.cancel()
+        try:
+            await service_task
+        except asyncio.CancelledError:
+            pass
+        producer_thread.join()
+
+    def run_asyncio(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self.run_asyncio_until_all_received())
+        finally:
+            loop.close()
+
+    def run(self):
+        start_usage = resource.getrusage(resource.RUSAGE_SELF)
+        if self.run_mode == 'asyncio':
+            self.run_asyncio()
+        else:
+            self.run_threads()
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+
+        latencies = []
+        for received_time, event_msg in self.received_windows:
+            event_id = json.loads(event_msg['event'])['vekg_stream'][0]['id']
+            latencies.append(received_time - self.sent_times[event_id])
+        latencies.sort()
+        context_switches = (
+            (end_usage.ru_nvcsw - start_usage.ru_nvcsw) + (end_usage.ru_nivcsw - start_usage.ru_nivcsw)
+        )
+        return {
+            'p50_us': statistics.median(latencies) * 1e6,
+            'p99_us': latencies[int(len(latencies) * 0.99) - 1] * 1e6,
+            'context_switches_per_event': context_switches / self.num_events,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=2000)
+    parser.add_argument('--interval-ms', type=float, default=1)
+    parser.add_argument('--modes', nargs='+', default=['threads', 'asyncio'])
+    args = parser.parse_args()
+
+    print(f'{"mode":>10} {"p50 us":>10} {"p99 us":>10} {"ctx switches/event":>20}')
+    for run_mode in args.modes:
+        result = RunModeBenchmark(run_mode, args.events, args.interval_ms).run()
+        print(
+            f'{run_mode:>10} {result["p50_us"]:>10.1f} {result["p99_us"]:>10.1f} '
+            f'{result["context_switches_per_event"]:>20.2f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
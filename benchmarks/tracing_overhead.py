@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+Measures the per-event cost of tracing in WindowManager.process_data_events:
+ - off: no tracer (the opentracing no-op tracer).
+ - ratio N: a jaeger tracer with an in-memory stand-in reporter, tracing N of the windows (one span per
+   sampled window, linking its frames).
+ - per-frame spans: as before the window sampling, one span for each frame and each window.
+The events carry the trace headers of an upstream service, as in production.
+
+Runs without Redis/Jaeger, using the mocked streams from event_service_utils.
+"""
+import argparse
+import json
+import time
+from unittest.mock import patch
+
+from event_service_utils.services.tracer import BaseTracerService
+from event_service_utils.tests.mocked_streams import MockedStreamFactory
+from jaeger_client import Tracer as JaegerTracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from opentracing import Tracer
+from opentracing.propagation import Format
+
+from window_manager.service import WindowManager
+
+
+class PerFrameSpansWindowManager(WindowManager):
+
+    def process_data_event_wrapper(self, event_data, json_msg):
+        BaseTracerService.process_data_event_wrapper(self, event_data, json_msg)
+
+
+def build_service(service_cls, tracer, sample_ratio, num_queries, window_size):
+    mocked_dict = {'wm-data': [], f'cg-{service_cls.__name__}': {}}
+    with patch('window_manager.service.init_tracer', return_value=tracer):
+        service = service_cls(
+            service_stream_key='wm-data',
+            service_cmd_key_list=[],
+            pub_event_list=[],
+            service_details=None,
+            matcher_stream_key='ma-data',
+            stream_factory=MockedStreamFactory(mocked_dict=mocked_dict),
+            logging_level='ERROR',
+            tracer_configs={},
+            tracing_configs={'sample_ratio': sample_ratio},
+        )
+    for i in range(num_queries):
+        service.add_query_window_action(f'query-{i}', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [window_size]})
+    return service
+
+
+def make_event_list(tracer, num_events, num_queries, num_buffer_streams, num_nodes):
+    event_list = []
+    for i in range(num_events):
+        tracer_headers = {}
+        with tracer.start_span('publish') as span:
+            tracer.inject(span.context, Format.HTTP_HEADERS, tracer_headers)
+        event_data = {
+            'id': f'event-{i}',
+            'vekg': {'nodes': [[f'object-{n}', {'label': 'car'}] for n in range(num_nodes)], 'edges': []},
+            'query_ids': [f'query-{q}' for q in range(num_queries)],
+            'buffer_stream_key': f'buffer-{i % num_buffer_streams}',
+            'tracer': {'headers': tracer_headers},
+        }
+        event_list.append((f'{i}-0', {'event': json.dumps(event_data)}))
+    return event_list
+
+
+def run(service, event_list, batch_size):
+    start = time.perf_counter()
+    for batch_start in range(0, len(event_list), batch_size):
+        service.process_data_events(event_list[batch_start:batch_start + batch_size])
+    return (time.perf_counter() - start) / len(event_list)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=3)
+    parser.add_argument('--buffer-streams', type=int, default=10)
+    parser.add_argument('--nodes', type=int, default=10)
+    parser.add_argument('--window-size', type=int, default=10)
+    parser.add_argument('--sample-ratios', type=float, nargs='+', default=[0, 0.01, 0.1, 1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    upstream_tracer = JaegerTracer('upstream', reporter=InMemoryReporter(), sampler=ConstSampler(True))
+    event_list = make_event_list(upstream_tracer, args.events, args.queries, args.buffer_streams, args.nodes)
+    modes = [('off', WindowManager, None, 1)]
+    modes.extend((f'ratio {sample_ratio:g}', WindowManager, True, sample_ratio) for sample_ratio in args.sample_ratios)
+    modes.append(('per-frame spans', PerFrameSpansWindowManager, True, 1))
+
+    print(f'{"tracing":>16} {"us/event":>10} {"spans/event":>12} {"overhead":>9}')
+    off_cost = None
+    for mode_name, service_cls, is_traced, sample_ratio in modes:
+        best_cost = None
+        for _ in range(args.repeat):
+            reporter = InMemoryReporter()
+            tracer = Tracer()
+            if is_traced:
+                tracer = JaegerTracer('WindowManager', reporter=reporter, sampler=ConstSampler(True))
+            service = build_service(service_cls, tracer, sample_ratio, args.queries, args.window_size)
+            cost = run(service, event_list, 1)
+            best_cost = cost if best_cost is None else min(best_cost, cost)
+            spans_per_event = len(reporter.get_spans()) / len(event_list)
+        if off_cost is None:
+            off_cost = best_cost
+        print(
+            f'{mode_name:>16} {best_cost * 1e6:>10.2f} {spans_per_event:>12.3f} '
+            f'{(best_cost / off_cost - 1) * 100:>8.1f}%'
+        )
+
+
+if __name__ == '__main__':
+    main()
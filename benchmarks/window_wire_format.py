@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+Compares the size and encode/decode cost of the windows sent to the matcher in each wire format:
+ - json: the window event json, with every frame encoded in full.
+ - msgpack-delta: the window event json without its frames, and the frames encoded with msgpack,
+   the first one in full and every other one as the delta from its previous frame.
+The windows are made of consecutive frames of a video, where most objects stay in the scene (with
+jittering bounding boxes and confidences) and objects occasionally enter or leave it.
+"""
+import argparse
+import json
+import random
+import time
+
+from window_manager.wire_formats import decode_window_msg, encode_window_msg
+
+
+def make_node(object_id, label):
+    return [
+        object_id,
+        {
+            'label': label,
+            'confidence': round(random.uniform(0.5, 1), 2),
+            'bounding_box': [random.randint(0, 600), random.randint(0, 440), 40, 40],
+            'color': random.choice(['blue', 'white', 'red']),
+        }
+    ]
+
+
+def jitter_node(node):
+    attributes = dict(node[1])
+    attributes['confidence'] = round(min(1, max(0.5, attributes['confidence'] + random.uniform(-0.05, 0.05))), 2)
+    attributes['bounding_box'] = [value + random.randint(-3, 3) for value in attributes['bounding_box']]
+    return [node[0], attributes]
+
+
+def make_window_frames(num_frames, num_objects, change_probability):
+    nodes = [make_node(f'object-{n}', random.choice(['car', 'person', 'bus'])) for n in range(num_objects)]
+    next_object_index = num_objects
+    frames = []
+    for index in range(num_frames):
+        nodes = [jitter_node(node) for node in nodes]
+        if random.random() < change_probability:
+            # an object leaves the scene and a new one enters it
+            nodes.pop(random.randrange(len(nodes)))
+            nodes.append(make_node(f'object-{next_object_index}', random.choice(['car', 'person', 'bus'])))
+            next_object_index += 1
+        edges = [[nodes[n][0], nodes[n + 1][0], {'relation': 'near'}] for n in range(0, len(nodes) - 1, 2)]
+        frames.append({
+            'id': f'event-{index}',
+            'publisher_id': 'publisher-1',
+            'buffer_stream_key': 'buffer-1',
+            'query_ids': ['query-1'],
+            'timestamp': 1600000000 + index / 30,
+            'vekg': {'nodes': nodes, 'edges': edges},
+        })
+    return frames
+
+
+def encode_json_msg(event_data):
+    return {'event': json.dumps(event_data)}
+
+
+def get_msg_size(event_msg):
+    return sum(len(value) for value in event_msg.values())
+
+
+def measure(function, argument, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(argument)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, nargs='+', default=[10, 30, 100])
+    parser.add_argument('--objects', type=int, default=20)
+    parser.add_argument('--change-probability', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    random.seed(0)
+
+    print(
+        f'{"frames":>7} {"json KB":>9} {"delta KB":>9} {"ratio":>6} '
+        f'{"json enc us":>12} {"delta enc us":>13} {"json dec us":>12} {"delta dec us":>13}'
+    )
+    for num_frames in args.frames:
+        frames = make_window_frames(num_frames, args.objects, args.change_probability)
+        event_data = {'id': 'window-1', 'query_id': 'query-1', 'vekg_stream': frames}
+        json_msg = encode_json_msg(event_data)
+        delta_msg = encode_window_msg(event_data)
+        assert decode_window_msg(delta_msg) == decode_window_msg(json_msg)
+        json_size = get_msg_size(json_msg)
+        delta_size = get_msg_size(delta_msg)
+        json_encode = measure(encode_json_msg, event_data, args.repeat)
+        delta_encode = measure(encode_window_msg, event_data, args.repeat)
+        json_decode = measure(decode_window_msg, json_msg, args.repeat)
+        delta_decode = measure(decode_window_msg, delta_msg, args.repeat)
+        print(
+            f'{num_frames:>7} {json_size / 1024:>9.1f} {delta_size / 1024:>9.1f} {json_size / delta_size:>5.1f}x '
+            f'{json_encode * 1e6:>12.0f} {delta_encode * 1e6:>13.0f} '
+            f'{json_decode * 1e6:>12.0f} {delta_decode * 1e6:>13.0f}'
+        )
+
+
+if __name__ == '__main__':
+    main()
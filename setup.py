@@ -7,5 +7,12 @@ setup(
     author='Felipe Arruda Pontes',
     author_email='felipe.arruda.pontes@insight-centre.org',
     packages=['window_manager'],
+    # redis.asyncio is used by the asyncio run mode
+    install_requires=['redis>=4.2'],
+    # optional dependencies: the "columnar" window aggregation and the "msgpack-delta" window wire format
+    extras_require={
+        'columnar': ['numpy>=1.19'],
+        'msgpack': ['msgpack>=1.0'],
+    },
     zip_safe=False
 )
@@ -0,0 +1,63 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import AsyncMock, MagicMock
+
+from redis.exceptions import ResponseError
+
+from window_manager.async_streams import AsyncConsumerGroupStream, AsyncStreamWriter
+
+
+def run_coroutine(coroutine):
+    # asyncio.run would unset the current event loop, which the (jaeger) tracers need when closed
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class AsyncConsumerGroupStreamTestCase(TestCase):
+    def setUp(self):
+        self.redis_client = MagicMock()
+        self.redis_client.xgroup_create = AsyncMock()
+        self.redis_client.xreadgroup = AsyncMock()
+        self.redis_client.xack = AsyncMock()
+        self.stream = AsyncConsumerGroupStream(self.redis_client, ['wm-data'], group_name='cg-wm-data')
+
+    def test_create_group_ignores_existing_group(self):
+        self.redis_client.xgroup_create.side_effect = ResponseError('BUSYGROUP Consumer Group name already exists')
+        run_coroutine(self.stream.create_group())
+        self.redis_client.xgroup_create.assert_called_once_with('wm-data', 'cg-wm-data', id='$', mkstream=True)
+
+    def test_create_group_raises_other_errors(self):
+        self.redis_client.xgroup_create.side_effect = ResponseError('WRONGTYPE')
+        with self.assertRaises(ResponseError):
+            run_coroutine(self.stream.create_group())
+
+    def test_read_events_uses_same_consumer_as_thread_mode(self):
+        self.redis_client.xreadgroup.return_value = [[b'wm-data', [(b'1-0', {b'event': b'{}'})]]]
+        event_list = run_coroutine(self.stream.read_events(count=10, block=5))
+        self.assertListEqual([(b'1-0', {b'event': b'{}'})], event_list)
+        self.redis_client.xreadgroup.assert_called_once_with(
+            'cg-wm-data', 'cg-wm-data.c1', {'wm-data': '>'}, count=10, block=5
+        )
+
+    def test_read_events_without_events(self):
+        self.redis_client.xreadgroup.return_value = None
+        self.assertListEqual([], run_coroutine(self.stream.read_events()))
+
+    def test_ack_all_events_at_once(self):
+        run_coroutine(self.stream.ack(b'1-0', b'2-0'))
+        self.redis_client.xack.assert_called_once_with('wm-data', 'cg-wm-data', b'1-0', b'2-0')
+
+
+class AsyncStreamWriterTestCase(TestCase):
+    def test_write_events_in_a_pipeline(self):
+        redis_client = MagicMock()
+        pipeline = redis_client.pipeline.return_value
+        pipeline.execute = AsyncMock(return_value=[b'1-0', b'2-0'])
+        writer = AsyncStreamWriter(redis_client)
+        result = run_coroutine(writer.write_events('ma-data', [{'event': '1'}, {'event': '2'}], maxlen=10))
+        self.assertListEqual([b'1-0', b'2-0'], result)
+        pipeline.xadd.assert_any_call('ma-data', {'event': '1'}, maxlen=10)
+        pipeline.xadd.assert_any_call('ma-data', {'event': '2'}, maxlen=10)
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from event_service_utils.tests.mocked_streams import MockedStreamAndConsumer
+
+from window_manager.backpressure import BackpressureStream, SpillFile, get_stream_backlog
+
+
+class BackpressureStreamTestCase(TestCase):
+    def setUp(self):
+        self.stream = MockedStreamAndConsumer('ma-data', [])
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def create_backpressure_stream(self, action, **kwargs):
+        spill_path = os.path.join(self.tmp_dir, 'spill.jsonl')
+        return BackpressureStream(
+            self.stream, max_backlog=4, action=action, check_interval=0, resume_ratio=0.5, spill_path=spill_path,
+            **kwargs
+        )
+
+    def make_msgs(self, indexes):
+        return [{'event': f'{{"id": "window-{index}"}}'} for index in indexes]
+
+    def consume(self, count):
+        del self.stream.mocked_values[:count]
+
+    def test_pause_keeps_writing_and_pauses_intake_until_under_resume_ratio(self):
+        backpressure_stream = self.create_backpressure_stream('pause')
+        self.assertFalse(backpressure_stream.is_intake_paused())
+        backpressure_stream.write_events(*self.make_msgs(range(4)))
+        self.assertTrue(backpressure_stream.is_intake_paused())
+        backpressure_stream.write_events(*self.make_msgs(range(4, 5)))
+        self.assertEqual(5, len(self.stream.mocked_values))
+        self.consume(3)
+        self.assertTrue(backpressure_stream.is_intake_paused())
+        self.consume(1)
+        self.assertFalse(backpressure_stream.is_intake_paused())
+
+    def test_trim_drops_the_oldest_events(self):
+        metrics = MagicMock()
+        backpressure_stream = self.create_backpressure_stream('trim', metrics=metrics)
+        backpressure_stream.write_events(*self.make_msgs(range(6)))
+        backpressure_stream.check()
+        self.assertListEqual(self.make_msgs(range(2, 6)), self.stream.mocked_values)
+        self.assertFalse(backpressure_stream.is_intake_paused())
+        metrics.output_trimmed_events.labels('ma-data').inc.assert_called_once_with(2)
+
+    def test_spill_writes_to_disk_and_replays_in_order_when_there_is_room(self):
+        backpressure_stream = self.create_backpressure_stream('spill')
+        backpressure_stream.write_events(*self.make_msgs(range(4)))
+        backpressure_stream.write_events(*self.make_msgs(range(4, 7)))
+        self.assertEqual(4, len(self.stream.mocked_values))
+        self.assertEqual(3, backpressure_stream.spilled_events_count)
+
+        self.consume(3)
+        backpressure_stream.write_events(*self.make_msgs(range(7, 8)))
+        self.assertListEqual(self.make_msgs([3, 4]), self.stream.mocked_values)
+        # the new event is spilled after the ones not replayed yet
+        self.assertEqual(3, backpressure_stream.spilled_events_count)
+
+        self.consume(2)
+        backpressure_stream.check()
+        self.assertListEqual(self.make_msgs([5, 6]), self.stream.mocked_values)
+        self.consume(2)
+        backpressure_stream.check()
+        self.assertListEqual(self.make_msgs([7]), self.stream.mocked_values)
+        self.assertEqual(0, backpressure_stream.spilled_events_count)
+
+    def test_invalid_actions_are_rejected(self):
+        with self.assertRaises(ValueError):
+            BackpressureStream(self.stream, max_backlog=4, action='block')
+        with self.assertRaises(ValueError):
+            BackpressureStream(self.stream, max_backlog=4, action='spill')
+
+
+class SpillFileTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'spill.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pending_events_are_read_after_a_restart(self):
+        SpillFile(self.path).append([{'event': '1'}, {'event': '2'}])
+        spill_file = SpillFile(self.path)
+        self.assertEqual(2, len(spill_file))
+        self.assertListEqual([{'event': '1'}], spill_file.read(1))
+        self.assertListEqual([{'event': '2'}], spill_file.read(5))
+        self.assertEqual(0, os.path.getsize(self.path))
+
+    def test_read_events_are_not_read_again_after_a_restart(self):
+        spill_file = SpillFile(self.path)
+        spill_file.append([{'event': '1'}, {'event': '2'}, {'event': '3'}])
+        self.assertListEqual([{'event': '1'}], spill_file.read(1))
+        spill_file = SpillFile(self.path)
+        self.assertEqual(2, len(spill_file))
+        self.assertListEqual([{'event': '2'}, {'event': '3'}], spill_file.read(5))
+        self.assertFalse(os.path.exists(f'{self.path}.offset'))
+        spill_file.append([{'event': '4'}])
+        self.assertListEqual([{'event': '4'}], SpillFile(self.path).read(5))
+
+    def test_offset_past_the_end_of_the_file_is_reset(self):
+        SpillFile(self.path).append([{'event': '1'}])
+        with open(f'{self.path}.offset', 'w') as offset_file:
+            offset_file.write('1000')
+        self.assertListEqual([{'event': '1'}], SpillFile(self.path).read(5))
+
+    def test_binary_fields_are_kept(self):
+        event_msg = {'event': '{"id": "window-1"}', 'vekg_stream': b'\x94\x01\x90\xc0\x90'}
+        SpillFile(self.path).append([event_msg])
+        self.assertListEqual([event_msg], SpillFile(self.path).read(1))
+
+
+class StreamBacklogTestCase(TestCase):
+    def test_uses_the_slowest_consumer_group_lag(self):
+        stream = MagicMock(key='ma-data')
+        stream.redis_db.xinfo_groups.return_value = [{'lag': 3, 'pending': 2}, {'lag': 10, 'pending': 1}]
+        self.assertEqual(11, get_stream_backlog(stream))
+
+    def test_uses_the_stream_length_without_consumer_groups_lag(self):
+        stream = MagicMock(key='ma-data')
+        stream.redis_db.xinfo_groups.return_value = []
+        stream.redis_db.xlen.return_value = 7
+        self.assertEqual(7, get_stream_backlog(stream))
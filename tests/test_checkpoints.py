@@ -0,0 +1,112 @@
+import json
+import shutil
+import tempfile
+import zlib
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from window_manager.checkpoints import (
+    FileCheckpointStorage,
+    RedisCheckpointStorage,
+    WindowStateCheckpointer,
+    create_checkpoint_storage,
+    decode_json_state,
+    encode_json_state,
+)
+from window_manager.lazy_events import LazyVEKGEvent, parse_routing_fields
+
+
+class WindowStateCheckpointerTestCase(TestCase):
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.storage = FileCheckpointStorage(self.checkpoint_dir)
+        self.checkpointer = WindowStateCheckpointer(self.storage, max_deltas=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def make_checkpoint(self, last_event_id, queries, bufferstream_states, removed_window_spec_keys=()):
+        return {
+            'last_event_id': last_event_id,
+            'queries': queries,
+            'removed_window_spec_keys': list(removed_window_spec_keys),
+            'controller_states': {window_spec_key: None for window_spec_key in bufferstream_states},
+            'bufferstream_states': bufferstream_states,
+        }
+
+    def test_load_without_checkpoints_returns_none(self):
+        self.assertIsNone(self.checkpointer.load())
+
+    def test_first_checkpoint_is_full_and_deltas_are_written_until_max_deltas(self):
+        self.assertTrue(self.checkpointer.needs_full_checkpoint())
+        self.assertEqual('000000000001-full', self.checkpointer.write(self.make_checkpoint('1-0', {}, {}), True))
+        self.assertFalse(self.checkpointer.needs_full_checkpoint())
+        self.assertEqual('000000000002-delta', self.checkpointer.write(self.make_checkpoint('2-0', {}, {}), False))
+        self.checkpointer.write(self.make_checkpoint('3-0', {}, {}), False)
+        self.assertTrue(self.checkpointer.needs_full_checkpoint())
+
+    def test_full_checkpoint_removes_previous_checkpoints(self):
+        self.checkpointer.write(self.make_checkpoint('1-0', {}, {}), True)
+        self.checkpointer.write(self.make_checkpoint('2-0', {}, {}), False)
+        self.checkpointer.write(self.make_checkpoint('3-0', {}, {}), True)
+        self.assertListEqual(['000000000003-full'], self.storage.list_names())
+
+    def test_load_applies_deltas_over_last_full_checkpoint(self):
+        queries = {'q1': 'spec1', 'q2': 'spec2'}
+        self.checkpointer.write(
+            self.make_checkpoint('1-0', queries, {'spec1': {'a': [1], 'b': [2]}, 'spec2': {'c': [3]}}), True
+        )
+        self.checkpointer.write(self.make_checkpoint('2-0', queries, {'spec1': {'a': [1, 4], 'b': None}}), False)
+        self.checkpointer.write(
+            self.make_checkpoint('3-0', {'q1': 'spec1'}, {}, removed_window_spec_keys=['spec2']), False
+        )
+
+        checkpointer = WindowStateCheckpointer(FileCheckpointStorage(self.checkpoint_dir), max_deltas=2)
+        checkpoint = checkpointer.load()
+        self.assertEqual('3-0', checkpoint['last_event_id'])
+        self.assertDictEqual({'q1': 'spec1'}, checkpoint['queries'])
+        self.assertDictEqual({'spec1': {'a': [1, 4]}}, checkpoint['bufferstream_states'])
+        self.assertEqual(3, checkpointer.sequence)
+        self.assertTrue(checkpointer.needs_full_checkpoint())
+
+    def test_file_storage_does_not_list_temporary_files(self):
+        open(f'{self.checkpoint_dir}/000000000001-full.tmp', 'wb').close()
+        self.assertListEqual([], self.storage.list_names())
+
+
+class JsonStateTestCase(TestCase):
+    def test_lazy_events_are_kept_as_raw_json(self):
+        raw_json = '{"id": "event-id-1", "buffer_stream_key": "a", "vekg": {"nodes": []}}'
+        lazy_event = parse_routing_fields(raw_json, ['buffer_stream_key', 'query_ids'])
+        decoded_event = parse_routing_fields(raw_json, ['buffer_stream_key'])
+        decoded_event.decode()
+        state = {'events': [lazy_event, decoded_event, {'id': 'event-id-2'}], 'watermark': 1}
+
+        decoded_state = decode_json_state(encode_json_state(state))
+        self.assertEqual(1, decoded_state['watermark'])
+        restored_lazy_event, restored_decoded_event, event = decoded_state['events']
+        self.assertIsInstance(restored_lazy_event, LazyVEKGEvent)
+        self.assertDictEqual({'buffer_stream_key': 'a'}, dict(restored_lazy_event))
+        self.assertNotIn('query_ids', restored_lazy_event)
+        self.assertFalse(restored_lazy_event.is_decoded)
+        self.assertDictEqual({'nodes': []}, restored_lazy_event['vekg'])
+        self.assertEqual('event-id-1', restored_decoded_event['id'])
+        self.assertDictEqual({'id': 'event-id-2'}, event)
+
+    def test_other_format_versions_are_rejected(self):
+        data = zlib.compress(json.dumps({'version': 0, 'state': {}}).encode('utf-8'))
+        with self.assertRaises(ValueError):
+            decode_json_state(data)
+
+
+class CreateCheckpointStorageTestCase(TestCase):
+    def test_uses_redis_when_no_path_is_given(self):
+        stream_factory = MagicMock()
+        storage = create_checkpoint_storage(stream_factory, key='wm-data-checkpoint', path='')
+        self.assertIsInstance(storage, RedisCheckpointStorage)
+        storage.write('000000000001-full', b'data')
+        stream_factory.redis_db.hset.assert_called_once_with('wm-data-checkpoint', '000000000001-full', b'data')
+
+    def test_raises_without_path_or_redis(self):
+        with self.assertRaises(RuntimeError):
+            create_checkpoint_storage(object(), key='wm-data-checkpoint')
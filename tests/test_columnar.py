@@ -0,0 +1,96 @@
+import pickle
+from unittest import TestCase, skipUnless
+
+from window_manager.columnar import ColumnarWindow
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def make_event(index, nodes):
+    return {
+        'id': f'event-id-{index}',
+        'vekg': {'nodes': nodes, 'edges': [['car1', 'person1', {'relation': 'near'}]]},
+        'query_ids': ['query_id1'],
+        'buffer_stream_key': '12345',
+        'timestamp': index,
+    }
+
+
+@skipUnless(numpy, 'numpy is not installed')
+class ColumnarWindowTestCase(TestCase):
+    def setUp(self):
+        self.window = ColumnarWindow(['confidence', 'bounding_box'], frames_capacity=2)
+        self.event_data1 = make_event(1, [
+            ['car1', {'label': 'car', 'confidence': 0.9, 'bounding_box': [1, 2, 3, 4]}],
+            ['person1', {'label': 'person', 'confidence': 0.5}],
+        ])
+        self.event_data2 = make_event(2, [['car1', {'label': 'car', 'confidence': 0.8, 'bounding_box': [2, 3, 4, 5]}]])
+
+    def test_numeric_attributes_are_extracted_to_columns(self):
+        self.window.append(self.event_data1)
+        self.window.append(self.event_data2)
+        self.assertEqual(2, len(self.window))
+        self.assertListEqual([0, 0, 1], self.window.get_frame_indexes().tolist())
+        self.assertListEqual([0.9, 0.5, 0.8], self.window.get_column('confidence').tolist())
+        bounding_boxes = self.window.get_column('bounding_box')
+        self.assertEqual((3, 4), bounding_boxes.shape)
+        self.assertTrue(numpy.isnan(bounding_boxes[1]).all())
+        self.assertListEqual(
+            [['car1', {'label': 'car'}], ['person1', {'label': 'person'}]], self.window[0]['vekg']['nodes']
+        )
+        self.assertListEqual(self.event_data1['vekg']['edges'], self.window[0]['vekg']['edges'])
+
+    def test_arrays_are_preallocated_and_grow(self):
+        self.window.append(self.event_data1)
+        self.assertEqual(4, self.window.rows_capacity)
+        self.window.append(self.event_data1)
+        self.window.append(self.event_data1)
+        self.assertEqual(8, self.window.rows_capacity)
+        self.assertListEqual([0.9, 0.5] * 3, self.window.get_column('confidence').tolist())
+
+    def test_values_that_dont_fit_are_kept_in_the_frame(self):
+        self.window.append(self.event_data1)
+        self.window.append(make_event(2, [['car1', {'confidence': 'high', 'bounding_box': [1, 2]}]]))
+        self.assertTrue(numpy.isnan(self.window.get_column('confidence')[2]))
+        self.assertDictEqual({'confidence': 'high', 'bounding_box': [1, 2]}, self.window[1]['vekg']['nodes'][0][1])
+
+    def test_frame_strings_are_interned(self):
+        self.window.append(make_event(1, [[''.join(['car', '1']), {'label': ''.join(['c', 'ar'])}]]))
+        self.window.append(make_event(2, [[''.join(['car', '1']), {'label': ''.join(['c', 'ar'])}]]))
+        node1, node2 = self.window[0]['vekg']['nodes'][0], self.window[1]['vekg']['nodes'][0]
+        self.assertIs(node1[0], node2[0])
+        self.assertIs(node1[1]['label'], node2[1]['label'])
+        self.assertIs(self.window[0]['vekg']['edges'][0][0], self.window[1]['vekg']['edges'][0][0])
+
+    def test_to_dict_has_the_frames_and_the_columns(self):
+        self.window.append(self.event_data1)
+        self.assertDictEqual(
+            {
+                'frames': [{
+                    'id': 'event-id-1',
+                    'buffer_stream_key': '12345',
+                    'timestamp': 1,
+                    'vekg': {
+                        'nodes': [['car1', {'label': 'car'}], ['person1', {'label': 'person'}]],
+                        'edges': [['car1', 'person1', {'relation': 'near'}]],
+                    },
+                }],
+                'frame_indexes': [0, 0],
+                'columns': {
+                    'confidence': [0.9, 0.5],
+                    'bounding_box': [[1.0, 2.0, 3.0, 4.0], [None, None, None, None]],
+                },
+            },
+            self.window.to_dict()
+        )
+
+    def test_copy_and_pickle(self):
+        self.window.append(self.event_data1)
+        window_copy = self.window.copy()
+        window_copy.append(self.event_data2)
+        self.assertEqual(1, len(self.window))
+        self.assertEqual(self.window, pickle.loads(pickle.dumps(self.window)))
+        self.assertNotEqual(self.window, window_copy)
@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+from window_manager.deadlines import DeadlineHeap
+
+
+class DeadlineHeapTestCase(TestCase):
+    def setUp(self):
+        self.deadlines = DeadlineHeap()
+
+    def test_pop_expired_returns_keys_in_deadline_order(self):
+        self.deadlines.schedule('b', 2)
+        self.deadlines.schedule('a', 1)
+        self.deadlines.schedule('c', 3)
+        self.assertListEqual(['a', 'b'], self.deadlines.pop_expired(2))
+        self.assertListEqual(['c'], self.deadlines.pop_expired(10))
+        self.assertEqual(0, len(self.deadlines))
+
+    def test_pop_expired_ignores_cancelled_keys(self):
+        self.deadlines.schedule('a', 1)
+        self.deadlines.schedule('b', 1)
+        self.deadlines.cancel('a')
+        self.assertListEqual(['b'], self.deadlines.pop_expired(1))
+        self.assertNotIn('a', self.deadlines)
+
+    def test_schedule_again_replaces_previous_deadline(self):
+        self.deadlines.schedule('a', 1)
+        self.deadlines.schedule('a', 5)
+        self.assertListEqual([], self.deadlines.pop_expired(4))
+        self.assertEqual(5, self.deadlines.next_deadline())
+        self.assertListEqual(['a'], self.deadlines.pop_expired(5))
+
+    def test_next_deadline_is_none_when_empty(self):
+        self.assertIsNone(self.deadlines.next_deadline())
+        self.deadlines.schedule('a', 1)
+        self.deadlines.cancel('a')
+        self.assertIsNone(self.deadlines.next_deadline())
+
+    def test_rescheduling_many_times_keeps_heap_bounded(self):
+        for deadline in range(1000):
+            self.deadlines.schedule('a', deadline)
+        self.assertLess(len(self.deadlines.heap), 100)
+        self.assertEqual(999, self.deadlines.next_deadline())
@@ -0,0 +1,65 @@
+import json
+import pickle
+from unittest import TestCase
+
+from window_manager.lazy_events import LazyVEKGEvent, parse_routing_fields
+
+
+class ParseRoutingFieldsTestCase(TestCase):
+    def setUp(self):
+        self.event_data = {
+            'id': 'event-id-1',
+            'vekg': {'nodes': [['car1', {'label': 'car', 'color': 'blue'}]], 'edges': []},
+            'query_ids': ['query_id1', 'query_id2'],
+            'buffer_stream_key': '12345',
+        }
+        self.event_json = json.dumps(self.event_data)
+        self.fields = ['id', 'query_ids', 'buffer_stream_key', 'tracer']
+
+    def test_only_routing_fields_are_decoded(self):
+        event_data = parse_routing_fields(self.event_json, self.fields)
+        self.assertIsInstance(event_data, LazyVEKGEvent)
+        self.assertFalse(event_data.is_decoded)
+        self.assertDictEqual(
+            {'id': 'event-id-1', 'query_ids': ['query_id1', 'query_id2'], 'buffer_stream_key': '12345'},
+            dict(event_data)
+        )
+        self.assertEqual(self.event_json, event_data.raw_json)
+
+    def test_accepts_bytes(self):
+        event_data = parse_routing_fields(self.event_json.encode('utf-8'), self.fields)
+        self.assertEqual('12345', event_data['buffer_stream_key'])
+        self.assertEqual(self.event_json, event_data.raw_json)
+
+    def test_absent_fields_dont_decode_event(self):
+        event_data = parse_routing_fields(self.event_json, self.fields)
+        self.assertEqual({}, event_data.get('tracer', {}))
+        self.assertNotIn('tracer', event_data)
+        self.assertFalse(event_data.is_decoded)
+
+    def test_other_fields_are_decoded_on_first_access(self):
+        event_data = parse_routing_fields(self.event_json, self.fields)
+        self.assertEqual(self.event_data['vekg'], event_data['vekg'])
+        self.assertTrue(event_data.is_decoded)
+        self.assertIn('vekg', event_data)
+        with self.assertRaises(KeyError):
+            event_data['not_there']
+
+    def test_fully_decodes_if_routing_field_is_ambiguous(self):
+        self.event_data['vekg']['nodes'][0][1]['id'] = 'nested-id'
+        event_data = parse_routing_fields(json.dumps(self.event_data), self.fields)
+        self.assertTrue(event_data.is_decoded)
+        self.assertEqual('event-id-1', event_data['id'])
+
+    def test_field_names_inside_string_values_are_not_confused_with_keys(self):
+        self.event_data['vekg']['nodes'][0][1]['label'] = 'query_ids'
+        event_data = parse_routing_fields(json.dumps(self.event_data), self.fields)
+        self.assertFalse(event_data.is_decoded)
+        self.assertListEqual(['query_id1', 'query_id2'], event_data['query_ids'])
+
+    def test_pickle_keeps_raw_json_and_routing_fields(self):
+        event_data = parse_routing_fields(self.event_json, self.fields)
+        unpickled = pickle.loads(pickle.dumps(event_data))
+        self.assertEqual(self.event_json, unpickled.raw_json)
+        self.assertDictEqual(dict(event_data), dict(unpickled))
+        self.assertFalse(unpickled.is_decoded)
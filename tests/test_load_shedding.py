@@ -0,0 +1,75 @@
+from unittest import TestCase
+
+from window_manager.load_shedding import LoadShedder, get_similarity, get_vekg_signature
+
+
+class LoadShedderTestCase(TestCase):
+    def setUp(self):
+        self.load_shedder = LoadShedder(
+            ['sample', 'coalesce', 'drop_low_priority'],
+            max_input_lag=10, max_event_processing_secs=0.01, sample_every=2, low_priority_query_ids=['query_id2']
+        )
+
+    def make_event(self, index, node_ids, buffer_stream_key='12345'):
+        return {
+            'id': f'event-id-{index}',
+            'vekg': {'nodes': [[node_id, {}] for node_id in node_ids], 'edges': []},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+        }
+
+    def test_overload_starts_over_a_limit_and_ends_under_the_recovery_ratio(self):
+        self.assertFalse(self.load_shedder.update(5, 0.001))
+        self.assertTrue(self.load_shedder.update(5, 0.02))
+        self.assertTrue(self.load_shedder.is_overloaded)
+        self.assertFalse(self.load_shedder.update(6, None))
+        self.assertTrue(self.load_shedder.is_overloaded)
+        self.assertTrue(self.load_shedder.update(4, None))
+        self.assertFalse(self.load_shedder.is_overloaded)
+
+    def test_unknown_policies_are_rejected(self):
+        with self.assertRaises(ValueError):
+            LoadShedder(['random'])
+
+    def test_frames_are_sampled_per_buffer_stream(self):
+        load_shedder = LoadShedder(['sample'], sample_every=3)
+        policies = [
+            load_shedder.get_frame_shedding_policy(self.make_event(index, [index], buffer_stream_key))
+            for index in range(4) for buffer_stream_key in ['a', 'b']
+        ]
+        self.assertListEqual(
+            [None, None, 'sample', 'sample', 'sample', 'sample', None, None], policies
+        )
+        self.assertDictEqual({'a': 2, 'b': 2}, load_shedder.bufferstream_shed_frames)
+
+    def test_similar_frames_are_coalesced(self):
+        load_shedder = LoadShedder(['coalesce'], coalesce_similarity=0.75)
+        policies = [
+            load_shedder.get_frame_shedding_policy(self.make_event(index, node_ids))
+            for index, node_ids in enumerate([['a', 'b', 'c', 'd'], ['a', 'b', 'c', 'd'], ['a', 'b', 'c'], ['a', 'b']])
+        ]
+        self.assertListEqual([None, 'coalesce', 'coalesce', None], policies)
+
+    def test_window_shed_frames_are_the_ones_since_the_previous_window(self):
+        load_shedder = LoadShedder(['sample'], sample_every=2)
+        for index in range(4):
+            load_shedder.get_frame_shedding_policy(self.make_event(index, []))
+        window = [self.make_event(0, [])]
+        self.assertEqual(2, load_shedder.get_window_shed_frames('controller', window))
+        self.assertEqual(0, load_shedder.get_window_shed_frames('controller', window))
+        self.assertEqual(2, load_shedder.get_window_shed_frames('other_controller', window))
+
+    def test_low_priority_queries_are_only_dropped_while_overloaded(self):
+        self.assertListEqual([], self.load_shedder.get_dropped_query_ids(['query_id1', 'query_id2']))
+        self.load_shedder.update(20, None)
+        self.assertListEqual(['query_id2'], self.load_shedder.get_dropped_query_ids(['query_id1', 'query_id2']))
+
+
+class VEKGSimilarityTestCase(TestCase):
+    def test_signature_has_the_node_ids_and_edges(self):
+        event_data = {'vekg': {'nodes': [['car1', {}], ['person1', {}]], 'edges': [['car1', 'person1', {}]]}}
+        self.assertSetEqual({'car1', 'person1', ('car1', 'person1')}, get_vekg_signature(event_data))
+
+    def test_similarity_of_empty_signatures(self):
+        self.assertEqual(1.0, get_similarity(set(), set()))
+        self.assertEqual(0.5, get_similarity({1, 2}, {2}))
@@ -0,0 +1,83 @@
+import pickle
+from unittest import TestCase
+
+from window_manager.merged_graphs import MergedGraphWindow
+
+
+class MergedGraphWindowTestCase(TestCase):
+    def setUp(self):
+        self.window = MergedGraphWindow()
+        self.event_data1 = {
+            'id': 'event-id-1',
+            'vekg': {
+                'nodes': [['car1', {'label': 'car', 'color': 'blue'}], ['person1', {'label': 'person'}]],
+                'edges': [['car1', 'person1', {'relation': 'near'}]],
+            },
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': '12345',
+            'timestamp': 1,
+        }
+        self.event_data2 = {
+            'id': 'event-id-2',
+            'vekg': {
+                'nodes': [['car1', {'label': 'car', 'color': 'red'}], ['dog1', {'label': 'dog'}]],
+                'edges': [['car1', 'person1', {'relation': 'far'}]],
+            },
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': '12345',
+            'timestamp': 2,
+        }
+
+    def test_nodes_are_deduplicated_by_id_with_first_and_last_frames(self):
+        self.window.append(self.event_data1)
+        self.window.append(self.event_data2)
+        self.assertDictEqual(
+            {
+                'car1': ['car1', {'label': 'car', 'color': 'red'}, 0, 1],
+                'person1': ['person1', {'label': 'person'}, 0, 0],
+                'dog1': ['dog1', {'label': 'dog'}, 1, 1],
+            },
+            self.window.nodes
+        )
+        self.assertDictEqual(
+            {('car1', 'person1'): ['car1', 'person1', {'relation': 'far'}, 0, 1]},
+            self.window.edges
+        )
+
+    def test_only_the_routing_fields_of_the_frames_are_kept(self):
+        self.window.append(self.event_data1)
+        self.assertEqual(1, len(self.window))
+        self.assertDictEqual(
+            {'id': 'event-id-1', 'buffer_stream_key': '12345', 'timestamp': 1, 'query_ids': ['query_id1']},
+            self.window[0]
+        )
+
+    def test_to_dict_has_the_frames_and_the_merged_graph(self):
+        self.window.append(self.event_data1)
+        self.window.append(self.event_data2)
+        self.assertDictEqual(
+            {
+                'frames': [
+                    {'id': 'event-id-1', 'buffer_stream_key': '12345', 'timestamp': 1},
+                    {'id': 'event-id-2', 'buffer_stream_key': '12345', 'timestamp': 2},
+                ],
+                'nodes': [
+                    ['car1', {'label': 'car', 'color': 'red'}, 0, 1],
+                    ['person1', {'label': 'person'}, 0, 0],
+                    ['dog1', {'label': 'dog'}, 1, 1],
+                ],
+                'edges': [['car1', 'person1', {'relation': 'far'}, 0, 1]],
+            },
+            self.window.to_dict()
+        )
+
+    def test_copy_is_not_changed_by_new_frames(self):
+        self.window.append(self.event_data1)
+        window_copy = self.window.copy()
+        self.window.append(self.event_data2)
+        self.assertEqual(1, len(window_copy))
+        self.assertEqual(['car1', {'label': 'car', 'color': 'blue'}, 0, 0], window_copy.nodes['car1'])
+
+    def test_can_be_pickled(self):
+        self.window.append(self.event_data1)
+        self.assertEqual(self.window, pickle.loads(pickle.dumps(self.window)))
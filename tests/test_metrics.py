@@ -0,0 +1,127 @@
+import json
+import urllib.request
+from unittest import TestCase
+
+from window_manager.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    LabeledMetric,
+    MetricsHTTPServer,
+    MetricsRegistry,
+    WindowManagerMetrics,
+    get_stream_event_id_time,
+)
+
+
+class HistogramTestCase(TestCase):
+    def setUp(self):
+        self.histogram = Histogram([1, 5, 10])
+
+    def test_observe_counts_each_value_in_its_bucket(self):
+        for value in [0.5, 1, 3, 7, 100]:
+            self.histogram.observe(value)
+        self.assertListEqual([2, 1, 1, 1], self.histogram.bucket_counts)
+        self.assertEqual(5, self.histogram.count)
+        self.assertEqual(111.5, self.histogram.sum)
+
+    def test_should_sample_once_every_sample_every_calls(self):
+        histogram = Histogram([1], sample_every=3)
+        samples = [histogram.should_sample() for _ in range(7)]
+        self.assertListEqual([True, False, False, True, False, False, True], samples)
+
+    def test_call_sampled_only_observes_sampled_calls(self):
+        histogram = Histogram([1], sample_every=2)
+        results = [histogram.call_sampled(lambda x: x * 2, i) for i in range(4)]
+        self.assertListEqual([0, 2, 4, 6], results)
+        self.assertEqual(2, histogram.count)
+
+    def test_samples_have_cumulative_buckets(self):
+        for value in [0.5, 3, 100]:
+            self.histogram.observe(value)
+        samples = self.histogram.get_samples('h', {})
+        self.assertListEqual(
+            [
+                ('h_bucket', {'le': '1'}, 1),
+                ('h_bucket', {'le': '5'}, 2),
+                ('h_bucket', {'le': '10'}, 2),
+                ('h_bucket', {'le': '+Inf'}, 3),
+                ('h_sum', {}, 103.5),
+                ('h_count', {}, 3),
+            ],
+            samples
+        )
+
+
+class MetricsRegistryTestCase(TestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry('wm')
+        self.counter = self.registry.register('events_total', 'Events.', Counter())
+        self.per_query = self.registry.register('windows_total', 'Windows.', LabeledMetric('query_id', Counter))
+
+    def test_render_text_uses_prometheus_format(self):
+        self.counter.inc(3)
+        self.per_query.labels('q"1').inc()
+        self.assertEqual(
+            '# HELP wm_events_total Events.\n'
+            '# TYPE wm_events_total counter\n'
+            'wm_events_total 3\n'
+            '# HELP wm_windows_total Windows.\n'
+            '# TYPE wm_windows_total counter\n'
+            'wm_windows_total{query_id="q\\"1"} 1\n',
+            self.registry.render_text()
+        )
+
+    def test_removed_labels_are_not_rendered(self):
+        self.per_query.labels('q1').inc()
+        self.per_query.remove('q1')
+        self.assertDictEqual({'events_total': 0, 'windows_total': {}}, self.registry.get_snapshot())
+
+    def test_replace_drops_the_previous_label_values(self):
+        gauges = LabeledMetric('buffer_stream_key', Gauge)
+        gauges.replace({'a': 1, 'b': 2})
+        gauges.replace({'b': 3})
+        self.assertDictEqual({'b': 3}, gauges.get_snapshot())
+
+
+
+class WindowManagerMetricsTestCase(TestCase):
+    def test_worker_states_are_added_to_the_service_metrics(self):
+        metrics = WindowManagerMetrics()
+        metrics.events_processed.inc(2)
+        worker_metrics = WindowManagerMetrics()
+        worker_metrics.events_processed.inc(3)
+        worker_metrics.windows_emitted.labels('query_id1').inc()
+        worker_metrics.window_fill_seconds.observe(1)
+        metrics.set_worker_state(0, json.loads(json.dumps(worker_metrics.get_state())))
+        # the latest state of a worker replaces its previous one
+        metrics.set_worker_state(0, worker_metrics.get_state())
+        snapshot = metrics.get_snapshot()
+        self.assertEqual(5, snapshot['events_processed_total'])
+        self.assertDictEqual({'query_id1': 1}, snapshot['windows_emitted_total'])
+        self.assertEqual(1, snapshot['window_fill_seconds']['count'])
+        self.assertIn('window_manager_events_processed_total 5\n', metrics.render_text())
+        self.assertEqual(2, metrics.events_processed.value)
+
+class MetricsHTTPServerTestCase(TestCase):
+    def setUp(self):
+        self.metrics = WindowManagerMetrics()
+        self.server = MetricsHTTPServer(self.metrics, port=0, host='127.0.0.1')
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get(self, path):
+        with urllib.request.urlopen(f'http://127.0.0.1:{self.server.port}{path}', timeout=5) as response:
+            return response.read().decode('utf-8')
+
+    def test_serves_metrics_as_text_and_json(self):
+        self.metrics.events_processed.inc(5)
+        self.assertIn('window_manager_events_processed_total 5\n', self.get('/metrics'))
+        self.assertEqual(5, json.loads(self.get('/metrics.json'))['events_processed_total'])
+
+
+class StreamEventIdTimeTestCase(TestCase):
+    def test_returns_the_event_id_time_in_seconds(self):
+        self.assertEqual(1600000000.5, get_stream_event_id_time(b'1600000000500-3'))
@@ -0,0 +1,61 @@
+import json
+from unittest import TestCase
+from unittest.mock import patch, MagicMock
+
+from window_manager.payload_stores import (
+    InMemoryPayloadStore,
+    RedisPayloadStore,
+    create_payload_store,
+)
+
+
+class InMemoryPayloadStoreTestCase(TestCase):
+    def setUp(self):
+        self.payload_store = InMemoryPayloadStore(key_prefix='ma-data-payload', ttl=10)
+
+    def test_get_payload_key_uses_prefix(self):
+        self.assertEqual('ma-data-payload:event-id-1', self.payload_store.get_payload_key('event-id-1'))
+
+    def test_put_many_and_get_many(self):
+        self.payload_store.put_many({'k1': 'v1', 'k2': 'v2'})
+        self.assertListEqual(['v1', None, 'v2'], self.payload_store.get_many(['k1', 'k3', 'k2']))
+
+    @patch('window_manager.payload_stores.time')
+    def test_payloads_are_removed_after_ttl(self, mocked_time):
+        mocked_time.time.return_value = 100
+        self.payload_store.put_many({'k1': 'v1'})
+        mocked_time.time.return_value = 109
+        self.assertListEqual(['v1'], self.payload_store.get_many(['k1']))
+        mocked_time.time.return_value = 110
+        self.assertListEqual([None], self.payload_store.get_many(['k1']))
+        self.assertEqual(0, len(self.payload_store))
+
+    def test_get_window_loads_window_from_refs(self):
+        event_data = {'id': 'event-id-1', 'vekg': {}}
+        self.payload_store.put_many({self.payload_store.get_payload_key('event-id-1'): json.dumps(event_data)})
+        window = self.payload_store.get_window({'key_prefix': 'ma-data-payload', 'event_ids': ['event-id-1']})
+        self.assertListEqual([event_data], window)
+
+
+class RedisPayloadStoreTestCase(TestCase):
+    def test_put_many_uses_single_pipeline_with_ttl(self):
+        redis_db = MagicMock()
+        payload_store = RedisPayloadStore(redis_db=redis_db, key_prefix='prefix', ttl=10)
+        payload_store.put_many({'k1': 'v1', 'k2': 'v2'})
+        pipeline = redis_db.pipeline.return_value
+        self.assertEqual(1, redis_db.pipeline.call_count)
+        pipeline.set.assert_any_call('k1', 'v1', ex=10)
+        pipeline.set.assert_any_call('k2', 'v2', ex=10)
+        pipeline.execute.assert_called_once_with()
+
+
+class CreatePayloadStoreTestCase(TestCase):
+    def test_uses_redis_store_if_stream_factory_has_redis_connection(self):
+        stream_factory = MagicMock()
+        payload_store = create_payload_store(stream_factory, key_prefix='prefix', ttl=10)
+        self.assertIsInstance(payload_store, RedisPayloadStore)
+        self.assertEqual(stream_factory.redis_db, payload_store.redis_db)
+
+    def test_uses_in_memory_store_otherwise(self):
+        payload_store = create_payload_store(object(), key_prefix='prefix', ttl=10)
+        self.assertIsInstance(payload_store, InMemoryPayloadStore)
@@ -0,0 +1,87 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from window_manager.replay import WindowManagerReplay, encode_binary_record, read_log_records
+
+
+def make_query_created_record(query_id, window, time):
+    return {
+        'stream': 'QueryCreated',
+        'time': time,
+        'event': {'id': f'{query_id}-created', 'query_id': query_id, 'parsed_query': {'window': window}},
+    }
+
+
+def make_vekg_record(index, query_ids, time):
+    event_data = {
+        'id': f'event-id-{index}',
+        'vekg': {'nodes': [['car1', {}]], 'edges': []},
+        'query_ids': query_ids,
+        'buffer_stream_key': 'buffer-1',
+    }
+    return {'stream': 'wm-data', 'time': time, 'event': json.dumps(event_data)}
+
+
+class ReadLogRecordsTestCase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.records = [make_vekg_record(index, ['query_id1'], index) for index in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reads_jsonl_logs(self):
+        path = os.path.join(self.tmp_dir, 'log.jsonl')
+        with open(path, 'w') as log_file:
+            log_file.writelines(f'{json.dumps(record)}\n' for record in self.records)
+        self.assertListEqual(self.records, list(read_log_records(path)))
+
+    def test_reads_gzipped_binary_logs(self):
+        path = os.path.join(self.tmp_dir, 'log.bin.gz')
+        with gzip.open(path, 'wb') as log_file:
+            for record in self.records:
+                log_file.write(encode_binary_record(record))
+        self.assertListEqual(self.records, list(read_log_records(path)))
+
+
+class WindowManagerReplayTestCase(TestCase):
+    def setUp(self):
+        self.output_file = io.StringIO()
+        self.records = [
+            make_query_created_record('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}, 0),
+            make_query_created_record('query_id2', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3]}, 0),
+        ]
+        self.records.extend(make_vekg_record(index, ['query_id1', 'query_id2'], index * 0.5) for index in range(7))
+
+    def test_windows_are_written_to_the_output_file(self):
+        window_manager_replay = WindowManagerReplay(output_file=self.output_file, batch_size=4)
+        summary = window_manager_replay.replay(iter(self.records))
+        windows = [json.loads(line) for line in self.output_file.getvalue().splitlines()]
+        self.assertListEqual(
+            [['event-id-0', 'event-id-1'], ['event-id-0', 'event-id-1', 'event-id-2'], ['event-id-2', 'event-id-3']],
+            [[e['id'] for e in window['vekg_stream']] for window in windows[:3]]
+        )
+        self.assertEqual(7, summary['data_events'])
+        self.assertEqual(2, summary['cmd_events'])
+        self.assertEqual(5, summary['windows'])
+        self.assertDictEqual({'query_id1': 3, 'query_id2': 2}, summary['query_windows'])
+        self.assertEqual(3.0, summary['recorded_secs'])
+        self.assertEqual(2, summary['buffered_events'])
+
+    def test_removed_queries_keep_their_windows_in_the_summary(self):
+        self.records.append({'stream': 'QueryRemoved', 'event': {'id': 'removed', 'query_id': 'query_id1'}})
+        summary = WindowManagerReplay().replay(iter(self.records))
+        self.assertDictEqual({'query_id1': 3, 'query_id2': 2}, summary['query_windows'])
+
+    @patch('window_manager.replay.time.sleep')
+    def test_recorded_speed_waits_for_the_recorded_time_of_each_event(self, mocked_sleep):
+        WindowManagerReplay(speed=2).replay(iter(self.records))
+        wait_times = [call[0][0] for call in mocked_sleep.call_args_list]
+        self.assertEqual(6, len(wait_times))
+        self.assertAlmostEqual(1.5, wait_times[-1], places=1)
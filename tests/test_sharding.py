@@ -0,0 +1,38 @@
+from unittest import TestCase
+
+from window_manager.sharding import ConsistentHashRing
+
+
+class ConsistentHashRingTestCase(TestCase):
+    def setUp(self):
+        self.keys = [f'publisher-{i}' for i in range(1000)]
+
+    def test_get_shard_is_deterministic(self):
+        ring = ConsistentHashRing(['shard-1', 'shard-2'])
+        other_ring = ConsistentHashRing(['shard-2', 'shard-1'])
+        for key in self.keys:
+            self.assertEqual(ring.get_shard(key), other_ring.get_shard(key))
+
+    def test_get_shard_without_shards(self):
+        self.assertIsNone(ConsistentHashRing([]).get_shard('publisher-1'))
+
+    def test_keys_are_spread_between_shards(self):
+        ring = ConsistentHashRing(['shard-1', 'shard-2', 'shard-3'])
+        shard_keys_count = {}
+        for key in self.keys:
+            shard_id = ring.get_shard(key)
+            shard_keys_count[shard_id] = shard_keys_count.get(shard_id, 0) + 1
+        self.assertEqual(3, len(shard_keys_count))
+        for keys_count in shard_keys_count.values():
+            self.assertGreater(keys_count, 200)
+
+    def test_adding_a_shard_only_moves_keys_to_the_new_shard(self):
+        ring = ConsistentHashRing(['shard-1', 'shard-2'])
+        new_ring = ConsistentHashRing(['shard-1', 'shard-2', 'shard-3'])
+        moved_keys_count = 0
+        for key in self.keys:
+            if ring.get_shard(key) != new_ring.get_shard(key):
+                self.assertEqual('shard-3', new_ring.get_shard(key))
+                moved_keys_count += 1
+        self.assertGreater(moved_keys_count, 0)
+        self.assertLess(moved_keys_count, 500)
@@ -0,0 +1,79 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from window_manager.stream_utils import (
+    ack_events, get_stream_event_id_key, read_events_with_block, read_pending_events, write_events_pipelined
+)
+
+
+class ReadEventsWithBlockTestCase(TestCase):
+    def test_overrides_stream_block_only_during_the_read(self):
+        stream = MagicMock()
+        stream.block = 0
+        blocks_during_read = []
+
+        def read_events(count):
+            blocks_during_read.append(stream.block)
+            yield ('1-0', {'event': '{}'})
+
+        stream.read_events.side_effect = read_events
+        event_list = read_events_with_block(stream, count=10, block=5)
+        self.assertListEqual([('1-0', {'event': '{}'})], event_list)
+        self.assertListEqual([5], blocks_during_read)
+        self.assertEqual(0, stream.block)
+        stream.read_events.assert_called_once_with(count=10)
+
+    def test_uses_stream_default_block_if_none(self):
+        stream = MagicMock()
+        stream.block = 0
+        stream.read_events.return_value = iter([])
+        self.assertListEqual([], read_events_with_block(stream, count=10))
+        self.assertEqual(0, stream.block)
+
+
+class WriteEventsPipelinedTestCase(TestCase):
+    def test_writes_all_events_in_one_redis_pipeline(self):
+        stream = MagicMock()
+        stream.key = 'ma-data'
+        stream.default_write_kwargs = {'maxlen': 10, 'approximate': False}
+        write_events_pipelined(stream, [{'event': '1'}, {'event': '2'}])
+        pipeline = stream.redis_db.pipeline.return_value
+        self.assertEqual(2, pipeline.xadd.call_count)
+        pipeline.xadd.assert_any_call('ma-data', {'event': '1'}, maxlen=10, approximate=False)
+        pipeline.execute.assert_called_once_with()
+        self.assertFalse(stream.write_events.called)
+
+    def test_uses_write_events_if_stream_has_no_redis_connection(self):
+        stream = MagicMock(spec=['key', 'write_events'])
+        write_events_pipelined(stream, [{'event': '1'}, {'event': '2'}])
+        stream.write_events.assert_called_once_with({'event': '1'}, {'event': '2'})
+
+
+class AckEventsTestCase(TestCase):
+    def test_acks_all_events_at_once_for_consumer_groups(self):
+        stream = MagicMock()
+        stream.key = 'wm-data'
+        ack_events(stream, ['1-0', '2-0'])
+        stream.input_consumer_group.wm_data.ack.assert_called_once_with('1-0', '2-0')
+        self.assertFalse(stream.ack.called)
+
+    def test_acks_each_event_otherwise(self):
+        stream = MagicMock(spec=['key', 'ack'])
+        ack_events(stream, ['1-0', '2-0'])
+        self.assertEqual(2, stream.ack.call_count)
+
+
+class ReadPendingEventsTestCase(TestCase):
+    def test_reads_the_pending_events_of_the_consumer(self):
+        stream = MagicMock()
+        stream.key = 'wm-data'
+        stream.input_consumer_group.wm_data.read.return_value = [('2-0', {'event': '{}'})]
+        self.assertListEqual([('2-0', {'event': '{}'})], read_pending_events(stream, 10, last_event_id='1-0'))
+        stream.input_consumer_group.wm_data.read.assert_called_once_with(count=10, last_id='1-0')
+
+    def test_streams_without_consumer_group_have_no_pending_events(self):
+        self.assertListEqual([], read_pending_events(MagicMock(spec=['key']), 10))
+
+    def test_event_ids_are_sorted_by_time_and_sequence(self):
+        self.assertLess(get_stream_event_id_key(b'9-1'), get_stream_event_id_key('10-0'))
+        self.assertEqual((10, 0), get_stream_event_id_key('10'))
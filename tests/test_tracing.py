@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from jaeger_client import Tracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
+from opentracing.propagation import Format
+
+from window_manager.tracing import WindowTraceSampler
+
+
+class WindowTraceSamplerTestCase(TestCase):
+    def setUp(self):
+        self.reporter = InMemoryReporter()
+        self.tracer = Tracer('WindowManager', reporter=self.reporter, sampler=ConstSampler(True))
+        self.event_data = {'id': 'window-id-1', 'query_id': 'query_id1'}
+
+    def tearDown(self):
+        self.tracer.close()
+
+    def make_frames(self, count):
+        frames = []
+        for index in range(count):
+            tracer_headers = {}
+            with self.tracer.start_span('frame') as span:
+                self.tracer.inject(span.context, Format.HTTP_HEADERS, tracer_headers)
+            frames.append({'id': f'event-id-{index}', 'tracer': {'headers': tracer_headers}})
+        return frames
+
+    def test_sampled_window_span_follows_from_its_frames(self):
+        sampler = WindowTraceSampler(sample_ratio=1, max_linked_frames=3)
+        frames = self.make_frames(9)
+        span, tracer_headers = sampler.get_tracer_headers(self.tracer, self.event_data, frames, 'ma-data')
+        span.finish()
+
+        window_span = self.reporter.get_spans()[-1]
+        self.assertEqual('send_window_to_matcher', window_span.operation_name)
+        linked_span_ids = [ref.referenced_context.span_id for ref in window_span.references]
+        frame_span_ids = [
+            self.tracer.extract(Format.HTTP_HEADERS, frames[i]['tracer']['headers']).span_id for i in [0, 3, 6]
+        ]
+        self.assertListEqual(frame_span_ids, linked_span_ids)
+        self.assertEqual(window_span.span_id, self.tracer.extract(Format.HTTP_HEADERS, tracer_headers).span_id)
+
+    def test_unsampled_window_has_no_span_and_a_not_sampled_context(self):
+        sampler = WindowTraceSampler(sample_ratio=0)
+        spans_count = len(self.reporter.get_spans())
+        span, tracer_headers = sampler.get_tracer_headers(self.tracer, self.event_data, self.make_frames(2), 'ma-data')
+        self.assertIsNone(span)
+        self.assertEqual(spans_count + 2, len(self.reporter.get_spans()))
+        span_context = self.tracer.extract(Format.HTTP_HEADERS, tracer_headers)
+        self.assertFalse(span_context.flags & 1)
+
+    def test_frames_without_or_with_corrupted_headers_are_not_linked(self):
+        sampler = WindowTraceSampler(sample_ratio=1)
+        frames = [{'id': 'event-id-1'}, {'id': 'event-id-2', 'tracer': {'headers': {'uber-trace-id': 'bad'}}}]
+        span, _ = sampler.get_tracer_headers(self.tracer, self.event_data, frames, 'ma-data')
+        span.finish()
+        self.assertIsNone(self.reporter.get_spans()[-1].references)
+
+    def test_sample_ratio(self):
+        sampler = WindowTraceSampler(sample_ratio=0.25)
+        sampled_count = sum(sampler.should_sample() for _ in range(4000))
+        self.assertTrue(800 < sampled_count < 1200)
@@ -1,7 +1,28 @@
-from unittest import TestCase
+from unittest import TestCase, skipUnless
 from unittest.mock import patch, MagicMock
 
-from window_manager.window_controllers import TumblingCountWindowController
+from window_manager.checkpoints import decode_json_state, encode_json_state
+from window_manager.columnar import ColumnarWindow
+from window_manager.deadlines import DeadlineHeap
+from window_manager.merged_graphs import MergedGraphWindow
+from window_manager.window_controllers import (
+    TumblingCountWindowController,
+    TumblingTimeWindowController,
+    HoppingTimeWindowController,
+    SlidingCountWindowController,
+    SessionWindowController,
+    Pane,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def json_round_trip(state):
+    # the states are checkpointed and handed off as json
+    return decode_json_state(encode_json_state(state))
 
 
 class TumblingCountWindowControllerTestCase(TestCase):
@@ -36,6 +57,14 @@ class TumblingCountWindowControllerTestCase(TestCase):
     def test_repr_is_correct(self):
         self.assertEquals('TumblingCountWindowController("query_id1", *(3,))', self.window_controller.__repr__())
 
+    def test_add_and_remove_query_id_keeps_query_ids_reference_count(self):
+        self.window_controller.add_query_id('query_id2')
+        self.window_controller.add_query_id('query_id2')
+        self.assertEqual(('query_id1', 'query_id2'), self.window_controller.query_ids)
+        self.assertEqual(1, self.window_controller.remove_query_id('query_id1'))
+        self.assertEqual(('query_id2',), self.window_controller.query_ids)
+        self.assertEqual(0, self.window_controller.remove_query_id('query_id2'))
+
     def test_update_windows_correctly_updates_datastructure_if_first_event(self):
         buffer_stream_key = self.event_data1['buffer_stream_key']
         self.window_controller.update_windows(self.event_data1)
@@ -98,6 +127,13 @@ class TumblingCountWindowControllerTestCase(TestCase):
             self.window_controller.finished_bufferstream_to_window_map[buffer_stream_key1]
         )
 
+    def test_update_windows_returns_finished_buffer_stream_keys(self):
+        buffer_stream_key1 = self.event_data1['buffer_stream_key']
+        self.assertListEqual([], self.window_controller.update_windows(self.event_data1))
+        self.assertListEqual([], self.window_controller.update_windows(self.event_data2))
+        self.assertListEqual([buffer_stream_key1], self.window_controller.update_windows(self.event_data3))
+        self.assertListEqual([], self.window_controller.update_windows(self.event_data1))
+
     def test_get_and_reset_finished_bufferstream_windows_get_and_cleans_up_datastructure(self):
         self.window_controller.finished_bufferstream_to_window_map = {
             '123': [self.event_data1],
@@ -106,3 +142,583 @@ class TumblingCountWindowControllerTestCase(TestCase):
         ret = self.window_controller.get_and_reset_finished_bufferstream_windows()
         self.assertListEqual([[self.event_data1], [self.event_data2, self.event_data3]], list(ret))
         self.assertEqual(self.window_controller.finished_bufferstream_to_window_map, {})
+
+
+def make_timed_event(event_id, timestamp, buffer_stream_key='12345'):
+    return {
+        'id': event_id,
+        'vekg': {},
+        'query_ids': ['query_id1'],
+        'buffer_stream_key': buffer_stream_key,
+        'timestamp': timestamp,
+    }
+
+
+class TumblingTimeWindowControllerTestCase(TestCase):
+    def setUp(self):
+        self.window_controller = TumblingTimeWindowController('query_id1', 10)
+
+    def test_repr_is_correct(self):
+        self.assertEqual('TumblingTimeWindowController("query_id1", *(10,))', self.window_controller.__repr__())
+
+    def test_update_windows_keeps_window_open_until_watermark_reaches_window_end(self):
+        event1 = make_timed_event('event-id-1', 1)
+        event2 = make_timed_event('event-id-2', 9.5)
+        self.assertListEqual([], self.window_controller.update_windows(event1))
+        self.assertListEqual([], self.window_controller.update_windows(event2))
+        self.assertListEqual([], list(self.window_controller.get_and_reset_finished_bufferstream_windows()))
+
+    def test_update_windows_closes_window_when_watermark_passes_it(self):
+        event1 = make_timed_event('event-id-1', 1)
+        event2 = make_timed_event('event-id-2', 9.5)
+        event3 = make_timed_event('event-id-3', 10)
+        self.window_controller.update_windows(event1)
+        self.window_controller.update_windows(event2)
+        self.assertListEqual(['12345'], self.window_controller.update_windows(event3))
+        windows = list(self.window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual([[event1, event2]], windows)
+        self.assertListEqual([event3], self.window_controller.bufferstream_to_events_map['12345'])
+
+    def test_idle_buffer_stream_windows_are_closed_by_the_controller_watermark(self):
+        event1 = make_timed_event('event-id-1', 1, buffer_stream_key='a')
+        self.window_controller.update_windows(event1)
+        self.assertListEqual([], self.window_controller.update_windows(make_timed_event('event-id-2', 9, 'b')))
+        finished_keys = self.window_controller.update_windows(make_timed_event('event-id-3', 1000, 'b'))
+        self.assertListEqual(['a', 'b'], finished_keys)
+        self.assertListEqual(
+            [[event1], [make_timed_event('event-id-2', 9, 'b')]],
+            self.window_controller.get_and_reset_finished_bufferstream_windows()
+        )
+        self.assertNotIn('a', self.window_controller.bufferstream_to_events_map)
+        self.assertEqual(1, len(self.window_controller.window_deadlines))
+
+    def test_allowed_lateness_keeps_windows_open_for_slower_buffer_streams(self):
+        window_controller = TumblingTimeWindowController('query_id1', 10, {'allowed_lateness': 5})
+        events_a = [make_timed_event(f'event-id-a{i}', 5 + i, buffer_stream_key='a') for i in range(8)]
+        events_b = [make_timed_event(f'event-id-b{i}', i, buffer_stream_key='b') for i in range(8)]
+        finished_keys = []
+        for event_a, event_b in zip(events_a, events_b):
+            finished_keys.extend(window_controller.update_windows(event_a))
+            finished_keys.extend(window_controller.update_windows(event_b))
+        self.assertListEqual([], finished_keys)
+        self.assertEqual(0, window_controller.late_events_count)
+        self.assertListEqual(['a', 'b'], window_controller.update_windows(make_timed_event('event-id-a', 15, 'a')))
+        self.assertListEqual(
+            [events_a[:5], events_b], window_controller.get_and_reset_finished_bufferstream_windows()
+        )
+        window_controller.update_windows(make_timed_event('event-id-b', 9, 'b'))
+        self.assertEqual(1, window_controller.late_events_count)
+
+    def test_negative_allowed_lateness_is_invalid(self):
+        with self.assertRaises(ValueError):
+            TumblingTimeWindowController('query_id1', 10, {'allowed_lateness': -1})
+
+    def test_update_windows_ignores_late_events(self):
+        self.window_controller.update_windows(make_timed_event('event-id-1', 25))
+        late_event = make_timed_event('event-id-2', 3)
+        self.assertListEqual([], self.window_controller.update_windows(late_event))
+        self.assertEqual(1, self.window_controller.late_events_count)
+        self.assertDictEqual({'12345': 1}, self.window_controller.get_and_reset_late_events())
+        self.assertDictEqual({}, self.window_controller.get_and_reset_late_events())
+        self.assertNotIn(late_event, self.window_controller.bufferstream_to_events_map['12345'])
+
+
+class HoppingTimeWindowControllerTestCase(TestCase):
+    def setUp(self):
+        self.window_controller = HoppingTimeWindowController('query_id1', 10, 5)
+
+    def test_update_windows_emits_overlapping_windows_without_duplicating_storage(self):
+        events = [make_timed_event(f'event-id-{i}', i * 3) for i in range(6)]
+        finished_bufferstream_keys = []
+        for event_data in events:
+            finished_bufferstream_keys.extend(self.window_controller.update_windows(event_data))
+        # timestamps 0, 3, 6, 9, 12, 15 -> windows [-5, 5), [0, 10), [5, 15) are closed
+        self.assertListEqual(['12345', '12345', '12345'], finished_bufferstream_keys)
+        windows = list(self.window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual(
+            [
+                [events[0], events[1]],
+                [events[0], events[1], events[2], events[3]],
+                [events[2], events[3], events[4]],
+            ],
+            windows
+        )
+        self.assertListEqual(
+            [events[4], events[5]],
+            self.window_controller.bufferstream_to_events_map['12345']
+        )
+
+
+class SlidingCountWindowControllerTestCase(TestCase):
+    def setUp(self):
+        self.events = [
+            {
+                'id': f'event-id-{i}',
+                'vekg': {},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': '12345',
+            }
+            for i in range(6)
+        ]
+
+    def test_invalid_window_and_slide_sizes_are_rejected(self):
+        for window_size, slide_size in [(3, 0), (0, 1), (-3, 1), (2, 3)]:
+            with self.assertRaises(ValueError):
+                SlidingCountWindowController('query_id1', window_size, slide_size)
+
+    def test_repr_is_correct(self):
+        window_controller = SlidingCountWindowController('query_id1', 3, 1)
+        self.assertEqual('SlidingCountWindowController("query_id1", *(3, 1))', window_controller.__repr__())
+
+    def test_update_windows_emits_a_window_every_slide_after_first_full_window(self):
+        window_controller = SlidingCountWindowController('query_id1', 3, 1)
+        finished = [window_controller.update_windows(event_data) for event_data in self.events]
+        self.assertListEqual([[], [], ['12345'], ['12345'], ['12345'], ['12345']], finished)
+        windows = list(window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual(
+            [self.events[0:3], self.events[1:4], self.events[2:5], self.events[3:6]],
+            windows
+        )
+
+    def test_update_windows_with_slide_bigger_than_one(self):
+        window_controller = SlidingCountWindowController('query_id1', 4, 2)
+        for event_data in self.events:
+            window_controller.update_windows(event_data)
+        windows = list(window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual([self.events[0:4], self.events[2:6]], windows)
+        self.assertEqual(2, window_controller.pane_size)
+
+    def test_overlapping_windows_share_the_same_panes(self):
+        window_controller = SlidingCountWindowController('query_id1', 3, 1)
+        for event_data in self.events[:4]:
+            window_controller.update_windows(event_data)
+        window1, window2 = window_controller.get_and_reset_finished_bufferstream_windows()
+        self.assertIs(window1.panes[1], window2.panes[0])
+        self.assertIs(window1[1], self.events[1])
+
+    def test_ring_buffer_is_bounded_by_window_size(self):
+        window_controller = SlidingCountWindowController('query_id1', 3, 1)
+        for event_data in self.events:
+            window_controller.update_windows(event_data)
+        ring_buffer = window_controller.bufferstream_to_ring_buffer_map['12345']
+        self.assertEqual(3, len(ring_buffer.panes))
+
+    def test_query_added_later_starts_with_the_next_window_without_its_panes(self):
+        window_controller = SlidingCountWindowController('query_id1', 4, 2)
+        for event_data in self.events[:2]:
+            window_controller.update_windows(event_data)
+        window_controller.add_query_id('query_id2')
+        events = [dict(event_data, query_ids=['query_id1', 'query_id2']) for event_data in self.events[2:6]]
+        for event_data in events:
+            window_controller.update_windows(event_data)
+        query_windows = window_controller.get_and_reset_finished_query_windows()
+        self.assertListEqual(
+            [(('query_id1',), self.events[:2] + events[:2]), (('query_id1', 'query_id2'), events)],
+            query_windows
+        )
+
+    def test_pane_encodes_frames_only_once(self):
+        encoder = MagicMock(side_effect=lambda frame: frame['id'])
+        pane = Pane(self.events[:2])
+        self.assertEqual('event-id-0, event-id-1', pane.get_encoded_frames(encoder))
+        self.assertEqual('event-id-0, event-id-1', pane.get_encoded_frames(encoder))
+        self.assertEqual(2, encoder.call_count)
+
+
+class SessionWindowControllerTestCase(TestCase):
+    def setUp(self):
+        self.window_controller = SessionWindowController('query_id1', 5, 4)
+
+    def make_event(self, timestamp, buffer_stream_key='12345'):
+        return {
+            'id': f'event-id-{buffer_stream_key}-{timestamp}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+            'timestamp': timestamp,
+        }
+
+    def test_session_is_closed_after_a_gap_without_events(self):
+        for timestamp in [1, 3, 7]:
+            self.assertListEqual([], self.window_controller.update_windows(self.make_event(timestamp)))
+        self.assertListEqual(['12345'], self.window_controller.update_windows(self.make_event(12)))
+        windows = self.window_controller.get_and_reset_finished_bufferstream_windows()
+        self.assertListEqual([[self.make_event(1), self.make_event(3), self.make_event(7)]], windows)
+        self.assertEqual(1, self.window_controller.buffered_events_count)
+
+    def test_idle_buffer_stream_session_is_closed_by_the_controller_watermark(self):
+        window_controller = SessionWindowController('query_id1', 5, 100)
+        window_controller.update_windows(self.make_event(1, buffer_stream_key='b1'))
+        window_controller.update_windows(self.make_event(2, buffer_stream_key='b1'))
+        self.assertListEqual([], window_controller.update_windows(self.make_event(1, buffer_stream_key='b2')))
+        self.assertListEqual(
+            ['b2', 'b1'], window_controller.update_windows(self.make_event(1000, buffer_stream_key='b2'))
+        )
+        self.assertListEqual(
+            [
+                [self.make_event(1, buffer_stream_key='b2')],
+                [self.make_event(1, buffer_stream_key='b1'), self.make_event(2, buffer_stream_key='b1')],
+            ],
+            window_controller.get_and_reset_finished_bufferstream_windows()
+        )
+        self.assertEqual(1, len(window_controller.session_deadlines))
+
+    def test_allowed_lateness_keeps_sessions_open_for_slower_buffer_streams(self):
+        # "a" is 5 seconds behind "b"
+        window_controller = SessionWindowController('query_id1', 5, 4, {'allowed_lateness': 5})
+        window_controller.update_windows(self.make_event(1, buffer_stream_key='a'))
+        window_controller.update_windows(self.make_event(6, buffer_stream_key='b'))
+        window_controller.update_windows(self.make_event(2, buffer_stream_key='a'))
+        self.assertListEqual([], window_controller.update_windows(self.make_event(10, buffer_stream_key='b')))
+        self.assertListEqual(['a'], window_controller.update_windows(self.make_event(12, buffer_stream_key='b')))
+        self.assertListEqual(
+            [[self.make_event(1, buffer_stream_key='a'), self.make_event(2, buffer_stream_key='a')]],
+            window_controller.get_and_reset_finished_bufferstream_windows()
+        )
+        self.assertEqual(0, window_controller.late_events_count)
+
+    def test_session_is_closed_at_max_length(self):
+        events = [self.make_event(timestamp) for timestamp in range(6)]
+        finished_keys = [self.window_controller.update_windows(event_data) for event_data in events]
+        self.assertListEqual([[], [], [], ['12345'], [], []], finished_keys)
+        self.assertListEqual([events[:4]], self.window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertEqual(2, self.window_controller.get_bufferstream_events_count('12345'))
+
+    def test_late_events_without_open_session_are_ignored(self):
+        for timestamp in range(20, 24):
+            self.window_controller.update_windows(self.make_event(timestamp))
+        self.assertListEqual([], self.window_controller.update_windows(self.make_event(10)))
+        self.assertEqual(1, self.window_controller.late_events_count)
+        self.assertDictEqual({'12345': 1}, self.window_controller.get_and_reset_late_events())
+        self.assertEqual(0, self.window_controller.get_bufferstream_events_count('12345'))
+
+    def test_out_of_order_events_do_not_move_the_session_deadline_back(self):
+        self.window_controller.update_windows(self.make_event(10))
+        self.window_controller.update_windows(self.make_event(8))
+        self.assertEqual(15, self.window_controller.session_deadlines.get_deadline('12345'))
+
+
+class WindowControllersBufferedEventsTestCase(TestCase):
+    def make_events(self, num_events, buffer_stream_key='12345'):
+        return [
+            {
+                'id': f'event-id-{i}',
+                'vekg': {},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': buffer_stream_key,
+                'timestamp': i,
+            }
+            for i in range(num_events)
+        ]
+
+    def test_tumbling_count_buffered_events_count(self):
+        window_controller = TumblingCountWindowController('query_id1', 3)
+        for event_data in self.make_events(4) + self.make_events(1, 'other'):
+            window_controller.update_windows(event_data)
+        self.assertEqual(2, window_controller.buffered_events_count)
+        self.assertEqual(1, window_controller.get_bufferstream_events_count('12345'))
+        self.assertEqual(1, window_controller.evict_bufferstream('12345'))
+        self.assertEqual(1, window_controller.buffered_events_count)
+        self.assertNotIn('12345', window_controller.bufferstream_to_window_map)
+
+    def test_tumbling_count_trim_discards_partial_window_over_limit(self):
+        window_controller = TumblingCountWindowController('query_id1', 5)
+        for event_data in self.make_events(3):
+            window_controller.update_windows(event_data)
+        self.assertEqual(0, window_controller.trim_bufferstream('12345', 3))
+        self.assertEqual(3, window_controller.trim_bufferstream('12345', 2))
+        self.assertEqual(0, window_controller.buffered_events_count)
+
+    def test_sliding_count_buffered_events_count_is_bounded_by_window_size(self):
+        window_controller = SlidingCountWindowController('query_id1', 4, 2)
+        for event_data in self.make_events(9):
+            window_controller.update_windows(event_data)
+        self.assertEqual(5, window_controller.buffered_events_count)
+        self.assertEqual(5, window_controller.get_bufferstream_events_count('12345'))
+        self.assertEqual(5, window_controller.evict_bufferstream('12345'))
+        self.assertEqual(0, window_controller.buffered_events_count)
+
+    def test_time_window_buffered_events_count_and_trim(self):
+        window_controller = TumblingTimeWindowController('query_id1', 10)
+        events = self.make_events(12)
+        for event_data in events:
+            window_controller.update_windows(event_data)
+        self.assertEqual(2, window_controller.buffered_events_count)
+        self.assertEqual(1, window_controller.trim_bufferstream('12345', 1))
+        self.assertListEqual([events[11]], window_controller.bufferstream_to_events_map['12345'])
+        self.assertEqual(1, window_controller.buffered_events_count)
+
+
+class WindowControllersStateTestCase(TestCase):
+    def make_events(self, num_events, buffer_stream_key='12345'):
+        return [
+            {
+                'id': f'event-id-{i}',
+                'vekg': {},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': buffer_stream_key,
+                'timestamp': i,
+            }
+            for i in range(num_events)
+        ]
+
+    def restore_controller(self, window_controller):
+        restored_controller = window_controller.__class__(window_controller.query_id, *window_controller.args)
+        restored_controller.set_state(json_round_trip(window_controller.get_state()))
+        for buffer_stream_key in window_controller.get_bufferstream_keys():
+            state = window_controller.get_bufferstream_state(buffer_stream_key)
+            if state is not None:
+                restored_controller.set_bufferstream_state(buffer_stream_key, json_round_trip(state))
+        return restored_controller
+
+    def test_tumbling_count_state_is_restored(self):
+        window_controller = TumblingCountWindowController('query_id1', 3)
+        events = self.make_events(6)
+        for event_data in events[:4]:
+            window_controller.update_windows(event_data)
+        restored_controller = self.restore_controller(window_controller)
+        self.assertEqual(1, restored_controller.buffered_events_count)
+        self.assertListEqual([], restored_controller.update_windows(events[4]))
+        self.assertListEqual(['12345'], restored_controller.update_windows(events[5]))
+        windows = list(restored_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual([events[3:6]], windows)
+
+    def test_time_window_state_is_restored(self):
+        window_controller = HoppingTimeWindowController('query_id1', 10, 5)
+        events = self.make_events(22)
+        for event_data in events[:17]:
+            window_controller.update_windows(event_data)
+        window_controller.get_and_reset_finished_bufferstream_windows()
+        restored_controller = self.restore_controller(window_controller)
+        self.assertEqual(window_controller.buffered_events_count, restored_controller.buffered_events_count)
+        self.assertEqual(16, restored_controller.watermark)
+        for event_data in events[17:]:
+            window_controller.update_windows(event_data)
+            restored_controller.update_windows(event_data)
+        windows = window_controller.get_and_reset_finished_bufferstream_windows()
+        self.assertEqual(1, len(windows))
+        self.assertListEqual(windows, restored_controller.get_and_reset_finished_bufferstream_windows())
+
+    def test_sliding_count_state_is_restored(self):
+        window_controller = SlidingCountWindowController('query_id1', 4, 2)
+        events = self.make_events(8)
+        for event_data in events[:5]:
+            window_controller.update_windows(event_data)
+        window_controller.get_and_reset_finished_bufferstream_windows()
+        restored_controller = self.restore_controller(window_controller)
+        self.assertEqual(5, restored_controller.buffered_events_count)
+        for event_data in events[5:]:
+            window_controller.update_windows(event_data)
+            restored_controller.update_windows(event_data)
+        windows = restored_controller.get_and_reset_finished_bufferstream_windows()
+        self.assertListEqual(window_controller.get_and_reset_finished_bufferstream_windows(), windows)
+        self.assertListEqual(events[2:6], windows[0])
+
+    def test_session_state_is_restored(self):
+        window_controller = SessionWindowController('query_id1', 5, 10)
+        events = self.make_events(4)
+        for event_data in events[:3]:
+            window_controller.update_windows(event_data)
+        restored_controller = self.restore_controller(window_controller)
+        self.assertEqual(7, restored_controller.session_deadlines.get_deadline('12345'))
+        restored_controller.update_windows(events[3])
+        restored_controller.update_windows(dict(events[3], id='event-id-8', timestamp=8))
+        self.assertListEqual([events], restored_controller.get_and_reset_finished_bufferstream_windows())
+
+    def test_time_window_bufferstream_state_can_be_moved_to_another_controller(self):
+        window_controller = TumblingTimeWindowController('query_id1', 10)
+        events = self.make_events(12)
+        for event_data in events[:5]:
+            window_controller.update_windows(event_data)
+        other_controller = TumblingTimeWindowController('query_id1', 10)
+        other_controller.set_bufferstream_state('12345', window_controller.get_bufferstream_state('12345'))
+        self.assertEqual(5, len(other_controller.bufferstream_to_events_map['12345']))
+        for event_data in events[5:11]:
+            other_controller.update_windows(event_data)
+        self.assertListEqual([events[:10]], other_controller.get_and_reset_finished_bufferstream_windows())
+
+
+class WindowControllersTimeoutsTestCase(TestCase):
+    def make_event(self, index, buffer_stream_key='12345'):
+        return {
+            'id': f'event-id-{index}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+            'timestamp': index,
+        }
+
+    @patch('window_manager.window_controllers.time')
+    def test_tumbling_count_partial_window_is_emitted_after_max_open_secs(self, mocked_time):
+        controller_timeouts = DeadlineHeap()
+        window_controller = TumblingCountWindowController(
+            'query_id1', 3, {'max_open_secs': 5}, controller_timeouts=controller_timeouts
+        )
+        mocked_time.monotonic.return_value = 100
+        window_controller.update_windows(self.make_event(1))
+        mocked_time.monotonic.return_value = 102
+        window_controller.update_windows(self.make_event(2))
+        self.assertEqual(105, controller_timeouts.get_deadline(window_controller))
+        self.assertListEqual([], window_controller.close_timed_out_windows(104))
+        self.assertListEqual(['12345'], window_controller.close_timed_out_windows(105))
+        windows = list(window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual([[self.make_event(1), self.make_event(2)]], windows)
+        self.assertEqual(0, window_controller.buffered_events_count)
+        self.assertIsNone(window_controller.get_next_timeout_deadline())
+
+    @patch('window_manager.window_controllers.time')
+    def test_tumbling_count_partial_window_is_discarded_after_max_open_secs(self, mocked_time):
+        window_controller = TumblingCountWindowController(
+            'query_id1', 3, {'max_open_secs': 5, 'on_timeout': 'discard'}
+        )
+        mocked_time.monotonic.return_value = 100
+        window_controller.update_windows(self.make_event(1))
+        self.assertListEqual(['12345'], window_controller.close_timed_out_windows(105))
+        self.assertListEqual([], list(window_controller.get_and_reset_finished_bufferstream_windows()))
+        self.assertEqual(0, window_controller.buffered_events_count)
+
+    @patch('window_manager.window_controllers.time')
+    def test_finished_window_cancels_its_timeouts(self, mocked_time):
+        mocked_time.monotonic.return_value = 100
+        window_controller = TumblingCountWindowController('query_id1', 2, {'max_open_secs': 5})
+        window_controller.update_windows(self.make_event(1))
+        window_controller.update_windows(self.make_event(2))
+        self.assertIsNone(window_controller.get_next_timeout_deadline())
+        self.assertListEqual([], window_controller.close_timed_out_windows(105))
+
+    def test_tumbling_count_partial_window_is_closed_by_the_watermark(self):
+        window_controller = TumblingCountWindowController('query_id1', 3, {'max_event_secs': 2})
+        window_controller.update_windows(self.make_event(1, buffer_stream_key='a'))
+        self.assertListEqual([], window_controller.update_windows(self.make_event(2, buffer_stream_key='b')))
+        self.assertListEqual(['a'], window_controller.update_windows(self.make_event(3, buffer_stream_key='b')))
+        windows = list(window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual([[self.make_event(1, buffer_stream_key='a')]], windows)
+        self.assertEqual(2, window_controller.buffered_events_count)
+
+    def test_sliding_count_partial_window_is_closed_by_the_watermark(self):
+        window_controller = SlidingCountWindowController('query_id1', 4, 2, {'max_event_secs': 4})
+        events = [self.make_event(i) for i in range(7)]
+        for event_data in events[:4]:
+            window_controller.update_windows(event_data)
+        window_controller.get_and_reset_finished_bufferstream_windows()
+        # the timeout starts again with the first event after the emitted window
+        window_controller.update_windows(events[4])
+        window_controller.update_windows(self.make_event(7, buffer_stream_key='other'))
+        self.assertListEqual(['12345'], window_controller.update_windows(self.make_event(8, buffer_stream_key='other')))
+        windows = window_controller.get_and_reset_finished_bufferstream_windows()
+        self.assertListEqual([events[1:5]], windows)
+        self.assertEqual(0, window_controller.get_bufferstream_events_count('12345'))
+
+    @patch('window_manager.window_controllers.time')
+    def test_restored_partial_window_gets_new_timeouts(self, mocked_time):
+        mocked_time.monotonic.return_value = 100
+        window_controller = TumblingCountWindowController('query_id1', 3, {'max_open_secs': 5, 'max_event_secs': 10})
+        window_controller.set_bufferstream_state(
+            '12345', {'window': [self.make_event(1), self.make_event(2)], 'query_ids': ['query_id1']}
+        )
+        self.assertEqual(105, window_controller.get_next_timeout_deadline())
+        self.assertEqual(2, window_controller.watermark)
+        self.assertEqual(11, window_controller.window_event_deadlines.get_deadline('12345'))
+
+    def test_invalid_window_options_are_rejected(self):
+        with self.assertRaises(ValueError):
+            TumblingCountWindowController('query_id1', 3, {'on_timeout': 'ignore'})
+        with self.assertRaises(ValueError):
+            TumblingTimeWindowController('query_id1', 10, {'aggregation': 'merged_graph'})
+
+
+class WindowControllersMergedGraphTestCase(TestCase):
+    def make_event(self, timestamp, node_ids, buffer_stream_key='12345'):
+        return {
+            'id': f'event-id-{buffer_stream_key}-{timestamp}',
+            'vekg': {'nodes': [[node_id, {}] for node_id in node_ids], 'edges': []},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+            'timestamp': timestamp,
+        }
+
+    def test_tumbling_count_emits_merged_graphs(self):
+        window_controller = TumblingCountWindowController('query_id1', 2, {'aggregation': 'merged_graph'})
+        window_controller.update_windows(self.make_event(1, ['a', 'b']))
+        window_controller.update_windows(self.make_event(2, ['b', 'c']))
+        window_controller.update_windows(self.make_event(3, ['d']))
+        windows = list(window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertEqual(1, len(windows))
+        self.assertIsInstance(windows[0], MergedGraphWindow)
+        self.assertDictEqual({'a': ['a', {}, 0, 0], 'b': ['b', {}, 0, 1], 'c': ['c', {}, 1, 1]}, windows[0].nodes)
+        self.assertDictEqual({'d': ['d', {}, 0, 0]}, window_controller.bufferstream_to_window_map['12345'].nodes)
+        self.assertEqual(1, window_controller.buffered_events_count)
+
+    def test_session_emits_merged_graphs(self):
+        window_controller = SessionWindowController('query_id1', 5, 10, {'aggregation': 'merged_graph'})
+        window_controller.update_windows(self.make_event(1, ['a']))
+        window_controller.update_windows(self.make_event(2, ['a', 'b']))
+        window_controller.update_windows(self.make_event(10, ['c']))
+        windows = window_controller.get_and_reset_finished_bufferstream_windows()
+        self.assertDictEqual({'a': ['a', {}, 0, 1], 'b': ['b', {}, 1, 1]}, windows[0].nodes)
+
+    def test_session_trim_discards_the_whole_merged_graph(self):
+        window_controller = SessionWindowController('query_id1', 5, 10, {'aggregation': 'merged_graph'})
+        for timestamp in range(3):
+            window_controller.update_windows(self.make_event(timestamp, ['a']))
+        self.assertEqual(3, window_controller.trim_bufferstream('12345', 2))
+        self.assertEqual(0, window_controller.get_bufferstream_events_count('12345'))
+
+    def test_merged_graph_state_is_restored(self):
+        window_controller = TumblingCountWindowController('query_id1', 3, {'aggregation': 'merged_graph'})
+        window_controller.update_windows(self.make_event(1, ['a']))
+        state = json_round_trip(window_controller.get_bufferstream_state('12345'))
+        new_window_controller = TumblingCountWindowController('query_id1', 3, {'aggregation': 'merged_graph'})
+        new_window_controller.set_bufferstream_state('12345', state)
+        new_window_controller.update_windows(self.make_event(2, ['a']))
+        new_window_controller.update_windows(self.make_event(3, ['b']))
+        windows = list(new_window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertDictEqual({'a': ['a', {}, 0, 1], 'b': ['b', {}, 2, 2]}, windows[0].nodes)
+
+    def test_invalid_aggregations_are_rejected(self):
+        with self.assertRaises(ValueError):
+            TumblingCountWindowController('query_id1', 3, {'aggregation': 'union'})
+        with self.assertRaises(ValueError):
+            SlidingCountWindowController('query_id1', 3, 1, {'aggregation': 'merged_graph'})
+
+
+@skipUnless(numpy, 'numpy is not installed')
+class WindowControllersColumnarTestCase(TestCase):
+    def make_event(self, timestamp, confidences):
+        return {
+            'id': f'event-id-{timestamp}',
+            'vekg': {'nodes': [[f'car{i}', {'confidence': c}] for i, c in enumerate(confidences)], 'edges': []},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': '12345',
+            'timestamp': timestamp,
+        }
+
+    def test_tumbling_count_emits_columnar_windows(self):
+        window_controller = TumblingCountWindowController(
+            'query_id1', 2, {'aggregation': 'columnar', 'columns': ['confidence']}
+        )
+        window_controller.update_windows(self.make_event(1, [0.5, 0.6]))
+        window_controller.update_windows(self.make_event(2, [0.7, 0.8]))
+        windows = list(window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertIsInstance(windows[0], ColumnarWindow)
+        self.assertEqual(4, windows[0].rows_capacity)
+        self.assertListEqual([0.5, 0.6, 0.7, 0.8], windows[0].get_column('confidence').tolist())
+
+    def test_columnar_state_is_restored(self):
+        options = {'aggregation': 'columnar', 'columns': ['confidence']}
+        window_controller = TumblingCountWindowController('query_id1', 2, options)
+        window_controller.update_windows(self.make_event(1, [0.5]))
+        new_window_controller = TumblingCountWindowController('query_id1', 2, options)
+        state = json_round_trip(window_controller.get_bufferstream_state('12345'))
+        new_window_controller.set_bufferstream_state('12345', state)
+        new_window_controller.update_windows(self.make_event(2, [0.7]))
+        windows = list(new_window_controller.get_and_reset_finished_bufferstream_windows())
+        self.assertListEqual([0.5, 0.7], windows[0].get_column('confidence').tolist())
+
+    def test_invalid_columnar_options_are_rejected(self):
+        with self.assertRaises(ValueError):
+            TumblingCountWindowController('query_id1', 2, {'aggregation': 'columnar'})
+        with self.assertRaises(ValueError):
+            TumblingCountWindowController('query_id1', 2, {'columns': ['confidence']})
+        with self.assertRaises(ValueError):
+            SessionWindowController('query_id1', 5, 10, {'aggregation': 'columnar', 'columns': ['confidence']})
@@ -1,9 +1,27 @@
+import asyncio
+import json
+import shutil
+import sys
+import tempfile
+import threading
+from unittest import TestCase
 from unittest.mock import patch, MagicMock
 
 from event_service_utils.tests.base_test_case import MockedEventDrivenServiceStreamTestCase
 from event_service_utils.tests.json_msg_helper import prepare_event_msg_tuple
+from event_service_utils.tests.mocked_streams import MockedStreamFactory
+from jaeger_client import Tracer as JaegerTracer
+from jaeger_client.reporter import InMemoryReporter
+from jaeger_client.sampler import ConstSampler
 
 from window_manager.service import WindowManager
+from window_manager.sharding import ConsistentHashRing
+from window_manager.wire_formats import MSGPACK_DELTA_FORMAT, decode_window_msg, encode_window_frames
+from window_manager.window_controllers import (
+    TumblingTimeWindowController,
+    HoppingTimeWindowController,
+    SlidingCountWindowController,
+)
 
 from window_manager.conf import (
     SERVICE_STREAM_KEY,
@@ -13,6 +31,16 @@ from window_manager.conf import (
     PUB_EVENT_LIST,
 )
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class TestWindowManager(MockedEventDrivenServiceStreamTestCase):
     GLOBAL_SERVICE_CONFIG = {
@@ -90,7 +118,9 @@ class TestWindowManager(MockedEventDrivenServiceStreamTestCase):
         }
         self.service.add_query_window_action(query_id, window)
 
-        mocked_window_controller.assert_called_once_with(query_id, *['some', 'args'])
+        mocked_window_controller.assert_called_once_with(
+            query_id, *['some', 'args'], controller_timeouts=self.service.window_timeout_deadlines
+        )
 
     def test_add_query_window_action_should_update_datastructure_correctly(self):
         query_id = 'query_id'
@@ -108,6 +138,26 @@ class TestWindowManager(MockedEventDrivenServiceStreamTestCase):
         self.assertIn(query_id, self.service.query_windows)
         self.assertEquals('instance_of_controller', self.service.query_windows[query_id])
 
+    def test_session_windows_are_sent_to_matcher_after_their_gap(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'SESSION_WINDOW', 'args': [5, 100]})
+        for event_index, timestamp in enumerate([1, 2, 10]):
+            event_data = {
+                'id': f'event-id-{event_index}',
+                'vekg': {},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': 'buffer-1',
+                'timestamp': timestamp,
+            }
+            self.service.process_data_event(event_data, None)
+        windows = [json.loads(msg['event']) for msg in self.service.matcher_stream.mocked_values]
+        self.assertListEqual([['event-id-0', 'event-id-1']], [[e['id'] for e in w['vekg_stream']] for w in windows])
+
+    def test_add_query_window_action_supports_time_windows(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_TIME_WINDOW', 'args': [10]})
+        self.service.add_query_window_action('query_id2', {'window_type': 'HOPPING_TIME_WINDOW', 'args': [10, 5]})
+        self.assertIsInstance(self.service.query_windows['query_id1'], TumblingTimeWindowController)
+        self.assertIsInstance(self.service.query_windows['query_id2'], HoppingTimeWindowController)
+
     def test_add_query_window_action_shouldnt_do_anything_if_non_supported_window_type(self):
         query_id = 'query_id'
         window = {
@@ -123,6 +173,11 @@ class TestWindowManager(MockedEventDrivenServiceStreamTestCase):
         self.assertFalse(mocked_window_controller.called)
         self.assertNotIn(query_id, self.service.query_windows)
 
+    def test_add_query_window_action_ignores_invalid_window_args(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'SLIDING_COUNT_WINDOW', 'args': [3, 0]})
+        self.assertNotIn('query_id1', self.service.query_windows)
+        self.assertDictEqual({}, self.service.window_spec_controllers)
+
     def test_add_query_window_action_shouldnt_do_anything_if_query_window_duplicate(self):
         query_id = 'query_id'
         window = {
@@ -194,13 +249,1393 @@ class TestWindowManager(MockedEventDrivenServiceStreamTestCase):
         query_1_window_controller = MagicMock()
         query_2_window_controller = MagicMock()
 
-        query_1_window_controller.get_and_reset_finished_bufferstream_windows.return_value = ([1, 2, 3],)
-        query_2_window_controller.get_and_reset_finished_bufferstream_windows.return_value = ([4, 5, 6],)
-        self.service.query_windows = {
-            'query_id1': query_1_window_controller,
-            'query_id2': query_2_window_controller,
+        query_1_window_controller.get_and_reset_finished_query_windows.return_value = [(('query_id1',), [1, 2, 3])]
+        query_2_window_controller.get_and_reset_finished_query_windows.return_value = [(('query_id2',), [4, 5, 6])]
+        self.service.finished_window_controllers = {
+            query_1_window_controller: None,
+            query_2_window_controller: None,
         }
         self.service.send_finished_windows()
         self.assertEqual(2, mocked_send_to_matcher.call_count)
         self.assertListEqual(['query_id1', [1, 2, 3]], list((mocked_send_to_matcher.mock_calls[0])[1]))
         self.assertListEqual(['query_id2', [4, 5, 6]], list((mocked_send_to_matcher.mock_calls[1])[1]))
+        self.assertEqual({}, self.service.finished_window_controllers)
+
+    @patch('window_manager.service.WindowManager.send_window_to_matcher')
+    def test_send_finished_windows_should_only_check_controllers_with_finished_windows(self, mocked_send_to_matcher):
+        query_1_window_controller = MagicMock()
+        query_2_window_controller = MagicMock()
+
+        query_1_window_controller.get_and_reset_finished_query_windows.return_value = [(('query_id1',), [1, 2, 3])]
+        self.service.query_windows = {
+            'query_id1': query_1_window_controller,
+            'query_id2': query_2_window_controller,
+        }
+        self.service.finished_window_controllers = {
+            query_1_window_controller: None,
+        }
+        self.service.send_finished_windows()
+        self.assertEqual(1, mocked_send_to_matcher.call_count)
+        self.assertFalse(query_2_window_controller.get_and_reset_finished_query_windows.called)
+
+    def test_add_event_to_query_windows_should_mark_controllers_that_finished_windows(self):
+        query_1_window_controller = MagicMock()
+        query_2_window_controller = MagicMock()
+        query_1_window_controller.update_windows.return_value = ['12345']
+        query_2_window_controller.update_windows.return_value = []
+
+        self.service.query_windows = {
+            'query_id1': query_1_window_controller,
+            'query_id2': query_2_window_controller,
+        }
+        event_data = {
+            'id': 'event-id-1',
+            'vekg': {},
+            'query_ids': ['query_id1', 'query_id2'],
+            'buffer_stream_key': '12345',
+        }
+
+        self.service.add_event_to_query_windows(event_data)
+        self.assertDictEqual({query_1_window_controller: None}, self.service.finished_window_controllers)
+
+    def test_add_event_to_query_windows_should_update_shared_controller_only_once(self):
+        shared_window_controller = MagicMock()
+        self.service.query_windows = {
+            'query_id1': shared_window_controller,
+            'query_id2': shared_window_controller,
+        }
+        event_data = {
+            'id': 'event-id-1',
+            'vekg': {},
+            'query_ids': ['query_id1', 'query_id2'],
+            'buffer_stream_key': '12345',
+        }
+
+        self.service.add_event_to_query_windows(event_data)
+        shared_window_controller.update_windows.assert_called_once_with(event_data)
+
+    def send_window_events(self, query_ids_list, first_event_index=0):
+        for i, query_ids in enumerate(query_ids_list, first_event_index):
+            event_data = {
+                'id': f'event-id-{i}',
+                'vekg': {},
+                'query_ids': query_ids,
+                'buffer_stream_key': '12345',
+            }
+            self.service.process_data_event(event_data, prepare_event_msg_tuple(event_data)[1])
+        query_windows = {}
+        for event_msg in self.service.matcher_stream.mocked_values:
+            window_event = json.loads(event_msg['event'])
+            window_ids = [e['id'] for e in window_event['vekg_stream']]
+            query_windows.setdefault(window_event['query_id'], []).append(window_ids)
+        return query_windows
+
+    def test_add_query_window_action_shares_controller_between_queries_with_same_window_spec(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.add_query_window_action('query_id2', dict(window))
+        self.service.add_query_window_action('query_id3', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3]})
+        self.assertIs(self.service.query_windows['query_id1'], self.service.query_windows['query_id2'])
+        self.assertIsNot(self.service.query_windows['query_id1'], self.service.query_windows['query_id3'])
+        self.assertEqual(('query_id1', 'query_id2'), self.service.query_windows['query_id1'].query_ids)
+        self.assertEqual(2, len(self.service.window_spec_controllers))
+
+    def test_query_added_later_starts_with_the_next_window_of_shared_controller(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.send_window_events([['query_id1']])
+        self.service.add_query_window_action('query_id2', window)
+        self.assertIs(self.service.query_windows['query_id1'], self.service.query_windows['query_id2'])
+
+        self.service.matcher_stream.mocked_values.clear()
+        query_ids = ['query_id1', 'query_id2']
+        query_windows = self.send_window_events([query_ids, query_ids, query_ids], 1)
+        self.assertDictEqual(
+            {'query_id1': [['event-id-0', 'event-id-1'], ['event-id-2', 'event-id-3']],
+             'query_id2': [['event-id-2', 'event-id-3']]},
+            query_windows
+        )
+
+    def test_window_is_only_sent_to_the_queries_routed_all_its_events(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.add_query_window_action('query_id2', window)
+        self.service.add_query_window_action('query_id3', window)
+        query_windows = self.send_window_events([
+            ['query_id1', 'query_id2', 'query_id3'],
+            ['query_id2', 'query_id3'],
+        ])
+        self.assertDictEqual(
+            {
+                'query_id2': [['event-id-0', 'event-id-1']],
+                'query_id3': [['event-id-0', 'event-id-1']],
+            },
+            query_windows
+        )
+        self.assertEqual(1, len(self.service.window_spec_controllers))
+
+    def test_removed_query_is_not_sent_the_open_windows(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.add_query_window_action('query_id2', window)
+        self.send_window_events([['query_id1', 'query_id2']])
+        self.service.remove_query_window_action('query_id2')
+        query_windows = self.send_window_events([['query_id1']], 1)
+        self.assertDictEqual({'query_id1': [['event-id-0', 'event-id-1']]}, query_windows)
+
+    def test_shared_window_is_sent_to_each_query(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.add_query_window_action('query_id2', window)
+        query_windows = self.send_window_events([['query_id1', 'query_id2'], ['query_id1', 'query_id2']])
+        self.assertDictEqual(
+            {'query_id1': [['event-id-0', 'event-id-1']], 'query_id2': [['event-id-0', 'event-id-1']]}, query_windows
+        )
+        self.assertEqual(1, len(self.service.window_spec_controllers))
+
+    def test_window_event_serializer_uses_default_serializer_for_plain_windows(self):
+        event_data = {'id': 'window-id', 'vekg_stream': [{'id': 1}], 'query_id': 'query_id1'}
+        self.assertDictEqual(
+            self.service.default_event_serializer(event_data),
+            self.service.window_event_serializer(event_data)
+        )
+
+    def test_window_event_serializer_splices_paned_windows(self):
+        window_controller = SlidingCountWindowController('query_id1', 2, 1)
+        events = [{'id': i, 'vekg': {'nodes': [i]}, 'buffer_stream_key': '123', 'query_ids': []} for i in range(3)]
+        for event_data in events:
+            window_controller.update_windows(event_data)
+        for window in window_controller.get_and_reset_finished_bufferstream_windows():
+            event_data = {'id': 'window-id', 'vekg_stream': window, 'query_id': 'query_id1'}
+            event_msg = self.service.window_event_serializer(event_data)
+            self.assertDictEqual(
+                json.loads(self.service.default_event_serializer(event_data)['event']),
+                json.loads(event_msg['event'])
+            )
+
+
+class TestWindowManagerClaimCheck(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        claim_check_configs={'payload_ttl': 60},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def send_events(self, num_events):
+        for i in range(num_events):
+            event_data = {
+                'id': f'event-id-{i}',
+                'vekg': {'nodes': [i]},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': '12345',
+            }
+            self.service.process_data_event(event_data, prepare_event_msg_tuple(event_data)[1])
+
+    def test_window_sent_to_matcher_only_has_event_references(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        self.send_events(2)
+
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertNotIn('vekg_stream', window_event)
+        self.assertDictEqual(
+            {'key_prefix': f'{MATCHER_STREAM_KEY}-payload', 'event_ids': ['event-id-0', 'event-id-1']},
+            window_event['vekg_stream_refs']
+        )
+        window = self.service.payload_store.get_window(window_event['vekg_stream_refs'])
+        self.assertListEqual([{'nodes': [0]}, {'nodes': [1]}], [e['vekg'] for e in window])
+
+    def test_overlapping_windows_store_each_payload_once(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'SLIDING_COUNT_WINDOW', 'args': [3, 1]})
+        self.service.payload_store.put_many = MagicMock(wraps=self.service.payload_store.put_many)
+        self.send_events(5)
+
+        self.assertEqual(3, len(self.service.matcher_stream.mocked_values))
+        stored_keys = [
+            payload_key
+            for call in self.service.payload_store.put_many.call_args_list
+            for payload_key in call[0][0]
+        ]
+        self.assertEqual(5, len(stored_keys))
+        self.assertEqual(5, len(set(stored_keys)))
+
+
+class TestWindowManagerRawPassthrough(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        raw_passthrough=True,
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def test_process_data_only_decodes_routing_fields_and_splices_raw_events(self):
+        self.service.ack_data_stream_events = False
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        events = [
+            {
+                'id': f'event-id-{i}',
+                'vekg': {'nodes': [[f'car{i}', {'label': 'car'}]], 'edges': []},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': '12345',
+            }
+            for i in range(2)
+        ]
+        window_controller = self.service.query_windows['query_id1']
+        for event_data in events:
+            self.service.service_stream.mocked_values.append(prepare_event_msg_tuple(event_data))
+            self.service.process_data()
+            if window_controller.bufferstream_to_window_map['12345']:
+                buffered_event = window_controller.bufferstream_to_window_map['12345'][0]
+                self.assertFalse(buffered_event.is_decoded)
+
+        self.assertEqual(1, len(self.service.matcher_stream.mocked_values))
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertListEqual(events, window_event['vekg_stream'])
+        self.assertEqual('query_id1', window_event['query_id'])
+
+    def test_data_event_deserializer_keeps_raw_json(self):
+        event_data = {'id': 'event-id-1', 'vekg': {}, 'query_ids': ['q1'], 'buffer_stream_key': '1'}
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+        deserialized = self.service.data_event_deserializer(json_msg)
+        self.assertEqual(json_msg[b'event'], deserialized.raw_json)
+        self.assertFalse(deserialized.is_decoded)
+
+
+class TestWindowManagerBatchMode(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        batch_configs={'max_size': 4, 'max_linger_ms': 0},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerBatchMode, self).setUp()
+        self.service.ack_data_stream_events = False
+        # the mocked service stream list is shared by all the tests of the class
+        del self.service.service_stream.mocked_values[:]
+        for i in range(5):
+            event_data = {
+                'id': f'event-id-{i}',
+                'vekg': {},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': '12345',
+            }
+            self.service.service_stream.mocked_values.append(prepare_event_msg_tuple(event_data))
+
+    def test_process_data_reads_up_to_batch_max_size_events(self):
+        with patch.object(self.service, 'process_data_event_wrapper') as mocked_wrapper:
+            self.service.process_data()
+            self.assertEqual(4, mocked_wrapper.call_count)
+            self.service.process_data()
+            self.assertEqual(5, mocked_wrapper.call_count)
+
+    def test_process_data_flushes_batch_windows_in_a_single_write(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        self.service.matcher_stream.write_events = MagicMock(wraps=self.service.matcher_stream.write_events)
+        self.service.process_data()
+        self.service.matcher_stream.write_events.assert_called_once()
+        self.assertEqual(2, len(self.service.matcher_stream.mocked_values))
+        self.assertEqual([], self.service.pending_matcher_event_msgs)
+        window_event = json.loads(self.service.matcher_stream.mocked_values[1]['event'])
+        self.assertListEqual(['event-id-2', 'event-id-3'], [e['id'] for e in window_event['vekg_stream']])
+
+    def test_process_data_acks_all_batch_events_after_flush(self):
+        self.service.ack_data_stream_events = True
+        with patch('window_manager.service.ack_events') as mocked_ack:
+            self.service.process_data()
+        event_ids = mocked_ack.call_args[0][1]
+        self.assertEqual(4, len(event_ids))
+
+    def test_read_data_events_batch_lingers_to_fill_the_batch(self):
+        self.service.batch_max_linger_ms = 50
+        self.service.batch_max_size = 10
+        event_list = self.service.read_data_events_batch()
+        self.assertEqual(5, len(event_list))
+
+
+class TestWindowManagerQueryRemoved(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = TestWindowManager.GLOBAL_SERVICE_CONFIG
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    @patch('window_manager.service.WindowManager.remove_query_window_action')
+    def test_process_event_type_should_call_remove_query_window_with_proper_parameters(self, mocked_remove):
+        event_data = {
+            'id': 1,
+            'query_id': 'query-id',
+        }
+        json_msg = prepare_event_msg_tuple(event_data)[1]
+        self.service.process_event_type('QueryRemoved', event_data, json_msg)
+        mocked_remove.assert_called_once_with(query_id='query-id')
+
+    def test_remove_query_window_action_keeps_controller_shared_with_other_queries(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.add_query_window_action('query_id2', window)
+        window_controller = self.service.query_windows['query_id1']
+
+        self.service.remove_query_window_action('query_id1')
+        self.assertNotIn('query_id1', self.service.query_windows)
+        self.assertIs(window_controller, self.service.query_windows['query_id2'])
+        self.assertEqual(('query_id2',), window_controller.query_ids)
+        self.assertEqual(1, len(self.service.window_spec_controllers))
+
+    def test_remove_query_window_action_frees_controller_of_last_query(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.remove_query_window_action('query_id1')
+        self.assertEqual({}, self.service.query_windows)
+        self.assertEqual({}, self.service.window_spec_controllers)
+        self.assertEqual({}, self.service.query_window_spec_keys)
+
+        self.service.add_query_window_action('query_id1', window)
+        self.assertIn('query_id1', self.service.query_windows)
+
+    def test_remove_query_window_action_ignores_unknown_query(self):
+        self.service.remove_query_window_action('query_id1')
+        self.assertEqual({}, self.service.query_windows)
+
+    def test_remove_query_window_action_does_not_change_registry_in_use(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        query_registry = self.service.query_registry
+        self.service.remove_query_window_action('query_id1')
+        self.assertIn('query_id1', query_registry.query_windows)
+        self.assertNotIn('query_id1', self.service.query_registry.query_windows)
+
+    def test_add_event_to_query_windows_ignores_removed_queries(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [1]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.remove_query_window_action('query_id1')
+        event_data = {'id': 'event-id-1', 'query_ids': ['query_id1'], 'buffer_stream_key': 'a'}
+        self.service.add_event_to_query_windows(event_data)
+        self.assertDictEqual({}, self.service.finished_window_controllers)
+
+    def test_queries_can_be_added_and_removed_while_events_are_processed(self):
+        old_switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        errors = []
+        is_running = threading.Event()
+        is_running.set()
+
+        def process_events():
+            event_index = 0
+            try:
+                while is_running.is_set():
+                    event_index += 1
+                    query_ids = list(self.service.query_windows.keys())
+                    self.service.add_event_to_query_windows({
+                        'id': f'event-id-{event_index}',
+                        'vekg': {},
+                        'query_ids': query_ids,
+                        'buffer_stream_key': f'publisher-{event_index % 5}',
+                        'timestamp': event_index,
+                    })
+                    self.service.send_finished_windows()
+                    self.service.release_removed_window_controllers()
+            except Exception as e:
+                errors.append(e)
+
+        data_thread = threading.Thread(target=process_events)
+        data_thread.start()
+        try:
+            for i in range(2000):
+                window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [i % 4 + 1]}
+                self.service.add_query_window_action(f'query_id{i}', window)
+                if i >= 10:
+                    self.service.remove_query_window_action(f'query_id{i - 10}')
+        finally:
+            is_running.clear()
+            data_thread.join()
+            sys.setswitchinterval(old_switch_interval)
+        self.assertListEqual([], errors)
+        self.assertEqual(10, len(self.service.query_windows))
+        self.assertGreater(len(self.service.matcher_stream.mocked_values), 0)
+
+
+class TestWindowManagerBuffersMemory(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        memory_configs={
+            'max_buffered_events_per_stream': 3,
+            'max_buffered_events': 5,
+            'bufferstream_idle_timeout': 60,
+        },
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerBuffersMemory, self).setUp()
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_TIME_WINDOW', 'args': [100]})
+        self.event_index = 0
+
+    def send_event(self, buffer_stream_key):
+        self.event_index += 1
+        event_data = {
+            'id': f'event-id-{self.event_index}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+            'timestamp': self.event_index,
+        }
+        self.service.add_event_to_query_windows(event_data)
+
+    def test_buffer_stream_is_trimmed_to_max_buffered_events_per_stream(self):
+        for _ in range(5):
+            self.send_event('a')
+        window_controller = self.service.query_windows['query_id1']
+        self.assertEqual(3, window_controller.get_bufferstream_events_count('a'))
+        self.assertEqual(3, self.service.buffered_events_count)
+        self.assertEqual(2, self.service.memory_counters['dropped_events'])
+
+    def test_least_recently_updated_buffer_streams_are_evicted_over_max_buffered_events(self):
+        self.send_event('a')
+        self.send_event('a')
+        self.send_event('b')
+        self.send_event('b')
+        self.send_event('a')
+        self.send_event('c')
+        window_controller = self.service.query_windows['query_id1']
+        self.assertEqual(0, window_controller.get_bufferstream_events_count('b'))
+        self.assertEqual(3, window_controller.get_bufferstream_events_count('a'))
+        self.assertEqual(4, self.service.buffered_events_count)
+        self.assertEqual(1, self.service.memory_counters['evicted_bufferstreams'])
+        self.assertEqual(2, self.service.memory_counters['evicted_events'])
+
+    @patch('window_manager.service.time')
+    def test_idle_buffer_streams_are_flushed(self, mocked_time):
+        mocked_time.monotonic.return_value = 100
+        self.send_event('a')
+        mocked_time.monotonic.return_value = 150
+        self.send_event('b')
+        mocked_time.monotonic.return_value = 161
+        self.send_event('b')
+        window_controller = self.service.query_windows['query_id1']
+        self.assertEqual(0, window_controller.get_bufferstream_events_count('a'))
+        self.assertEqual(2, self.service.buffered_events_count)
+        self.assertListEqual(
+            [(window_controller, 'b')],
+            list(self.service.bufferstream_last_updates.keys())
+        )
+        self.assertEqual(1, self.service.memory_counters['flushed_bufferstreams'])
+        self.assertEqual(1, self.service.memory_counters['flushed_events'])
+        self.assertEqual(0, self.service.memory_counters['evicted_bufferstreams'])
+        self.assertDictEqual({window_controller: None}, self.service.finished_window_controllers)
+        query_windows = window_controller.get_and_reset_finished_query_windows()
+        self.assertListEqual(['event-id-1'], [event_data['id'] for event_data in query_windows[0][1]])
+
+    def test_remove_query_window_action_frees_buffered_events(self):
+        self.send_event('a')
+        self.send_event('b')
+        self.service.remove_query_window_action('query_id1')
+        self.assertEqual(2, self.service.buffered_events_count)
+        self.service.release_removed_window_controllers()
+        self.assertEqual(0, self.service.buffered_events_count)
+        self.assertEqual(0, len(self.service.bufferstream_last_updates))
+
+
+class TestWindowManagerMetrics(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        metrics_configs={'sample_every': 1},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerMetrics, self).setUp()
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        self.service.add_query_window_action('query_id1', window)
+        self.service.add_query_window_action('query_id2', window)
+        self.event_index = 0
+
+    def send_event(self, buffer_stream_key, query_ids):
+        self.event_index += 1
+        event_data = {
+            'id': f'event-id-{self.event_index}',
+            'vekg': {},
+            'query_ids': query_ids,
+            'buffer_stream_key': buffer_stream_key,
+            'timestamp': self.event_index * 0.5,
+        }
+        self.service.process_data_event(event_data, None)
+
+    def test_process_data_event_updates_event_and_window_metrics(self):
+        self.send_event('a', ['query_id1', 'query_id2'])
+        self.send_event('a', ['query_id1'])
+        metrics = self.service.metrics
+        self.assertEqual(2, metrics.events_processed.value)
+        self.assertEqual(2, metrics.event_processing_seconds.count)
+        self.assertEqual(1, metrics.matcher_write_seconds.count)
+        self.assertDictEqual({'query_id1': 1}, metrics.windows_emitted.get_snapshot())
+        self.assertEqual(0.5, metrics.window_fill_seconds.sum)
+
+    def test_refresh_metrics_sets_buffered_events_per_buffer_stream(self):
+        self.send_event('a', ['query_id1'])
+        self.send_event('b', ['query_id1'])
+        self.send_event('b', ['query_id1'])
+        self.send_event('c', ['query_id1'])
+        self.service.refresh_metrics()
+        self.assertDictEqual({'a': 1, 'c': 1}, self.service.metrics.buffered_events.get_snapshot())
+
+    def test_refresh_metrics_counts_late_events_per_buffer_stream(self):
+        self.service.add_query_window_action('query_id3', {'window_type': 'TUMBLING_TIME_WINDOW', 'args': [1]})
+        self.send_event('a', ['query_id3'])
+        self.send_event('a', ['query_id3'])
+        self.send_event('a', ['query_id3'])
+        self.service.process_data_event(
+            {'id': 'late-event-id', 'vekg': {}, 'query_ids': ['query_id3'], 'buffer_stream_key': 'a', 'timestamp': 0},
+            None
+        )
+        self.service.refresh_metrics()
+        self.service.refresh_metrics()
+        self.assertDictEqual({'a': 1}, self.service.metrics.late_events.get_snapshot())
+
+    def test_refresh_metrics_sets_input_lag_against_the_stream_head(self):
+        self.service.service_stream.redis_db = MagicMock()
+        self.service.service_stream.redis_db.xinfo_stream.return_value = {'last-generated-id': b'1600000003000-0'}
+        self.service.last_processed_event_id = b'1600000001500-2'
+        self.service.refresh_metrics()
+        self.assertEqual(1.5, self.service.metrics.input_lag_seconds.value)
+
+    def test_removed_query_is_removed_from_windows_emitted(self):
+        self.send_event('a', ['query_id1', 'query_id2'])
+        self.send_event('a', ['query_id1', 'query_id2'])
+        self.service.remove_query_window_action('query_id2')
+        self.assertDictEqual({'query_id1': 1}, self.service.metrics.windows_emitted.get_snapshot())
+
+
+class TestWindowManagerWindowTimeouts(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = TestWindowManager.GLOBAL_SERVICE_CONFIG
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerWindowTimeouts, self).setUp()
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3, {'max_open_secs': 5}]}
+        self.service.add_query_window_action('query_id1', window)
+
+    def send_event(self, event_index, buffer_stream_key='a'):
+        event_data = {
+            'id': f'event-id-{event_index}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+        }
+        self.service.add_event_to_query_windows(event_data)
+
+    @patch('window_manager.window_controllers.time')
+    @patch('window_manager.service.time')
+    def test_partial_windows_are_sent_to_matcher_after_max_open_secs(self, mocked_time, mocked_controllers_time):
+        mocked_time.monotonic.return_value = mocked_controllers_time.monotonic.return_value = 100
+        self.send_event(1, buffer_stream_key='a')
+        mocked_time.monotonic.return_value = mocked_controllers_time.monotonic.return_value = 103
+        self.send_event(2, buffer_stream_key='b')
+        self.assertEqual(2000, self.service.get_data_read_block())
+
+        mocked_time.monotonic.return_value = 105
+        self.service.close_timed_out_windows()
+        windows = [json.loads(msg['event']) for msg in self.service.matcher_stream.mocked_values]
+        self.assertListEqual([['event-id-1']], [[e['id'] for e in w['vekg_stream']] for w in windows])
+        self.assertEqual(108, self.service.window_timeout_deadlines.next_deadline())
+
+        mocked_time.monotonic.return_value = 108
+        self.service.close_timed_out_windows()
+        self.assertEqual(2, len(self.service.matcher_stream.mocked_values))
+        self.assertIsNone(self.service.get_data_read_block())
+
+    @patch('window_manager.window_controllers.time')
+    @patch('window_manager.service.time')
+    def test_removed_controllers_are_not_checked_for_timeouts(self, mocked_time, mocked_controllers_time):
+        mocked_time.monotonic.return_value = mocked_controllers_time.monotonic.return_value = 100
+        self.send_event(1)
+        self.service.remove_query_window_action('query_id1')
+        self.service.release_removed_window_controllers()
+        self.assertIsNone(self.service.get_data_read_block())
+        mocked_time.monotonic.return_value = 105
+        self.service.close_timed_out_windows()
+        self.assertEqual(0, len(self.service.matcher_stream.mocked_values))
+
+    def test_invalid_window_options_are_not_added(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3, {'on_timeout': 'ignore'}]}
+        self.service.add_query_window_action('query_id2', window)
+        self.assertNotIn('query_id2', self.service.query_windows)
+
+
+class TestWindowManagerMergedGraphs(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = TestWindowManager.GLOBAL_SERVICE_CONFIG
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerMergedGraphs, self).setUp()
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2, {'aggregation': 'merged_graph'}]}
+        self.service.add_query_window_action('query_id1', window)
+
+    def test_merged_graph_is_sent_to_matcher_instead_of_the_frames(self):
+        for event_index, node_ids in enumerate([['car1', 'person1'], ['car1']]):
+            event_data = {
+                'id': f'event-id-{event_index}',
+                'vekg': {'nodes': [[node_id, {}] for node_id in node_ids], 'edges': []},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': 'buffer-1',
+            }
+            self.service.process_data_event(event_data, None)
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertNotIn('vekg_stream', window_event)
+        self.assertDictEqual(
+            {
+                'frames': [
+                    {'id': 'event-id-0', 'buffer_stream_key': 'buffer-1'},
+                    {'id': 'event-id-1', 'buffer_stream_key': 'buffer-1'},
+                ],
+                'nodes': [['car1', {}, 0, 1], ['person1', {}, 0, 0]],
+                'edges': [],
+            },
+            window_event['vekg_graph']
+        )
+
+
+class TestWindowManagerColumnar(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = TestWindowManager.GLOBAL_SERVICE_CONFIG
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        if numpy is None:
+            self.skipTest('numpy is not installed')
+        super(TestWindowManagerColumnar, self).setUp()
+        options = {'aggregation': 'columnar', 'columns': ['confidence']}
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2, options]}
+        self.service.add_query_window_action('query_id1', window)
+
+    def test_columns_are_sent_to_matcher_with_the_frames(self):
+        for event_index, confidence in enumerate([0.5, 0.7]):
+            event_data = {
+                'id': f'event-id-{event_index}',
+                'vekg': {'nodes': [['car1', {'label': 'car', 'confidence': confidence}]], 'edges': []},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': 'buffer-1',
+            }
+            self.service.process_data_event(event_data, None)
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertNotIn('vekg_stream', window_event)
+        self.assertDictEqual(
+            {
+                'frames': [
+                    {
+                        'id': f'event-id-{event_index}',
+                        'buffer_stream_key': 'buffer-1',
+                        'vekg': {'nodes': [['car1', {'label': 'car'}]], 'edges': []},
+                    }
+                    for event_index in range(2)
+                ],
+                'frame_indexes': [0, 1],
+                'columns': {'confidence': [0.5, 0.7]},
+            },
+            window_event['vekg_columnar']
+        )
+
+
+class TestWindowManagerLoadShedding(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        load_shedding_configs={
+            'policies': ['sample', 'drop_low_priority'],
+            'max_event_processing_ms': 10,
+            'sample_every': 2,
+            'low_priority_query_ids': ['query_id2'],
+        },
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerLoadShedding, self).setUp()
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        self.service.add_query_window_action('query_id2', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+
+    def send_events(self, event_indexes):
+        for event_index in event_indexes:
+            event_data = {
+                'id': f'event-id-{event_index}',
+                'vekg': {},
+                'query_ids': ['query_id1', 'query_id2'],
+                'buffer_stream_key': 'buffer-1',
+            }
+            self.service.process_data_event(event_data, None)
+
+    def set_event_processing_time(self, event_processing_time):
+        histogram = self.service.metrics.event_processing_seconds
+        histogram.observe(event_processing_time)
+        self.service.check_load()
+
+    def test_windows_are_sent_without_shedding_when_not_overloaded(self):
+        self.set_event_processing_time(0.001)
+        self.send_events(range(2))
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertNotIn('load_shedding', window_event)
+        window_events = [json.loads(event_msg['event']) for event_msg in self.service.matcher_stream.mocked_values]
+        self.assertListEqual(['query_id1', 'query_id2'], [window_event['query_id'] for window_event in window_events])
+
+    def test_frames_are_sampled_and_low_priority_queries_dropped_while_overloaded(self):
+        self.set_event_processing_time(0.02)
+        self.assertEqual(1, self.service.metrics.overloaded.value)
+        self.send_events(range(4))
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertListEqual(['event-id-0', 'event-id-2'], [e['id'] for e in window_event['vekg_stream']])
+        self.assertEqual('query_id1', window_event['query_id'])
+        self.assertDictEqual({'shed_frames': 1, 'dropped_query_ids': ['query_id2']}, window_event['load_shedding'])
+        self.assertDictEqual({'sample': 2}, self.service.metrics.shed_frames.get_snapshot())
+        self.assertEqual(1, self.service.metrics.shed_query_windows.value)
+
+    def test_shedding_stops_when_the_overload_is_over(self):
+        self.set_event_processing_time(0.02)
+        self.set_event_processing_time(0.001)
+        self.assertEqual(0, self.service.metrics.overloaded.value)
+        self.send_events(range(2))
+        self.assertEqual(2, len(self.service.matcher_stream.mocked_values))
+
+
+class TestWindowManagerOutputBackpressure(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        backpressure_configs={'max_backlog': 2, 'action': 'pause', 'check_interval': 0, 'resume_ratio': 0.5},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerOutputBackpressure, self).setUp()
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [1]})
+
+    def send_event(self, event_index):
+        event_data = {
+            'id': f'event-id-{event_index}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': 'buffer-1',
+        }
+        self.service.process_data_event(event_data, None)
+
+    @patch('window_manager.service.time.sleep')
+    def test_intake_is_paused_while_the_matcher_stream_is_backpressured(self, mocked_sleep):
+        self.service.read_data_events_batch = MagicMock(return_value=[])
+        self.send_event(1)
+        self.send_event(2)
+        self.service.process_data()
+        self.assertFalse(self.service.read_data_events_batch.called)
+        mocked_sleep.assert_called_once_with(0)
+
+        self.service.matcher_stream.stream.mocked_values.pop(0)
+        self.service.matcher_stream.stream.mocked_values.pop(0)
+        self.service.process_data()
+        self.assertTrue(self.service.read_data_events_batch.called)
+
+    def test_windows_are_written_through_the_backpressure_stream(self):
+        self.send_event(1)
+        window_event = json.loads(self.service.matcher_stream.stream.mocked_values[0]['event'])
+        self.assertListEqual(['event-id-1'], [e['id'] for e in window_event['vekg_stream']])
+        self.service.check_output_backpressure()
+        self.service.refresh_metrics()
+        self.assertDictEqual({MATCHER_STREAM_KEY: 1}, self.service.metrics.output_backlog.get_snapshot())
+
+
+class TestWindowManagerCheckpoints(MockedEventDrivenServiceStreamTestCase):
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.GLOBAL_SERVICE_CONFIG = dict(
+            TestWindowManager.GLOBAL_SERVICE_CONFIG,
+            checkpoint_configs={'path': self.checkpoint_dir, 'interval': 10, 'max_deltas': 2},
+        )
+        super(TestWindowManagerCheckpoints, self).setUp()
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3]})
+        self.service.add_query_window_action('query_id2', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3]})
+        self.service.add_query_window_action('query_id3', {'window_type': 'TUMBLING_TIME_WINDOW', 'args': [10]})
+        self.event_index = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def make_event(self, buffer_stream_key, query_ids):
+        self.event_index += 1
+        return {
+            'id': f'event-id-{self.event_index}',
+            'vekg': {},
+            'query_ids': query_ids,
+            'buffer_stream_key': buffer_stream_key,
+            'timestamp': self.event_index,
+        }
+
+    def restart_service(self):
+        restored_service = self.instantiate_service()
+        self.assertTrue(restored_service.restore_checkpoint())
+        return restored_service
+
+    def test_restore_checkpoint_without_checkpoints(self):
+        self.assertFalse(self.instantiate_service().restore_checkpoint())
+
+    def test_restore_checkpoint_restores_query_windows_and_open_buffer_streams(self):
+        self.service.add_event_to_query_windows(self.make_event('a', ['query_id1', 'query_id3']))
+        self.service.add_event_to_query_windows(self.make_event('b', ['query_id2']))
+        self.service.last_processed_event_id = '1-1'
+        self.service.write_checkpoint()
+
+        restored_service = self.restart_service()
+        self.assertListEqual(['query_id1', 'query_id2', 'query_id3'], list(restored_service.query_windows))
+        self.assertEqual('1-1', restored_service.last_processed_event_id)
+        shared_window_controller = restored_service.query_windows['query_id1']
+        self.assertIs(shared_window_controller, restored_service.query_windows['query_id2'])
+        self.assertEqual(1, shared_window_controller.get_bufferstream_events_count('a'))
+        self.assertEqual(1, shared_window_controller.get_bufferstream_events_count('b'))
+        self.assertEqual(('query_id2',), shared_window_controller.bufferstream_window_query_ids['b'])
+        self.assertEqual(1, restored_service.query_windows['query_id3'].watermark)
+
+    def test_restore_checkpoint_applies_delta_checkpoints(self):
+        events = [self.make_event('a', ['query_id1']) for _ in range(3)]
+        self.service.add_event_to_query_windows(events[0])
+        self.service.write_checkpoint()
+        self.service.add_event_to_query_windows(events[1])
+        self.service.add_event_to_query_windows(self.make_event('b', ['query_id3']))
+        self.service.remove_query_window_action('query_id3')
+        self.service.write_checkpoint()
+        self.assertListEqual(
+            ['000000000001-full', '000000000002-delta'], self.service.checkpointer.storage.list_names()
+        )
+
+        restored_service = self.restart_service()
+        self.assertListEqual(['query_id1', 'query_id2'], list(restored_service.query_windows))
+        restored_service.add_event_to_query_windows(events[2])
+        restored_service.send_finished_windows()
+        self.assertEqual(1, len(restored_service.matcher_stream.mocked_values))
+
+    @patch('window_manager.service.time')
+    def test_process_data_writes_checkpoint_after_interval(self, mocked_time):
+        mocked_time.monotonic.return_value = self.service.next_checkpoint_time - 1
+        self.service.process_data()
+        self.assertListEqual([], self.service.checkpointer.storage.list_names())
+        mocked_time.monotonic.return_value = self.service.next_checkpoint_time
+        self.service.process_data()
+        self.assertListEqual(['000000000001-full'], self.service.checkpointer.storage.list_names())
+
+    def make_event_tuple(self, event_id, buffer_stream_key, query_ids):
+        return (event_id, {'event': json.dumps(self.make_event(buffer_stream_key, query_ids))})
+
+    @patch('window_manager.service.ack_events')
+    @patch('window_manager.service.time')
+    def test_process_data_acks_events_once_checkpointed(self, mocked_time, mocked_ack_events):
+        mocked_time.monotonic.return_value = self.service.next_checkpoint_time - 1
+        self.service.process_data_batch([self.make_event_tuple('1-0', 'a', ['query_id1'])])
+        mocked_ack_events.assert_called_once_with(self.service.service_stream, [])
+        mocked_time.monotonic.return_value = self.service.next_checkpoint_time
+        self.service.process_data_batch([self.make_event_tuple(b'2-0', 'a', ['query_id1'])])
+        mocked_ack_events.assert_called_with(self.service.service_stream, ['1-0', b'2-0'])
+        self.assertEqual('2-0', self.service.checkpointer.load()['last_event_id'])
+
+    @patch('window_manager.service.read_pending_events')
+    @patch('window_manager.service.ack_events')
+    def test_pending_events_after_the_checkpoint_are_processed_on_restart(self, mocked_ack_events, mocked_read):
+        self.service.last_processed_event_id = '2-0'
+        self.service.write_checkpoint()
+        restored_service = self.restart_service()
+        mocked_read.side_effect = [
+            [self.make_event_tuple(f'{index}-0', 'a', ['query_id1']) for index in range(1, 4)],
+            [self.make_event_tuple(b'10-0', 'a', ['query_id1'])],
+            [],
+        ]
+        restored_service.process_pending_data_events()
+        mocked_ack_events.assert_any_call(restored_service.service_stream, ['1-0', '2-0'])
+        self.assertEqual(2, restored_service.query_windows['query_id1'].get_bufferstream_events_count('a'))
+        self.assertEqual(b'10-0', restored_service.last_processed_event_id)
+        self.assertListEqual(['0', '3-0', b'10-0'], [call[1]['last_event_id'] for call in mocked_read.call_args_list])
+
+
+class MockedHandoffStreamFactory(MockedStreamFactory):
+    # handoff streams are read back by the service, so written events get an id, as in redis streams
+
+    def create(self, key, stype=None, cg_id=None):
+        stream = super(MockedHandoffStreamFactory, self).create(key, stype=stype, cg_id=cg_id)
+        if isinstance(key, str) and key.startswith(f'{SERVICE_STREAM_KEY}-handoff-'):
+            def write_events(*events):
+                stream.mocked_values.extend((f'{id(event)}-0', event) for event in events)
+            stream.write_events = write_events
+        return stream
+
+
+class TestWindowManagerSharding(TestCase):
+    SHARD_IDS = ['shard-1', 'shard-2']
+
+    def setUp(self):
+        # streams shared by all the shards, except for the data stream, since every shard reads all of it
+        self.shared_streams = {MATCHER_STREAM_KEY: []}
+        self.shards = {}
+        for shard_id in self.SHARD_IDS:
+            self.shards[shard_id] = self.instantiate_shard(shard_id, self.SHARD_IDS)
+        self.event_index = 0
+
+    def instantiate_shard(self, shard_id, shard_ids):
+        for other_shard_id in ['shard-1', 'shard-2', 'shard-3']:
+            self.shared_streams.setdefault(f'{SERVICE_STREAM_KEY}-handoff-{other_shard_id}', [])
+        mocked_streams_dict = dict(self.shared_streams, **{
+            SERVICE_STREAM_KEY: [],
+            f'cg-WindowManager-{shard_id}': {},
+        })
+        service_kwargs = dict(
+            TestWindowManager.GLOBAL_SERVICE_CONFIG,
+            stream_factory=MockedHandoffStreamFactory(mocked_dict=mocked_streams_dict),
+            sharding_configs={'shard_id': shard_id, 'shard_ids': shard_ids},
+        )
+        with patch('event_service_utils.tracing.jaeger.init_tracer'):
+            shard = WindowManager(**service_kwargs)
+        shard.tracer = MagicMock()
+        shard.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3]})
+        return shard
+
+    def write_to_data_streams(self, event_data):
+        self.event_index += 1
+        event_msg = (f'{self.event_index}-0', {'event': json.dumps(event_data)})
+        for shard in self.shards.values():
+            shard.service_stream.write_events(event_msg)
+
+    def send_vekg_event(self, buffer_stream_key):
+        self.write_to_data_streams({
+            'id': f'event-id-{self.event_index + 1}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+        })
+
+    def process_data(self, shard_ids=None):
+        for shard_id in shard_ids or self.shards.keys():
+            self.shards[shard_id].process_data()
+
+    def get_matcher_windows(self):
+        return [json.loads(event_msg['event']) for event_msg in self.shared_streams[MATCHER_STREAM_KEY]]
+
+    def test_shards_use_their_own_cmd_consumer_group(self):
+        self.assertEqual('WindowManager-shard-1', self.shards['shard-1'].name)
+        self.assertFalse(self.shards['shard-1'].ack_data_stream_events)
+
+    def test_each_window_is_only_built_by_the_shard_owning_its_buffer_stream(self):
+        buffer_stream_keys = [f'publisher-{i}' for i in range(10)]
+        for _ in range(3):
+            for buffer_stream_key in buffer_stream_keys:
+                self.send_vekg_event(buffer_stream_key)
+                self.process_data()
+        windows = self.get_matcher_windows()
+        self.assertEqual(10, len(windows))
+        self.assertSetEqual(
+            set(buffer_stream_keys), {window['vekg_stream'][0]['buffer_stream_key'] for window in windows}
+        )
+        ring = ConsistentHashRing(self.SHARD_IDS)
+        for window in windows:
+            buffer_stream_key = window['vekg_stream'][0]['buffer_stream_key']
+            self.assertTrue(window['id'].startswith(f'WindowManager-{ring.get_shard(buffer_stream_key)}:'))
+
+    def test_rebalance_hands_off_open_windows_to_new_shard(self):
+        new_shard_ids = self.SHARD_IDS + ['shard-3']
+        new_ring = ConsistentHashRing(new_shard_ids)
+        buffer_stream_key = next(
+            f'publisher-{i}' for i in range(100) if new_ring.get_shard(f'publisher-{i}') == 'shard-3'
+        )
+        self.shards['shard-3'] = self.instantiate_shard('shard-3', self.SHARD_IDS)
+        for _ in range(2):
+            self.send_vekg_event(buffer_stream_key)
+            self.process_data()
+
+        self.write_to_data_streams({'id': 'rebalance-1', 'shard_ids': new_shard_ids})
+        self.send_vekg_event(buffer_stream_key)
+        # the new shard reaches the rebalance first, so it holds the events until the handoffs arrive
+        self.process_data(['shard-3', 'shard-3'])
+        self.assertEqual(1, len(self.shards['shard-3'].held_data_events))
+        self.process_data(['shard-1', 'shard-2', 'shard-1', 'shard-2', 'shard-3'])
+
+        windows = self.get_matcher_windows()
+        self.assertEqual(1, len(windows))
+        self.assertTrue(windows[0]['id'].startswith('WindowManager-shard-3:'))
+        self.assertListEqual(['event-id-1', 'event-id-2', 'event-id-4'], [e['id'] for e in windows[0]['vekg_stream']])
+        self.assertIsNone(self.shards['shard-3'].pending_rebalance_id)
+        for shard in self.shards.values():
+            self.assertListEqual(list(new_shard_ids), list(shard.shard_ring.shard_ids))
+
+    def test_invalid_handoffs_are_ignored(self):
+        new_shard_ids = self.SHARD_IDS + ['shard-3']
+        self.shards['shard-3'] = self.instantiate_shard('shard-3', self.SHARD_IDS)
+        self.write_to_data_streams({'id': 'rebalance-1', 'shard_ids': new_shard_ids})
+        self.process_data(['shard-3', 'shard-2', 'shard-3'])
+        self.assertSetEqual({'shard-1'}, self.shards['shard-3'].pending_handoff_shard_ids)
+
+        event_data = {'id': 'handoff-1', 'rebalance_id': 'rebalance-1', 'shard_id': 'shard-1'}
+        self.shared_streams[f'{SERVICE_STREAM_KEY}-handoff-shard-3'].append(
+            ('1-0', {'event': json.dumps(event_data), 'window_states': b'not a window state'})
+        )
+        with self.assertLogs(self.shards['shard-3'].logger, level='ERROR'):
+            self.process_data(['shard-3'])
+        self.assertIsNone(self.shards['shard-3'].pending_rebalance_id)
+
+
+class TestWindowManagerWorkers(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        tracer_configs={'reporting_host': 'localhost', 'reporting_port': 6831},
+        worker_configs={'count': 2},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerWorkers, self).setUp()
+        self.service.worker_pool.start()
+
+    def tearDown(self):
+        self.service.worker_pool.stop(timeout=10)
+
+    def test_init_rejects_workers_with_claim_check(self):
+        self.service_config = dict(self.GLOBAL_SERVICE_CONFIG, claim_check_configs={'payload_ttl': 10})
+        with self.assertRaises(RuntimeError):
+            self.instantiate_service()
+
+    @patch('window_manager.service.ack_events')
+    def test_windows_are_built_by_workers_and_written_to_matcher_in_order(self, mocked_ack_events):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        event_data = {'id': 'cmd-1', 'query_id': 'query_id1', 'parsed_query': {'window': window}}
+        self.service.process_event_type('QueryCreated', event_data, {})
+
+        event_list = []
+        for i in range(8):
+            event_data = {
+                'id': f'event-id-{i}',
+                'vekg': {},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': f'publisher-{i % 2}',
+            }
+            event_list.append((f'{i}-0', {'event': json.dumps(event_data)}))
+        self.service.process_data_batch(event_list)
+        mocked_ack_events.assert_called_once_with(self.service.service_stream, [])
+
+        matcher_values = self.service.matcher_stream.mocked_values
+        acked_event_ids = []
+        mocked_ack_events.side_effect = lambda stream, event_ids: acked_event_ids.extend(event_ids)
+        for _ in range(100):
+            if len(acked_event_ids) == 8:
+                break
+            self.service.process_worker_outputs(timeout=0.1)
+        self.assertEqual(4, len(matcher_values))
+        self.assertListEqual(sorted(event_id for event_id, _ in event_list), sorted(acked_event_ids))
+        windows_event_ids = {}
+        for event_msg in matcher_values:
+            vekg_stream = json.loads(event_msg['event'])['vekg_stream']
+            buffer_stream_key = vekg_stream[0]['buffer_stream_key']
+            windows_event_ids.setdefault(buffer_stream_key, []).append([e['id'] for e in vekg_stream])
+        self.assertListEqual(
+            [['event-id-0', 'event-id-2'], ['event-id-4', 'event-id-6']], windows_event_ids['publisher-0']
+        )
+        self.assertListEqual(
+            [['event-id-1', 'event-id-3'], ['event-id-5', 'event-id-7']], windows_event_ids['publisher-1']
+        )
+
+
+def run_coroutine(coroutine):
+    # asyncio.run would unset the current event loop, which the (jaeger) tracers need when closed
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestWindowManagerMsgpackDeltaWireFormat(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        window_wire_format=MSGPACK_DELTA_FORMAT,
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        if msgpack is None:
+            self.skipTest('msgpack is not installed')
+        super(TestWindowManagerMsgpackDeltaWireFormat, self).setUp()
+
+    def test_init_rejects_unknown_wire_format(self):
+        self.service_config = dict(self.GLOBAL_SERVICE_CONFIG, window_wire_format='xml')
+        with self.assertRaises(ValueError):
+            self.instantiate_service()
+
+    def test_windows_are_sent_as_msgpack_deltas(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [3]})
+        events = [
+            {
+                'id': f'event-id-{i}',
+                'vekg': {'nodes': [['car1', {'label': 'car', 'bounding_box': [i, 0, 10 + i, 10]}]], 'edges': []},
+                'query_ids': ['query_id1'],
+                'buffer_stream_key': '12345',
+            }
+            for i in range(3)
+        ]
+        for event_data in events:
+            self.service.process_data_event(event_data, None)
+
+        self.assertEqual(1, len(self.service.matcher_stream.mocked_values))
+        event_msg = self.service.matcher_stream.mocked_values[0]
+        self.assertIsInstance(event_msg['vekg_stream'], bytes)
+        window_event = decode_window_msg(event_msg)
+        self.assertListEqual(events, window_event['vekg_stream'])
+        self.assertEqual('query_id1', window_event['query_id'])
+
+    @patch('window_manager.service.encode_window_frames', wraps=encode_window_frames)
+    def test_shared_windows_frames_are_encoded_once(self, mocked_encode_window_frames):
+        for query_id in ['query_id1', 'query_id2']:
+            self.service.add_query_window_action(query_id, {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        events = [
+            {'id': f'event-id-{i}', 'vekg': {}, 'query_ids': ['query_id1', 'query_id2'], 'buffer_stream_key': '1'}
+            for i in range(2)
+        ]
+        for event_data in events:
+            self.service.process_data_event(event_data, None)
+
+        self.assertEqual(1, mocked_encode_window_frames.call_count)
+        window_events = [decode_window_msg(event_msg) for event_msg in self.service.matcher_stream.mocked_values]
+        self.assertListEqual(['query_id1', 'query_id2'], [window_event['query_id'] for window_event in window_events])
+        self.assertListEqual([events, events], [window_event['vekg_stream'] for window_event in window_events])
+
+
+class TestWindowManagerTracing(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        tracing_configs={'sample_ratio': 1, 'max_linked_frames': 10},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def setUp(self):
+        super(TestWindowManagerTracing, self).setUp()
+        self.reporter = InMemoryReporter()
+        self.service.tracer = JaegerTracer('WindowManager', reporter=self.reporter, sampler=ConstSampler(True))
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+
+    def tearDown(self):
+        self.service.tracer.close()
+
+    def process_events(self, count):
+        for i in range(count):
+            event_data = {'id': f'event-id-{i}', 'vekg': {}, 'query_ids': ['query_id1'], 'buffer_stream_key': '1'}
+            self.service.process_data_events([(f'{i}-0', {'event': json.dumps(event_data)})])
+
+    def test_only_windows_have_spans(self):
+        self.process_events(4)
+        self.assertListEqual(
+            ['send_window_to_matcher'] * 2, [span.operation_name for span in self.reporter.get_spans()]
+        )
+        window_event = json.loads(self.service.matcher_stream.mocked_values[0]['event'])
+        self.assertIn('uber-trace-id', window_event['tracer']['headers'])
+
+    def test_unsampled_windows_have_no_spans(self):
+        self.service.trace_sampler.sample_ratio = 0
+        self.process_events(4)
+        self.assertListEqual([], self.reporter.get_spans())
+        self.assertEqual(2, len(self.service.matcher_stream.mocked_values))
+
+
+class MockedAsyncStream(object):
+    def __init__(self, event_list=None):
+        self.event_list = list(event_list or [])
+        self.acked_event_ids = []
+        self.written_events = []
+
+    async def read_events(self, count=1, block=None):
+        event_list = self.event_list[:count]
+        del self.event_list[:count]
+        return event_list
+
+    async def read_stream_events_list(self, count=1, block=None):
+        event_list = await self.read_events(count=count, block=block)
+        return [(b'QueryCreated', event_list)] if event_list else []
+
+    async def ack(self, *event_ids):
+        self.acked_event_ids.extend(event_ids)
+
+    async def write_events(self, key, event_msgs, **write_kwargs):
+        self.written_events.extend((key, event_msg) for event_msg in event_msgs)
+
+
+class TestWindowManagerAsyncio(MockedEventDrivenServiceStreamTestCase):
+    GLOBAL_SERVICE_CONFIG = dict(
+        TestWindowManager.GLOBAL_SERVICE_CONFIG,
+        run_mode='asyncio',
+        batch_configs={'max_size': 10},
+        memory_configs={'bufferstream_idle_timeout': 60},
+    )
+    SERVICE_CLS = WindowManager
+    MOCKED_CG_STREAM_DICT = {
+
+    }
+    MOCKED_STREAMS_DICT = {
+        SERVICE_STREAM_KEY: [],
+        'cg-WindowManager': MOCKED_CG_STREAM_DICT,
+    }
+
+    def make_event_tuple(self, index, buffer_stream_key='a'):
+        event_data = {
+            'id': f'event-id-{index}',
+            'vekg': {},
+            'query_ids': ['query_id1'],
+            'buffer_stream_key': buffer_stream_key,
+        }
+        return (f'{index}-0', {'event': json.dumps(event_data)})
+
+    def test_init_rejects_asyncio_with_window_workers(self):
+        self.service_config = dict(self.GLOBAL_SERVICE_CONFIG, worker_configs={'count': 2})
+        with self.assertRaises(RuntimeError):
+            self.instantiate_service()
+
+    def test_process_cmd_async_processes_query_commands(self):
+        window = {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]}
+        event_data = {'id': 'cmd-1', 'query_id': 'query_id1', 'parsed_query': {'window': window}}
+        cmd_stream = MockedAsyncStream([('1-0', {'event': json.dumps(event_data)})])
+        run_coroutine(self.service.process_cmd_async('default', cmd_stream))
+        self.assertIn('query_id1', self.service.query_windows)
+
+    def test_process_data_async_writes_windows_and_acks_batch(self):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        data_stream = MockedAsyncStream([self.make_event_tuple(i) for i in range(5)])
+        stream_writer = MockedAsyncStream()
+        run_coroutine(self.service.process_data_async(data_stream, stream_writer))
+
+        self.assertEqual(2, len(stream_writer.written_events))
+        self.assertEqual(MATCHER_STREAM_KEY, stream_writer.written_events[0][0])
+        self.assertListEqual([f'{i}-0' for i in range(5)], data_stream.acked_event_ids)
+        self.assertListEqual([], self.service.matcher_stream.mocked_values)
+        self.assertEqual('4-0', self.service.last_processed_event_id)
+
+    @patch('window_manager.service.time')
+    def test_process_timers_evicts_idle_buffer_streams_without_new_events(self, mocked_time):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        mocked_time.monotonic.return_value = 100
+        self.service.process_data_events([self.make_event_tuple(0)])
+        self.assertEqual(1, self.service.buffered_events_count)
+        mocked_time.monotonic.return_value = 160
+        self.service.process_timers()
+        self.assertEqual(0, self.service.buffered_events_count)
+        self.assertEqual(1, len(self.service.pending_matcher_event_msgs))
+
+    @patch('window_manager.service.time')
+    def test_get_next_timers_deadline_uses_the_earliest_deadline(self, mocked_time):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        self.service.next_metrics_refresh_time = 200
+        self.assertEqual(200, self.service.get_next_timers_deadline())
+        mocked_time.monotonic.return_value = 100
+        self.service.process_data_events([self.make_event_tuple(0)])
+        self.assertEqual(160, self.service.get_next_timers_deadline())
+
+    @patch('window_manager.service.time')
+    def test_wake_up_async_timers_only_for_an_earlier_deadline(self, mocked_time):
+        self.service.add_query_window_action('query_id1', {'window_type': 'TUMBLING_COUNT_WINDOW', 'args': [2]})
+        self.service.next_metrics_refresh_time = 200
+        mocked_time.monotonic.return_value = 100
+
+        async def wake_up():
+            self.service.async_timers_wakeup = asyncio.Event()
+            self.service.async_timers_deadline = 200
+            self.service.wake_up_async_timers()
+            woken_up_without_events = self.service.async_timers_wakeup.is_set()
+            self.service.process_data_events([self.make_event_tuple(0)])
+            self.service.wake_up_async_timers()
+            return woken_up_without_events, self.service.async_timers_wakeup.is_set()
+
+        self.assertEqual((False, True), run_coroutine(wake_up()))
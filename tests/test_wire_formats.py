@@ -0,0 +1,115 @@
+import json
+from unittest import TestCase, skipUnless
+
+from window_manager.lazy_events import parse_routing_fields
+from window_manager.wire_formats import (
+    MSGPACK_DELTA_FORMAT,
+    KeyTable,
+    add_delta_ops,
+    apply_delta_ops,
+    decode_window_frames,
+    decode_window_msg,
+    encode_window_frames,
+    encode_window_msg,
+)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def make_frame(index, objects=('car1', 'person1')):
+    return {
+        'id': f'event-id-{index}',
+        'buffer_stream_key': '12345',
+        'query_ids': ['query_id1'],
+        'vekg': {
+            'nodes': [
+                [object_id, {'label': object_id[:-1], 'bounding_box': [10 + index, 20, 30 + index, 40]}]
+                for object_id in objects
+            ],
+            'edges': [],
+        },
+    }
+
+
+class DeltaOpsTestCase(TestCase):
+    def get_delta(self, previous, current):
+        key_table = KeyTable()
+        ops = []
+        add_delta_ops(previous, current, [], ops, key_table)
+        return ops, key_table
+
+    def test_only_the_changed_values_are_in_the_delta(self):
+        ops, key_table = self.get_delta(make_frame(0), make_frame(1))
+        changed_keys = {key_table.keys[op[0][0]] for op in ops}
+        self.assertSetEqual({'id', 'vekg'}, changed_keys)
+        self.assertEqual(make_frame(1), apply_delta_ops(make_frame(0), ops, key_table))
+
+    def test_added_and_removed_keys(self):
+        previous = {'a': 1, 'b': {'c': 2}}
+        current = {'b': {'c': 2, 'd': 3}, 'e': None}
+        ops, key_table = self.get_delta(previous, current)
+        self.assertEqual(current, apply_delta_ops(previous, ops, key_table))
+
+    def test_lists_with_different_lengths_are_replaced(self):
+        previous = make_frame(0)
+        current = make_frame(0, objects=('car1', 'person1', 'car2'))
+        ops, key_table = self.get_delta(previous, current)
+        self.assertEqual(current, apply_delta_ops(previous, ops, key_table))
+
+    def test_previous_frame_is_not_modified(self):
+        previous = make_frame(0)
+        ops, key_table = self.get_delta(previous, make_frame(1))
+        apply_delta_ops(previous, ops, key_table)
+        self.assertEqual(make_frame(0), previous)
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+class WindowFramesTestCase(TestCase):
+    def test_frames_round_trip(self):
+        frames = [make_frame(0), make_frame(1), make_frame(2, objects=('car1',)), make_frame(3, objects=('car1',))]
+        self.assertListEqual(frames, decode_window_frames(encode_window_frames(frames)))
+
+    def test_empty_window(self):
+        self.assertListEqual([], decode_window_frames(encode_window_frames([])))
+
+    def test_lazy_events_are_decoded(self):
+        fields = ['id', 'query_ids', 'buffer_stream_key']
+        frames = [parse_routing_fields(json.dumps(make_frame(i)), fields) for i in range(3)]
+        self.assertListEqual([make_frame(i) for i in range(3)], decode_window_frames(encode_window_frames(frames)))
+
+    def test_delta_encoding_is_smaller_than_json(self):
+        frames = [make_frame(i) for i in range(20)]
+        self.assertLess(len(encode_window_frames(frames)), len(json.dumps(frames)) / 2)
+
+    def test_unsupported_version(self):
+        with self.assertRaises(ValueError):
+            decode_window_frames(msgpack.packb([99, [], None, []]))
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+class WindowMsgTestCase(TestCase):
+    def setUp(self):
+        self.event_data = {
+            'id': 'window-id-1',
+            'query_ids': ['query_id1'],
+            'vekg_stream': [make_frame(0), make_frame(1)],
+        }
+
+    def test_msg_envelope_is_json(self):
+        event_msg = encode_window_msg(self.event_data)
+        envelope = json.loads(event_msg['event'])
+        self.assertEqual(MSGPACK_DELTA_FORMAT, envelope['vekg_stream_format'])
+        self.assertNotIn('vekg_stream', envelope)
+        self.assertIsInstance(event_msg['vekg_stream'], bytes)
+
+    def test_decode_msg_read_from_redis(self):
+        event_msg = encode_window_msg(self.event_data)
+        json_msg = {b'event': event_msg['event'].encode('utf-8'), b'vekg_stream': event_msg['vekg_stream']}
+        self.assertDictEqual(self.event_data, decode_window_msg(json_msg))
+
+    def test_decode_json_msg(self):
+        json_msg = {'event': json.dumps(self.event_data)}
+        self.assertDictEqual(self.event_data, decode_window_msg(json_msg))
@@ -0,0 +1,60 @@
+import queue
+from unittest import TestCase
+
+from window_manager.workers import QueueStreamFactory, WindowWorkerPool
+
+
+class QueueStreamFactoryTestCase(TestCase):
+    def test_written_events_are_sent_to_output_queue(self):
+        output_queue = queue.Queue()
+        stream = QueueStreamFactory(output_queue).create('ma-data', stype='streamOnly')
+        stream.write_events({'event': '{}'}, {'event': '[]'})
+        self.assertEqual(('ma-data', [{'event': '{}'}, {'event': '[]'}]), output_queue.get_nowait())
+        self.assertListEqual([], list(stream.read_events(count=10)))
+
+
+class WindowWorkerPoolTestCase(TestCase):
+    def setUp(self):
+        self.worker_pool = WindowWorkerPool(3, {})
+
+    def test_get_worker_index_is_stable_for_buffer_stream_key(self):
+        worker_indexes = {self.worker_pool.get_worker_index(f'publisher-{i}') for i in range(30)}
+        self.assertSetEqual({0, 1, 2}, worker_indexes)
+        self.assertEqual(
+            self.worker_pool.get_worker_index('publisher-1'), self.worker_pool.get_worker_index('publisher-1')
+        )
+        self.assertEqual(0, self.worker_pool.get_worker_index(None))
+
+    def test_get_outputs_returns_everything_in_queue(self):
+        self.worker_pool.output_queue.put(('ma-data', [1]))
+        self.worker_pool.output_queue.put(('ma-data', [2]))
+        outputs = []
+        while len(outputs) < 2:
+            # items put in a multiprocessing queue can take a moment to be available
+            outputs.extend(self.worker_pool.get_outputs(timeout=1))
+        self.assertListEqual([('ma-data', [1]), ('ma-data', [2])], outputs)
+        self.assertListEqual([], self.worker_pool.get_outputs(timeout=0.01))
+
+    def test_broadcast_tasks_are_sent_before_the_next_data_events(self):
+        self.worker_pool.broadcast('add_query', 'query_id1', {})
+        self.assertTrue(self.worker_pool.event_queues[0].empty())
+        self.worker_pool.send_data_events([[('1-0', {})], [], []])
+        self.assertListEqual(
+            [('add_query', ('query_id1', {})), ('data', [('1-0', {})])],
+            self.worker_pool.event_queues[0].get(timeout=1)
+        )
+        self.assertListEqual([('add_query', ('query_id1', {}))], self.worker_pool.event_queues[1].get(timeout=1))
+        self.worker_pool.send_data_events([[], [('2-0', {})], []])
+        self.assertListEqual([('data', [('2-0', {})])], self.worker_pool.event_queues[1].get(timeout=1))
+        self.assertListEqual([('add_query', ('query_id1', {}))], self.worker_pool.event_queues[2].get(timeout=1))
+
+    def test_queues_are_bounded(self):
+        worker_pool = WindowWorkerPool(2, {}, queue_size=1)
+        worker_pool.send_data_events([[('1-0', {})], []])
+        with self.assertRaises(queue.Full):
+            worker_pool.event_queues[0].put([], timeout=0.01)
+        worker_pool.event_queues[1].put([], timeout=0.01)
+        worker_pool.output_queue.put(('ma-data', [1]), timeout=0.01)
+        worker_pool.output_queue.put(('ma-data', [2]), timeout=0.01)
+        with self.assertRaises(queue.Full):
+            worker_pool.output_queue.put(('ma-data', [3]), timeout=0.01)
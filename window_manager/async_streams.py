@@ -0,0 +1,69 @@
+from redis.exceptions import ResponseError
+
+
+def create_async_redis_client(redis_db):
+    # async client connected to the same redis as the (walrus) database of the stream factory
+    import redis.asyncio
+
+    connection_kwargs = redis_db.connection_pool.connection_kwargs
+    return redis.asyncio.Redis(
+        host=connection_kwargs.get('host', 'localhost'),
+        port=connection_kwargs.get('port', 6379),
+        db=connection_kwargs.get('db', 0),
+        password=connection_kwargs.get('password'),
+    )
+
+
+class AsyncConsumerGroupStream(object):
+    # Async version of the consumer group streams, using the same group and consumer names,
+    # so the service can switch between the thread and asyncio run modes
+
+    def __init__(self, redis_client, keys, group_name, block=0):
+        self.redis_client = redis_client
+        self.keys = list(keys)
+        self.group_name = group_name
+        self.consumer_name = f'{group_name}.c1'
+        self.block = block
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}({self.keys}, "{self.group_name}")'
+
+    async def create_group(self):
+        for key in self.keys:
+            try:
+                await self.redis_client.xgroup_create(key, self.group_name, id='$', mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    async def read_stream_events_list(self, count=1, block=None):
+        if block is None:
+            block = self.block
+        streams_events_list = await self.redis_client.xreadgroup(
+            self.group_name, self.consumer_name, {key: '>' for key in self.keys}, count=count, block=block
+        )
+        return streams_events_list or []
+
+    async def read_events(self, count=1, block=None):
+        event_list = []
+        for _, stream_event_list in await self.read_stream_events_list(count=count, block=block):
+            event_list.extend(stream_event_list)
+        return event_list
+
+    async def ack(self, *event_ids):
+        if event_ids:
+            await self.redis_client.xack(self.keys[0], self.group_name, *event_ids)
+
+
+class AsyncStreamWriter(object):
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+
+    async def write_events(self, key, event_msgs, **write_kwargs):
+        # a single round trip for all the events
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for event_msg in event_msgs:
+            pipeline.xadd(key, event_msg, **write_kwargs)
+        return await pipeline.execute()
@@ -0,0 +1,224 @@
+import base64
+import json
+import os
+import threading
+import time
+
+from window_manager.stream_utils import write_events_pipelined
+
+BACKPRESSURE_ACTIONS = ('pause', 'trim', 'spill')
+
+
+def get_stream_backlog(stream):
+    # events of the stream not processed yet by its slowest consumer group (or the stream length,
+    # if it has no consumer groups or redis doesn't report their lag). Mocked streams return their length
+    redis_db = getattr(stream, 'redis_db', None)
+    if redis_db is None:
+        mocked_values = getattr(stream, 'mocked_values', None)
+        return len(mocked_values) if mocked_values is not None else None
+    groups = redis_db.xinfo_groups(stream.key)
+    if groups and all(group.get('lag') is not None for group in groups):
+        return max(group['lag'] + group['pending'] for group in groups)
+    return redis_db.xlen(stream.key)
+
+
+def trim_stream(stream, max_length):
+    # approximate trim (whole radix tree nodes) for redis streams, returns the number of trimmed events
+    redis_db = getattr(stream, 'redis_db', None)
+    if redis_db is not None:
+        return redis_db.xtrim(stream.key, maxlen=max_length, approximate=True)
+    mocked_values = getattr(stream, 'mocked_values', None)
+    if mocked_values is None or len(mocked_values) <= max_length:
+        return 0
+    trimmed_events_count = len(mocked_values) - max_length
+    del mocked_values[:trimmed_events_count]
+    return trimmed_events_count
+
+
+def encode_spilled_msg(event_msg):
+    # binary fields (eg: the msgpack-delta windows) are kept as {"base64": ...}
+    return json.dumps({
+        field: {'base64': base64.b64encode(value).decode('ascii')} if isinstance(value, bytes) else value
+        for field, value in event_msg.items()
+    })
+
+
+def decode_spilled_msg(line):
+    return {
+        field: base64.b64decode(value['base64']) if isinstance(value, dict) else value
+        for field, value in json.loads(line).items()
+    }
+
+
+class SpillFile(object):
+    # append-only file with one json event msg per line, read back in order. It's truncated once all the events
+    # were read, and the read offset is saved next to it (`<path>.offset`), so after a restart only the events
+    # not read yet are read. It's written and read by different threads (eg: with window workers), so it's locked
+
+    def __init__(self, path):
+        self.path = path
+        self.offset_path = f'{path}.offset'
+        self.lock = threading.Lock()
+        self.read_offset = 0
+        self.pending_count = 0
+        if os.path.exists(path):
+            self.read_offset = self.load_read_offset()
+            if self.read_offset > os.path.getsize(path):
+                # stopped after truncating the file, but before removing the offset
+                self.read_offset = 0
+            with open(path, 'rb') as spill_file:
+                spill_file.seek(self.read_offset)
+                self.pending_count = sum(1 for _ in spill_file)
+
+    def __len__(self):
+        with self.lock:
+            return self.pending_count
+
+    def load_read_offset(self):
+        try:
+            with open(self.offset_path, 'r') as offset_file:
+                return int(offset_file.read())
+        except (OSError, ValueError):
+            return 0
+
+    def save_read_offset(self):
+        tmp_path = f'{self.offset_path}.tmp'
+        with open(tmp_path, 'w') as offset_file:
+            offset_file.write(str(self.read_offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def append(self, event_msgs):
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as spill_file:
+                spill_file.writelines(f'{encode_spilled_msg(event_msg)}\n' for event_msg in event_msgs)
+            self.pending_count += len(event_msgs)
+
+    def read(self, count):
+        with self.lock:
+            event_msgs = []
+            with open(self.path, 'rb') as spill_file:
+                spill_file.seek(self.read_offset)
+                while len(event_msgs) < count:
+                    line = spill_file.readline()
+                    if not line:
+                        break
+                    event_msgs.append(decode_spilled_msg(line.decode('utf-8')))
+                self.read_offset = spill_file.tell()
+            self.pending_count -= len(event_msgs)
+            if self.pending_count <= 0:
+                self.pending_count = 0
+                self.read_offset = 0
+                open(self.path, 'w').close()
+                if os.path.exists(self.offset_path):
+                    os.remove(self.offset_path)
+            elif event_msgs:
+                self.save_read_offset()
+            return event_msgs
+
+
+class BackpressureStream(object):
+    # Output stream wrapper that checks (every `check_interval` seconds) the backlog of the stream, which is
+    # backpressured from `max_backlog` events until it's under `resume_ratio` of it. While backpressured:
+    #  - "pause": the writes go on, and the service stops reading new events (see `is_intake_paused`).
+    #  - "trim": the stream is trimmed to about `max_backlog` events, dropping the oldest ones.
+    #  - "spill": the writes go to a local spill file, and are written to the stream once it has room again.
+
+    def __init__(self, stream, max_backlog, action='pause', check_interval=1, resume_ratio=0.8, spill_path=None,
+                 logger=None, metrics=None):
+        if action not in BACKPRESSURE_ACTIONS:
+            raise ValueError(f'Invalid backpressure action "{action}", should be one of: {BACKPRESSURE_ACTIONS}')
+        if action == 'spill' and not spill_path:
+            raise ValueError('The "spill" backpressure action needs a spill path')
+        self.stream = stream
+        self.key = stream.key
+        self.max_backlog = max_backlog
+        self.action = action
+        self.check_interval = check_interval
+        self.resume_ratio = resume_ratio
+        self.spill_file = SpillFile(spill_path) if action == 'spill' else None
+        self.logger = logger
+        self.metrics = metrics
+        self.is_backpressured = False
+        self.backlog = 0
+        self.next_check_time = 0
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}({self.stream}, max_backlog={self.max_backlog}, action="{self.action}")'
+
+    @property
+    def default_write_kwargs(self):
+        return getattr(self.stream, 'default_write_kwargs', {})
+
+    @property
+    def spilled_events_count(self):
+        return len(self.spill_file) if self.spill_file is not None else 0
+
+    def log(self, level, message):
+        if self.logger is not None:
+            getattr(self.logger, level)(message)
+
+    def inc_counter(self, metric_name, amount):
+        if self.metrics is not None and amount:
+            getattr(self.metrics, metric_name).labels(self.key).inc(amount)
+
+    def check(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        if now < self.next_check_time:
+            return self.is_backpressured
+        self.next_check_time = now + self.check_interval
+        try:
+            backlog = get_stream_backlog(self.stream)
+        except Exception as e:
+            self.log('warning', f'Could not get the backlog of the output stream "{self.key}": {e}')
+            return self.is_backpressured
+        if backlog is None:
+            return self.is_backpressured
+        self.backlog = backlog
+        if not self.is_backpressured and backlog >= self.max_backlog:
+            self.is_backpressured = True
+            self.inc_counter('output_backpressure_starts', 1)
+            self.log('warning', f'Output stream "{self.key}" is {backlog} events behind, backpressure: {self.action}')
+        elif self.is_backpressured and backlog < self.max_backlog * self.resume_ratio:
+            self.is_backpressured = False
+            self.log('info', f'Output stream "{self.key}" is back to {backlog} events behind')
+        if self.is_backpressured and self.action == 'trim':
+            trimmed_events_count = trim_stream(self.stream, self.max_backlog)
+            self.inc_counter('output_trimmed_events', trimmed_events_count)
+            self.backlog -= trimmed_events_count
+        if not self.is_backpressured and self.spilled_events_count:
+            self.replay_spilled_events()
+        return self.is_backpressured
+
+    def is_intake_paused(self):
+        return self.action == 'pause' and self.check()
+
+    def replay_spilled_events(self):
+        # only up to the room left in the stream, the rest is replayed on the next checks
+        room = int(self.max_backlog * self.resume_ratio) - self.backlog
+        if room <= 0:
+            return
+        event_msgs = self.spill_file.read(room)
+        if event_msgs:
+            write_events_pipelined(self.stream, event_msgs)
+            self.backlog += len(event_msgs)
+            self.log('info', f'Wrote {len(event_msgs)} spilled events to output stream "{self.key}"')
+
+    def get_events_to_write(self, event_msgs):
+        # the events that can be written to the stream now, the others are spilled
+        self.check()
+        if self.spill_file is None:
+            return event_msgs
+        if self.is_backpressured or self.spilled_events_count:
+            # while there are spilled events the new ones are spilled too, so they are written in order
+            self.spill_file.append(event_msgs)
+            self.inc_counter('output_spilled_events', len(event_msgs))
+            return []
+        return event_msgs
+
+    def write_events(self, *events):
+        event_msgs = self.get_events_to_write(list(events))
+        if not event_msgs:
+            return []
+        return write_events_pipelined(self.stream, event_msgs)
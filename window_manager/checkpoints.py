@@ -0,0 +1,186 @@
+import json
+import os
+import zlib
+
+from window_manager.lazy_events import LazyVEKGEvent
+
+# version of the json states format, increased on incompatible changes
+STATE_FORMAT_VERSION = 1
+# key of the objects that hold a lazy event (in the lists of events)
+LAZY_EVENT_KEY = '__lazy_event__'
+
+
+def to_json_state(value):
+    # the states are plain json values, except for the lazy events, which are kept as their raw json. Events are
+    # only found in lists, and the plain dicts in lists (eg: decoded events) are kept as they are, without walking them
+    if isinstance(value, LazyVEKGEvent):
+        routing_fields = None if value.is_decoded else dict(value)
+        return {LAZY_EVENT_KEY: [value.raw_json, routing_fields, list(value.absent_fields)]}
+    if isinstance(value, (list, tuple)):
+        return [item if type(item) is dict else to_json_state(item) for item in value]
+    if isinstance(value, dict):
+        return {key: to_json_state(item) for key, item in value.items()}
+    return value
+
+
+def from_json_list_item(item):
+    if type(item) is not dict:
+        return from_json_state(item)
+    lazy_event = item.get(LAZY_EVENT_KEY)
+    if lazy_event is None:
+        return item
+    raw_json, routing_fields, absent_fields = lazy_event
+    return LazyVEKGEvent(raw_json, routing_fields, tuple(absent_fields))
+
+
+def from_json_state(value):
+    if isinstance(value, list):
+        return [from_json_list_item(item) for item in value]
+    if isinstance(value, dict):
+        return {key: from_json_state(item) for key, item in value.items()}
+    return value
+
+
+def encode_json_state(state):
+    json_state = {'version': STATE_FORMAT_VERSION, 'state': to_json_state(state)}
+    return zlib.compress(json.dumps(json_state).encode('utf-8'))
+
+
+def decode_json_state(data):
+    json_state = json.loads(zlib.decompress(data).decode('utf-8'))
+    if json_state.get('version') != STATE_FORMAT_VERSION:
+        raise ValueError(f'Unsupported state format version: {json_state.get("version")}')
+    return from_json_state(json_state['state'])
+
+
+class FileCheckpointStorage(object):
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}("{self.path}")'
+
+    def write(self, name, data):
+        file_path = os.path.join(self.path, name)
+        tmp_file_path = f'{file_path}.tmp'
+        with open(tmp_file_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file_path, file_path)
+
+    def read(self, name):
+        with open(os.path.join(self.path, name), 'rb') as f:
+            return f.read()
+
+    def list_names(self):
+        return sorted(name for name in os.listdir(self.path) if not name.endswith('.tmp'))
+
+    def delete(self, name):
+        os.remove(os.path.join(self.path, name))
+
+
+class RedisCheckpointStorage(object):
+
+    def __init__(self, redis_db, key):
+        self.redis_db = redis_db
+        self.key = key
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}("{self.key}")'
+
+    def write(self, name, data):
+        self.redis_db.hset(self.key, name, data)
+
+    def read(self, name):
+        return self.redis_db.hget(self.key, name)
+
+    def list_names(self):
+        return sorted(name.decode('utf-8') for name in self.redis_db.hkeys(self.key))
+
+    def delete(self, name):
+        self.redis_db.hdel(self.key, name)
+
+
+def create_checkpoint_storage(stream_factory, key, path=None):
+    if path:
+        return FileCheckpointStorage(path)
+    redis_db = getattr(stream_factory, 'redis_db', None)
+    if redis_db is None:
+        raise RuntimeError('Checkpoints need either a path or a stream factory with a redis connection.')
+    return RedisCheckpointStorage(redis_db=redis_db, key=key)
+
+
+class WindowStateCheckpointer(object):
+    # Writes a full checkpoint followed by up to `max_deltas` incremental ones (only the buffer streams
+    # changed since the previous checkpoint), then starts over with a new full checkpoint.
+    # Every checkpoint is a dict with:
+    #  - last_event_id: the last data event processed
+    #  - queries: query_id -> window spec key
+    #  - removed_window_spec_keys: window specs whose controller was removed (only on deltas)
+    #  - controller_states: window spec key -> controller level state
+    #  - bufferstream_states: window spec key -> {buffer_stream_key: state, or None if it was removed}
+
+    def __init__(self, storage, max_deltas):
+        self.storage = storage
+        self.max_deltas = max_deltas
+        self.sequence = 0
+        self.deltas_since_full = None
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}({self.storage}, sequence={self.sequence})'
+
+    def needs_full_checkpoint(self):
+        return self.deltas_since_full is None or self.deltas_since_full >= self.max_deltas
+
+    def encode(self, checkpoint):
+        return encode_json_state(checkpoint)
+
+    def decode(self, data):
+        return decode_json_state(data)
+
+    def write(self, checkpoint, is_full):
+        self.sequence += 1
+        checkpoint_type = 'full' if is_full else 'delta'
+        name = f'{self.sequence:012d}-{checkpoint_type}'
+        self.storage.write(name, self.encode(checkpoint))
+        if is_full:
+            for old_name in self.storage.list_names():
+                if old_name < name:
+                    self.storage.delete(old_name)
+            self.deltas_since_full = 0
+        else:
+            self.deltas_since_full += 1
+        return name
+
+    def apply_delta(self, checkpoint, delta):
+        checkpoint['last_event_id'] = delta['last_event_id']
+        checkpoint['queries'] = delta['queries']
+        for window_spec_key in delta['removed_window_spec_keys']:
+            checkpoint['controller_states'].pop(window_spec_key, None)
+            checkpoint['bufferstream_states'].pop(window_spec_key, None)
+        checkpoint['controller_states'].update(delta['controller_states'])
+        for window_spec_key, bufferstream_states in delta['bufferstream_states'].items():
+            checkpoint_bufferstream_states = checkpoint['bufferstream_states'].setdefault(window_spec_key, {})
+            for buffer_stream_key, state in bufferstream_states.items():
+                if state is None:
+                    checkpoint_bufferstream_states.pop(buffer_stream_key, None)
+                else:
+                    checkpoint_bufferstream_states[buffer_stream_key] = state
+
+    def load(self):
+        names = self.storage.list_names()
+        full_names = [name for name in names if name.endswith('-full')]
+        if not full_names:
+            return None
+        last_full_name = full_names[-1]
+        checkpoint = self.decode(self.storage.read(last_full_name))
+        delta_names = [name for name in names if name > last_full_name and name.endswith('-delta')]
+        for delta_name in delta_names:
+            self.apply_delta(checkpoint, self.decode(self.storage.read(delta_name)))
+        self.sequence = int(names[-1].split('-')[0])
+        self.deltas_since_full = len(delta_names)
+        return checkpoint
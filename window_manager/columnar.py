@@ -0,0 +1,211 @@
+import sys
+
+from window_manager.merged_graphs import FRAME_FIELDS
+
+
+def get_numpy():
+    # optional dependency, only needed for the "columnar" aggregation
+    import numpy
+    return numpy
+
+
+def intern_value(value):
+    # node ids and labels repeat in every frame, so the strings are shared instead of kept once per frame
+    return sys.intern(value) if type(value) is str else value
+
+
+def intern_edge(edge):
+    edge_attributes = edge[2] if len(edge) > 2 else {}
+    return [
+        intern_value(edge[0]),
+        intern_value(edge[1]),
+        {key: intern_value(value) for key, value in edge_attributes.items()},
+    ]
+
+
+def column_to_list(array):
+    # json friendly list, with None for the missing values (NaN)
+    numpy = get_numpy()
+    values = array.astype(object)
+    values[numpy.isnan(array)] = None
+    return values.tolist()
+
+
+class ColumnarWindow(object):
+    # Window that extracts the configured numeric node attributes of its frames into preallocated numpy
+    # arrays (one row for each node of each frame), so the window filters and aggregations can be vectorized.
+    # The frames only keep their routing fields and the rest of their VEKG (the node ids and the other node
+    # attributes, and the edges), with their strings interned. The arrays have room for `frames_capacity` frames
+    # with as many nodes as the first one, and double their size when they are full.
+    # Scalar attributes are 1-d columns and list attributes (eg: bounding boxes) 2-d columns, shaped by the
+    # first value seen. Missing values are NaN, and values that don't fit in the column are kept in the frame.
+    window_field = 'vekg_columnar'
+
+    def __init__(self, column_names, frames_capacity=1):
+        self.column_names = tuple(column_names)
+        self.frames_capacity = max(1, frames_capacity)
+        self.frames = []
+        self.rows_count = 0
+        self.rows_capacity = 0
+        # row -> index (in `frames`) of the frame of the node
+        self.frame_indexes = None
+        # column name -> array, created with the first value of the column
+        self.columns = {}
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}(frames={len(self.frames)}, rows={self.rows_count}, columns={self.column_names})'
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, ColumnarWindow):
+            return NotImplemented
+        numpy = get_numpy()
+        if (self.column_names, self.frames, self.rows_count) != (other.column_names, other.frames, other.rows_count):
+            return False
+        if self.rows_count and not numpy.array_equal(self.get_frame_indexes(), other.get_frame_indexes()):
+            return False
+        return all(
+            numpy.array_equal(self.get_column(column_name), other.get_column(column_name), equal_nan=True)
+            for column_name in self.column_names
+        )
+
+    def reserve_rows(self, rows_count):
+        numpy = get_numpy()
+        if self.frame_indexes is None:
+            self.rows_capacity = max(1, rows_count) * self.frames_capacity
+            self.frame_indexes = numpy.empty(self.rows_capacity, dtype=numpy.int32)
+            return
+        if self.rows_count + rows_count <= self.rows_capacity:
+            return
+        self.rows_capacity = max(self.rows_capacity * 2, self.rows_count + rows_count)
+        frame_indexes = numpy.empty(self.rows_capacity, dtype=numpy.int32)
+        frame_indexes[:self.rows_count] = self.frame_indexes[:self.rows_count]
+        self.frame_indexes = frame_indexes
+        for column_name, column in self.columns.items():
+            self.columns[column_name] = self.new_column(column.shape[1:], column[:self.rows_count])
+
+    def new_column(self, row_shape, rows=None):
+        numpy = get_numpy()
+        column = numpy.full((self.rows_capacity,) + tuple(row_shape), numpy.nan)
+        if rows is not None:
+            column[:len(rows)] = rows
+        return column
+
+    def get_row_shape(self, value):
+        return (len(value),) if isinstance(value, (list, tuple)) else ()
+
+    def set_column_values(self, column_name, start_row, values, nodes):
+        column = self.columns.get(column_name)
+        if column is None:
+            first_value = next(value for value in values if value is not None)
+            column = self.columns[column_name] = self.new_column(self.get_row_shape(first_value))
+        rows = column[start_row:start_row + len(values)]
+        row_shape = column.shape[1:]
+        missing_value = get_numpy().nan if not row_shape else [get_numpy().nan] * row_shape[0]
+        try:
+            rows[:] = [value if value is not None else missing_value for value in values]
+            return
+        except (TypeError, ValueError):
+            pass
+        # slow path, only for frames with values that don't fit in the column
+        for row_index, value in enumerate(values):
+            if value is None:
+                continue
+            try:
+                if self.get_row_shape(value) != row_shape:
+                    raise ValueError()
+                rows[row_index] = value
+            except (TypeError, ValueError):
+                rows[row_index] = get_numpy().nan
+                nodes[row_index][1][column_name] = value
+
+    def append(self, event_data):
+        frame_index = len(self.frames)
+        frame = {field: event_data[field] for field in FRAME_FIELDS if field in event_data}
+        vekg = event_data.get('vekg') or {}
+        event_nodes = vekg.get('nodes', ())
+        self.reserve_rows(len(event_nodes))
+        nodes = []
+        column_values = {column_name: [] for column_name in self.column_names}
+        for node in event_nodes:
+            node_attributes = node[1] if len(node) > 1 else {}
+            for column_name, values in column_values.items():
+                values.append(node_attributes.get(column_name))
+            nodes.append([
+                intern_value(node[0]),
+                {
+                    key: intern_value(value) for key, value in node_attributes.items()
+                    if key not in column_values
+                },
+            ])
+        start_row = self.rows_count
+        self.frame_indexes[start_row:start_row + len(nodes)] = frame_index
+        for column_name, values in column_values.items():
+            if any(value is not None for value in values):
+                self.set_column_values(column_name, start_row, values, nodes)
+        self.rows_count += len(nodes)
+        frame['vekg'] = dict(vekg, nodes=nodes, edges=[intern_edge(edge) for edge in vekg.get('edges', ())])
+        self.frames.append(frame)
+
+    def get_frame_indexes(self):
+        if self.frame_indexes is None:
+            return get_numpy().empty(0, dtype=get_numpy().int32)
+        return self.frame_indexes[:self.rows_count]
+
+    def get_column(self, column_name):
+        # view of the filled rows of the column (all NaN if no node had the attribute)
+        column = self.columns.get(column_name)
+        if column is None:
+            return get_numpy().full(self.rows_count, get_numpy().nan)
+        return column[:self.rows_count]
+
+    def copy(self):
+        window = ColumnarWindow(self.column_names, self.frames_capacity)
+        window.frames = list(self.frames)
+        window.rows_count = self.rows_count
+        window.rows_capacity = self.rows_capacity
+        if self.frame_indexes is not None:
+            window.frame_indexes = self.frame_indexes.copy()
+        window.columns = {column_name: column.copy() for column_name, column in self.columns.items()}
+        return window
+
+    def get_state(self):
+        # json friendly state (only the filled rows), restored with set_state
+        return {
+            'frames': list(self.frames),
+            'frame_indexes': self.get_frame_indexes().tolist(),
+            'columns': {
+                column_name: column_to_list(column[:self.rows_count]) for column_name, column in self.columns.items()
+            },
+        }
+
+    def set_state(self, state):
+        numpy = get_numpy()
+        self.frames = list(state['frames'])
+        self.rows_count = self.rows_capacity = len(state['frame_indexes'])
+        self.frame_indexes = None
+        self.columns = {}
+        if not self.rows_count:
+            return
+        self.frame_indexes = numpy.array(state['frame_indexes'], dtype=numpy.int32)
+        self.columns = {
+            column_name: numpy.array(values, dtype=float) for column_name, values in state['columns'].items()
+        }
+
+    def to_dict(self):
+        return {
+            'frames': [{k: v for k, v in frame.items() if k != 'query_ids'} for frame in self.frames],
+            'frame_indexes': self.get_frame_indexes().tolist(),
+            'columns': {
+                column_name: column_to_list(self.get_column(column_name)) for column_name in self.column_names
+            },
+        }
@@ -1,6 +1,6 @@
 import os
 
-from decouple import config
+from decouple import config, Csv
 
 SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(SOURCE_DIR)
@@ -10,10 +10,77 @@ REDIS_PORT = config('REDIS_PORT', default='6379')
 
 TRACER_REPORTING_HOST = config('TRACER_REPORTING_HOST', default='localhost')
 TRACER_REPORTING_PORT = config('TRACER_REPORTING_PORT', default='6831')
+TRACER_REPORTER_BATCH_SIZE = config('TRACER_REPORTER_BATCH_SIZE', default=100, cast=int)
+TRACER_REPORTER_FLUSH_INTERVAL = config('TRACER_REPORTER_FLUSH_INTERVAL', default=1, cast=float)
+# ratio of the windows traced (0 disables tracing), linking up to TRACING_MAX_LINKED_FRAMES of their frames
+TRACING_SAMPLE_RATIO = config('TRACING_SAMPLE_RATIO', default=1.0, cast=float)
+TRACING_MAX_LINKED_FRAMES = config('TRACING_MAX_LINKED_FRAMES', default=10, cast=int)
 
 SERVICE_STREAM_KEY = config('SERVICE_STREAM_KEY')
 MATCHER_STREAM_KEY = config('MATCHER_STREAM_KEY')
 
+CLAIM_CHECK_ENABLED = config('CLAIM_CHECK_ENABLED', default=False, cast=bool)
+CLAIM_CHECK_PAYLOAD_TTL = config('CLAIM_CHECK_PAYLOAD_TTL', default=300, cast=int)
+
+RAW_PASSTHROUGH_ENABLED = config('RAW_PASSTHROUGH_ENABLED', default=False, cast=bool)
+
+DATA_BATCH_MAX_SIZE = config('DATA_BATCH_MAX_SIZE', default=1, cast=int)
+DATA_BATCH_MAX_LINGER_MS = config('DATA_BATCH_MAX_LINGER_MS', default=0, cast=int)
+
+# 0 means no limit
+MAX_BUFFERED_EVENTS_PER_STREAM = config('MAX_BUFFERED_EVENTS_PER_STREAM', default=0, cast=int)
+MAX_BUFFERED_EVENTS = config('MAX_BUFFERED_EVENTS', default=0, cast=int)
+BUFFERSTREAM_IDLE_TIMEOUT = config('BUFFERSTREAM_IDLE_TIMEOUT', default=0, cast=int)
+
+CHECKPOINT_ENABLED = config('CHECKPOINT_ENABLED', default=False, cast=bool)
+CHECKPOINT_INTERVAL = config('CHECKPOINT_INTERVAL', default=10, cast=int)
+CHECKPOINT_MAX_DELTAS = config('CHECKPOINT_MAX_DELTAS', default=10, cast=int)
+# empty path means the checkpoints are stored in redis
+CHECKPOINT_PATH = config('CHECKPOINT_PATH', default='')
+
+# empty shard id means sharding is disabled
+SHARD_ID = config('SHARD_ID', default='')
+SHARD_IDS = config('SHARD_IDS', default='', cast=Csv())
+SHARD_VIRTUAL_NODES = config('SHARD_VIRTUAL_NODES', default=64, cast=int)
+SHARD_HANDOFF_TIMEOUT = config('SHARD_HANDOFF_TIMEOUT', default=30, cast=int)
+
+# number of worker processes building the windows (0 or 1 means the windows are built in the service process)
+WINDOW_WORKERS = config('WINDOW_WORKERS', default=0, cast=int)
+# max batches of events waiting in the queue of each worker, the service stops reading events when it's full
+WINDOW_WORKERS_QUEUE_SIZE = config('WINDOW_WORKERS_QUEUE_SIZE', default=100, cast=int)
+
+# "threads" or "asyncio"
+RUN_MODE = config('RUN_MODE', default='threads')
+
+# 0 disables the metrics http endpoint, and the periodic metrics logging
+METRICS_PORT = config('METRICS_PORT', default=0, cast=int)
+METRICS_DUMP_INTERVAL = config('METRICS_DUMP_INTERVAL', default=0, cast=int)
+METRICS_REFRESH_INTERVAL = config('METRICS_REFRESH_INTERVAL', default=5, cast=int)
+# timings are only measured once every METRICS_SAMPLE_EVERY calls
+METRICS_SAMPLE_EVERY = config('METRICS_SAMPLE_EVERY', default=100, cast=int)
+
+# comma separated list of "sample", "coalesce" and "drop_low_priority" (empty disables the load shedding)
+LOAD_SHEDDING_POLICIES = config('LOAD_SHEDDING_POLICIES', default='', cast=Csv())
+# 0 disables each limit
+LOAD_SHEDDING_MAX_INPUT_LAG = config('LOAD_SHEDDING_MAX_INPUT_LAG', default=5, cast=float)
+LOAD_SHEDDING_MAX_EVENT_PROCESSING_MS = config('LOAD_SHEDDING_MAX_EVENT_PROCESSING_MS', default=0, cast=float)
+LOAD_SHEDDING_RECOVERY_RATIO = config('LOAD_SHEDDING_RECOVERY_RATIO', default=0.5, cast=float)
+LOAD_SHEDDING_CHECK_INTERVAL = config('LOAD_SHEDDING_CHECK_INTERVAL', default=1, cast=float)
+LOAD_SHEDDING_SAMPLE_EVERY = config('LOAD_SHEDDING_SAMPLE_EVERY', default=2, cast=int)
+LOAD_SHEDDING_COALESCE_SIMILARITY = config('LOAD_SHEDDING_COALESCE_SIMILARITY', default=0.9, cast=float)
+LOAD_SHEDDING_LOW_PRIORITY_QUERY_IDS = config('LOAD_SHEDDING_LOW_PRIORITY_QUERY_IDS', default='', cast=Csv())
+
+# 0 disables the backpressure of the output (matcher) stream
+OUTPUT_MAX_BACKLOG = config('OUTPUT_MAX_BACKLOG', default=0, cast=int)
+# "pause", "trim" or "spill"
+OUTPUT_BACKPRESSURE_ACTION = config('OUTPUT_BACKPRESSURE_ACTION', default='pause')
+OUTPUT_BACKPRESSURE_CHECK_INTERVAL = config('OUTPUT_BACKPRESSURE_CHECK_INTERVAL', default=1, cast=float)
+OUTPUT_BACKPRESSURE_RESUME_RATIO = config('OUTPUT_BACKPRESSURE_RESUME_RATIO', default=0.8, cast=float)
+OUTPUT_SPILL_DIR = config('OUTPUT_SPILL_DIR', default='')
+
+# "json" or "msgpack-delta" (needs the msgpack package)
+WINDOW_WIRE_FORMAT = config('WINDOW_WIRE_FORMAT', default='json')
+
 LISTEN_EVENT_TYPE_QUERY_CREATED = config('LISTEN_EVENT_TYPE_QUERY_CREATED')
 LISTEN_EVENT_TYPE_QUERY_REMOVED = config('LISTEN_EVENT_TYPE_QUERY_REMOVED')
 
@@ -0,0 +1,61 @@
+import heapq
+import itertools
+
+
+class DeadlineHeap(object):
+    # Min-heap of (deadline, key) entries. Re-scheduling or cancelling a key is O(1)
+    # (the old heap entry is lazily discarded), and each expired key costs O(log n) to pop.
+
+    def __init__(self):
+        self.heap = []
+        self.key_to_deadline = {}
+        self._tie_breaker = itertools.count()
+
+    def __len__(self):
+        return len(self.key_to_deadline)
+
+    def __contains__(self, key):
+        return key in self.key_to_deadline
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}(keys={len(self)}, next_deadline={self.next_deadline()})'
+
+    def schedule(self, key, deadline):
+        self.key_to_deadline[key] = deadline
+        heapq.heappush(self.heap, (deadline, next(self._tie_breaker), key))
+        if len(self.heap) > 2 * len(self.key_to_deadline) + 64:
+            self._compact()
+
+    def cancel(self, key):
+        self.key_to_deadline.pop(key, None)
+
+    def get_deadline(self, key):
+        return self.key_to_deadline.get(key)
+
+    def _is_stale(self, entry):
+        deadline, _, key = entry
+        return self.key_to_deadline.get(key) != deadline
+
+    def _compact(self):
+        self.heap = [entry for entry in self.heap if not self._is_stale(entry)]
+        heapq.heapify(self.heap)
+
+    def next_deadline(self):
+        while self.heap and self._is_stale(self.heap[0]):
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+        return None
+
+    def pop_expired(self, now):
+        expired_keys = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            entry = heapq.heappop(heap)
+            if self._is_stale(entry):
+                continue
+            deadline, _, key = entry
+            del self.key_to_deadline[key]
+            expired_keys.append(key)
+        return expired_keys
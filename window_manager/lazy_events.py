@@ -0,0 +1,92 @@
+import json
+
+_json_decoder = json.JSONDecoder()
+_json_whitespace = ' \t\n\r'
+
+
+class LazyVEKGEvent(dict):
+    # Only the routing fields are decoded up front, the rest of the event is decoded on first access
+    # to a missing key. `raw_json` keeps the original serialized event, so it can be forwarded as is.
+    __slots__ = ('raw_json', 'is_decoded', 'absent_fields')
+
+    def __init__(self, raw_json, routing_fields=None, absent_fields=()):
+        super(LazyVEKGEvent, self).__init__(routing_fields or {})
+        self.raw_json = raw_json
+        self.is_decoded = False
+        # fields known to not be anywhere in raw_json, so looking for them doesn't need decoding
+        self.absent_fields = absent_fields
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}({dict.__repr__(self)})'
+
+    def __reduce__(self):
+        # once decoded, the fields are not pickled again, since they are all inside raw_json
+        if self.is_decoded:
+            return (self.__class__, (self.raw_json,))
+        return (self.__class__, (self.raw_json, dict(self), self.absent_fields))
+
+    def decode(self):
+        if not self.is_decoded:
+            self.update(json.loads(self.raw_json))
+            self.is_decoded = True
+
+    def __missing__(self, key):
+        if self.is_decoded or key in self.absent_fields:
+            raise KeyError(key)
+        self.decode()
+        return self[key]
+
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            return True
+        if self.is_decoded or key in self.absent_fields:
+            return False
+        self.decode()
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
+def _skip_whitespace(event_json, index):
+    while index < len(event_json) and event_json[index] in _json_whitespace:
+        index += 1
+    return index
+
+
+def _find_field_value_index(event_json, field):
+    # quotes are always escaped inside JSON strings, so a match of the quoted field name followed by
+    # a colon is a key. If it is the key of more than one object (eg: a nested one), we can't tell
+    # which one is the top level key without decoding everything, so None is returned.
+    key_token = f'"{field}"'
+    value_index = -1
+    key_index = event_json.find(key_token)
+    while key_index != -1:
+        colon_index = _skip_whitespace(event_json, key_index + len(key_token))
+        if colon_index < len(event_json) and event_json[colon_index] == ':':
+            if value_index != -1:
+                return None
+            value_index = _skip_whitespace(event_json, colon_index + 1)
+        key_index = event_json.find(key_token, key_index + len(key_token))
+    return value_index
+
+
+def parse_routing_fields(event_json, fields):
+    if isinstance(event_json, bytes):
+        event_json = event_json.decode('utf-8')
+    routing_fields = {}
+    absent_fields = []
+    for field in fields:
+        value_index = _find_field_value_index(event_json, field)
+        if value_index == -1:
+            absent_fields.append(field)
+            continue
+        if value_index is None:
+            event_data = LazyVEKGEvent(event_json)
+            event_data.decode()
+            return event_data
+        routing_fields[field] = _json_decoder.raw_decode(event_json, value_index)[0]
+    return LazyVEKGEvent(event_json, routing_fields, frozenset(absent_fields))
@@ -0,0 +1,114 @@
+LOAD_SHEDDING_POLICIES = ('sample', 'coalesce', 'drop_low_priority')
+
+
+def get_vekg_signature(event_data):
+    # node ids and (source, target) edges of the event VEKG, used to compare consecutive frames
+    vekg = event_data.get('vekg') or {}
+    signature = set()
+    for node in vekg.get('nodes', ()):
+        signature.add(node[0] if isinstance(node, (list, tuple)) else node)
+    for edge in vekg.get('edges', ()):
+        signature.add((edge[0], edge[1]))
+    return signature
+
+
+def get_similarity(signature, other_signature):
+    # jaccard similarity
+    if not signature and not other_signature:
+        return 1.0
+    return len(signature & other_signature) / len(signature | other_signature)
+
+
+class LoadShedder(object):
+    # While overloaded (input lag or event processing time over their limits), frames and windows are shed
+    # with the configured policies:
+    #  - "sample": only one of every `sample_every` frames of each buffer stream is added to the windows.
+    #  - "coalesce": frames whose VEKG is at least `coalesce_similarity` similar to the previous kept frame
+    #    of the same buffer stream are not added to the windows.
+    #  - "drop_low_priority": windows are not sent to the low priority queries.
+    # The overload ends when all the measures are below `recovery_ratio` of their limits, so it doesn't flap.
+
+    def __init__(self, policies, max_input_lag=5, max_event_processing_secs=0, recovery_ratio=0.5,
+                 sample_every=2, coalesce_similarity=0.9, low_priority_query_ids=()):
+        unknown_policies = set(policies) - set(LOAD_SHEDDING_POLICIES)
+        if unknown_policies:
+            raise ValueError(f'Unknown load shedding policies: {sorted(unknown_policies)}')
+        self.policies = set(policies)
+        self.max_input_lag = max_input_lag
+        self.max_event_processing_secs = max_event_processing_secs
+        self.recovery_ratio = recovery_ratio
+        self.sample_every = max(1, sample_every)
+        self.coalesce_similarity = coalesce_similarity
+        self.low_priority_query_ids = set(low_priority_query_ids)
+        self.is_overloaded = False
+        # buffer stream key -> frames seen during the overload, for the uniform sampling
+        self.bufferstream_frame_counts = {}
+        # buffer stream key -> VEKG signature of the last kept frame
+        self.bufferstream_signatures = {}
+        # buffer stream key -> total of shed frames, and window controller -> {buffer stream key: reported total}
+        self.bufferstream_shed_frames = {}
+        self.reported_shed_frames = {}
+
+    def get_load(self, input_lag, event_processing_secs):
+        # highest ratio between the measures and their limits
+        loads = [0]
+        if self.max_input_lag and input_lag is not None:
+            loads.append(input_lag / self.max_input_lag)
+        if self.max_event_processing_secs and event_processing_secs is not None:
+            loads.append(event_processing_secs / self.max_event_processing_secs)
+        return max(loads)
+
+    def update(self, input_lag, event_processing_secs):
+        # returns True if the overload started or ended
+        load = self.get_load(input_lag, event_processing_secs)
+        if not self.is_overloaded and load > 1:
+            self.is_overloaded = True
+            return True
+        if self.is_overloaded and load < self.recovery_ratio:
+            self.is_overloaded = False
+            self.bufferstream_frame_counts = {}
+            self.bufferstream_signatures = {}
+            return True
+        return False
+
+    def get_frame_shedding_policy(self, event_data):
+        # policy shedding the frame (only called while overloaded), or None if the frame is kept
+        buffer_stream_key = event_data['buffer_stream_key']
+        policy = None
+        if 'sample' in self.policies:
+            frame_count = self.bufferstream_frame_counts.get(buffer_stream_key, 0)
+            self.bufferstream_frame_counts[buffer_stream_key] = frame_count + 1
+            if frame_count % self.sample_every != 0:
+                policy = 'sample'
+        if policy is None and 'coalesce' in self.policies:
+            signature = get_vekg_signature(event_data)
+            last_signature = self.bufferstream_signatures.get(buffer_stream_key)
+            if last_signature is not None and get_similarity(signature, last_signature) >= self.coalesce_similarity:
+                policy = 'coalesce'
+            else:
+                self.bufferstream_signatures[buffer_stream_key] = signature
+        if policy is not None:
+            shed_frames = self.bufferstream_shed_frames
+            shed_frames[buffer_stream_key] = shed_frames.get(buffer_stream_key, 0) + 1
+        return policy
+
+    def get_window_shed_frames(self, window_controller, window):
+        # frames of the window buffer stream shed since the previous window of this controller
+        if not window or not self.bufferstream_shed_frames:
+            return 0
+        buffer_stream_key = window[0]['buffer_stream_key']
+        shed_frames = self.bufferstream_shed_frames.get(buffer_stream_key, 0)
+        if not shed_frames:
+            return 0
+        reported_shed_frames = self.reported_shed_frames.setdefault(window_controller, {})
+        previous_shed_frames = reported_shed_frames.get(buffer_stream_key, 0)
+        reported_shed_frames[buffer_stream_key] = shed_frames
+        return shed_frames - previous_shed_frames
+
+    def get_dropped_query_ids(self, query_ids):
+        if not self.is_overloaded or 'drop_low_priority' not in self.policies:
+            return []
+        return [query_id for query_id in query_ids if query_id in self.low_priority_query_ids]
+
+    def release_window_controller(self, window_controller):
+        self.reported_shed_frames.pop(window_controller, None)
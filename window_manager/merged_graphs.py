@@ -0,0 +1,88 @@
+FRAME_FIELDS = ('id', 'buffer_stream_key', 'timestamp', 'query_ids')
+
+
+class MergedGraphWindow(object):
+    # Window that keeps a single graph merged from the VEKGs of its frames, instead of the frames themselves.
+    # Nodes are deduplicated by id and edges by their (source, target) nodes, keeping the attributes of the
+    # last frame they were seen in, and the indexes of the first and last frames they were seen in.
+    # Only the routing fields of each frame are kept, so it can still be used where a list of events is
+    # expected for those fields (eg: len, window[0]['timestamp'] or iterating the frames `query_ids`).
+    # It's sent to the matcher (see `to_dict`) in the `window_field` of the window event.
+    window_field = 'vekg_graph'
+
+    def __init__(self):
+        self.frames = []
+        # node id -> [node id, attributes, first frame index, last frame index]
+        self.nodes = {}
+        # (source, target) -> [source, target, attributes, first frame index, last frame index]
+        self.edges = {}
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}(frames={len(self.frames)}, nodes={len(self.nodes)}, edges={len(self.edges)})'
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __eq__(self, other):
+        if not isinstance(other, MergedGraphWindow):
+            return NotImplemented
+        return (self.frames, self.nodes, self.edges) == (other.frames, other.nodes, other.edges)
+
+    def append(self, event_data):
+        frame_index = len(self.frames)
+        self.frames.append({field: event_data[field] for field in FRAME_FIELDS if field in event_data})
+        vekg = event_data.get('vekg') or {}
+        nodes = self.nodes
+        for node in vekg.get('nodes', ()):
+            node_id = node[0]
+            node_attributes = node[1] if len(node) > 1 else {}
+            merged_node = nodes.get(node_id)
+            if merged_node is None:
+                nodes[node_id] = [node_id, node_attributes, frame_index, frame_index]
+            else:
+                merged_node[1] = node_attributes
+                merged_node[3] = frame_index
+        edges = self.edges
+        for edge in vekg.get('edges', ()):
+            edge_key = (edge[0], edge[1])
+            edge_attributes = edge[2] if len(edge) > 2 else {}
+            merged_edge = edges.get(edge_key)
+            if merged_edge is None:
+                edges[edge_key] = [edge[0], edge[1], edge_attributes, frame_index, frame_index]
+            else:
+                merged_edge[2] = edge_attributes
+                merged_edge[4] = frame_index
+
+    def copy(self):
+        window = MergedGraphWindow()
+        window.frames = list(self.frames)
+        window.nodes = {node_id: list(node) for node_id, node in self.nodes.items()}
+        window.edges = {edge_key: list(edge) for edge_key, edge in self.edges.items()}
+        return window
+
+    def get_state(self):
+        # json friendly state, restored with set_state
+        return {
+            'frames': list(self.frames),
+            'nodes': [list(node) for node in self.nodes.values()],
+            'edges': [list(edge) for edge in self.edges.values()],
+        }
+
+    def set_state(self, state):
+        self.frames = list(state['frames'])
+        self.nodes = {node[0]: list(node) for node in state['nodes']}
+        self.edges = {(edge[0], edge[1]): list(edge) for edge in state['edges']}
+
+    def to_dict(self):
+        return {
+            'frames': [{k: v for k, v in frame.items() if k != 'query_ids'} for frame in self.frames],
+            'nodes': list(self.nodes.values()),
+            'edges': list(self.edges.values()),
+        }
@@ -0,0 +1,345 @@
+import bisect
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+WINDOW_FILL_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class Counter(object):
+    metric_type = 'counter'
+    __slots__ = ['value']
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get_samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+    def get_snapshot(self):
+        return self.value
+
+    def get_state(self):
+        return self.value
+
+    def merge_state(self, state):
+        # the values of the same metric in several processes are added up
+        self.value += state
+
+
+class Gauge(Counter):
+    metric_type = 'gauge'
+    __slots__ = []
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    # fixed buckets counted in a preallocated list, so observing a value doesn't allocate.
+    # `should_sample` is True once every `sample_every` calls, so that durations (which need two clock
+    # reads) are only measured for a sample of the calls
+    metric_type = 'histogram'
+    __slots__ = ['buckets', 'bucket_counts', 'sum', 'count', 'sample_every', 'sample_countdown']
+
+    def __init__(self, buckets, sample_every=1):
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.sample_every = max(1, sample_every)
+        self.sample_countdown = 1
+
+    def should_sample(self):
+        self.sample_countdown -= 1
+        if self.sample_countdown > 0:
+            return False
+        self.sample_countdown = self.sample_every
+        return True
+
+    def call_sampled(self, func, *args, **kwargs):
+        # calls func, and observes its duration if the call is sampled
+        if not self.should_sample():
+            return func(*args, **kwargs)
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_samples(self, name, labels):
+        samples = []
+        cumulative_count = 0
+        for bucket, bucket_count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+            cumulative_count += bucket_count
+            bucket_label = '+Inf' if bucket == float('inf') else repr(bucket)
+            samples.append((f'{name}_bucket', dict(labels, le=bucket_label), cumulative_count))
+        samples.append((f'{name}_sum', labels, self.sum))
+        samples.append((f'{name}_count', labels, self.count))
+        return samples
+
+    def get_snapshot(self):
+        return {
+            'count': self.count,
+            'avg': self.sum / self.count if self.count else None,
+        }
+
+    def get_state(self):
+        return [list(self.bucket_counts), self.sum, self.count]
+
+    def merge_state(self, state):
+        bucket_counts, histogram_sum, count = state
+        for index, bucket_count in enumerate(bucket_counts):
+            self.bucket_counts[index] += bucket_count
+        self.sum += histogram_sum
+        self.count += count
+
+
+class LabeledMetric(object):
+    # one child metric for each value of a single label, eg: one counter per query id
+
+    def __init__(self, label_name, metric_factory):
+        self.label_name = label_name
+        self.metric_factory = metric_factory
+        self.metric_type = metric_factory().metric_type
+        self.children = {}
+
+    def labels(self, label_value):
+        metric = self.children.get(label_value)
+        if metric is None:
+            metric = self.children[label_value] = self.metric_factory()
+        return metric
+
+    def remove(self, label_value):
+        self.children.pop(label_value, None)
+
+    def replace(self, label_values):
+        # used for gauges set all at once (eg: from a periodic snapshot), where the old values are dropped
+        children = {}
+        for label_value, value in label_values.items():
+            children[label_value] = self.metric_factory()
+            children[label_value].set(value)
+        self.children = children
+
+    def get_samples(self, name, labels):
+        samples = []
+        for label_value, metric in list(self.children.items()):
+            samples.extend(metric.get_samples(name, dict(labels, **{self.label_name: label_value})))
+        return samples
+
+    def get_snapshot(self):
+        return {label_value: metric.get_snapshot() for label_value, metric in list(self.children.items())}
+
+    def get_state(self):
+        return {label_value: metric.get_state() for label_value, metric in list(self.children.items())}
+
+    def merge_state(self, state):
+        for label_value, metric_state in state.items():
+            self.labels(label_value).merge_state(metric_state)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_sample(name, labels, value):
+    if labels:
+        labels_text = ','.join(f'{k}="{escape_label_value(v)}"' for k, v in labels.items())
+        name = f'{name}{{{labels_text}}}'
+    return f'{name} {value}'
+
+
+class MetricsRegistry(object):
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        # name -> (help text, metric)
+        self.metrics = {}
+
+    def register(self, name, help_text, metric):
+        self.metrics[name] = (help_text, metric)
+        return metric
+
+    def render_text(self):
+        # prometheus text exposition format
+        lines = []
+        for name, (help_text, metric) in list(self.metrics.items()):
+            full_name = f'{self.prefix}_{name}'
+            lines.append(f'# HELP {full_name} {help_text}')
+            lines.append(f'# TYPE {full_name} {metric.metric_type}')
+            lines.extend(format_sample(*sample) for sample in metric.get_samples(full_name, {}))
+        return '\n'.join(lines) + '\n'
+
+    def get_snapshot(self):
+        return {name: metric.get_snapshot() for name, (_, metric) in list(self.metrics.items())}
+
+    def get_state(self):
+        # raw values of the metrics, sent by the worker processes to be merged into the ones of the service
+        return {name: metric.get_state() for name, (_, metric) in list(self.metrics.items())}
+
+    def merge_state(self, state):
+        for name, metric_state in state.items():
+            if name in self.metrics:
+                self.metrics[name][1].merge_state(metric_state)
+
+
+class WindowManagerMetrics(object):
+
+    def __init__(self, sample_every=100):
+        self.registry = MetricsRegistry('window_manager')
+        # latest metrics state of each window worker process, added to the metrics of this process when rendered
+        self.worker_states = {}
+        register = self.registry.register
+        self.events_processed = register(
+            'events_processed_total', 'VEKG events processed.', Counter()
+        )
+        self.windows_emitted = register(
+            'windows_emitted_total', 'Windows sent to the matcher, per query.',
+            LabeledMetric('query_id', Counter)
+        )
+        self.window_fill_seconds = register(
+            'window_fill_seconds', 'Event time between the first and last events of the emitted windows.',
+            Histogram(WINDOW_FILL_BUCKETS)
+        )
+        self.event_processing_seconds = register(
+            'event_processing_seconds', 'Time to add an event to its windows and emit the finished ones (sampled).',
+            Histogram(LATENCY_BUCKETS, sample_every=sample_every)
+        )
+        self.matcher_write_seconds = register(
+            'matcher_write_seconds', 'Time to write the windows to the matcher stream (sampled).',
+            Histogram(LATENCY_BUCKETS, sample_every=sample_every)
+        )
+        self.buffered_events = register(
+            'buffered_events', 'Events buffered in the open windows, per buffer stream.',
+            LabeledMetric('buffer_stream_key', Gauge)
+        )
+        self.late_events = register(
+            'late_events_total', 'Events ignored by the event-time windows for being late, per buffer stream.',
+            LabeledMetric('buffer_stream_key', Counter)
+        )
+        self.evicted_bufferstreams = register(
+            'evicted_bufferstreams_total', 'Buffer streams evicted for being idle (flushed) or over the memory limits.',
+            LabeledMetric('reason', Counter)
+        )
+        self.input_lag_seconds = register(
+            'input_lag_seconds', 'Time between the last processed event and the head of the data stream.', Gauge()
+        )
+        self.overloaded = register(
+            'overloaded', 'Whether the load shedding is active (1) or not (0).', Gauge()
+        )
+        self.shed_frames = register(
+            'shed_frames_total', 'Frames not added to the windows by the load shedding, per policy.',
+            LabeledMetric('policy', Counter)
+        )
+        self.shed_query_windows = register(
+            'shed_query_windows_total', 'Windows not sent to low priority queries by the load shedding.', Counter()
+        )
+        self.output_backlog = register(
+            'output_backlog', 'Events of the output streams not processed yet by their consumers.',
+            LabeledMetric('stream', Gauge)
+        )
+        self.output_backpressure_starts = register(
+            'output_backpressure_starts_total', 'Times the output streams backlog went over its limit.',
+            LabeledMetric('stream', Counter)
+        )
+        self.output_trimmed_events = register(
+            'output_trimmed_events_total', 'Events trimmed from the backpressured output streams.',
+            LabeledMetric('stream', Counter)
+        )
+        self.output_spilled_events = register(
+            'output_spilled_events_total', 'Events spilled to disk instead of written to the output streams.',
+            LabeledMetric('stream', Counter)
+        )
+        self.intake_paused_seconds = register(
+            'intake_paused_seconds_total', 'Time the data intake was paused by the output backpressure.', Counter()
+        )
+
+    def set_worker_state(self, worker_index, state):
+        self.worker_states[worker_index] = state
+
+    def get_merged_registry(self):
+        worker_states = list(self.worker_states.values())
+        if not worker_states:
+            return self.registry
+        merged_registry = WindowManagerMetrics().registry
+        for state in [self.registry.get_state()] + worker_states:
+            merged_registry.merge_state(state)
+        return merged_registry
+
+    def render_text(self):
+        return self.get_merged_registry().render_text()
+
+    def get_snapshot(self):
+        return self.get_merged_registry().get_snapshot()
+
+    def get_state(self):
+        return self.registry.get_state()
+
+
+def get_stream_event_id_time(event_id):
+    # redis stream ids are "<milliseconds>-<sequence>"
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode('utf-8')
+    return int(event_id.split('-', 1)[0]) / 1000
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server only has it from python 3.7
+    daemon_threads = True
+
+
+class MetricsHTTPServer(object):
+    # pull endpoint serving the metrics in the prometheus text format (or as json at /metrics.json)
+
+    def __init__(self, metrics, port, host='0.0.0.0'):
+        self.metrics = metrics
+        self.server = ThreadingHTTPServer((host, port), self.create_request_handler())
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def create_request_handler(self):
+        metrics = self.metrics
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = metrics.render_text().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(metrics.get_snapshot()).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return MetricsRequestHandler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,79 @@
+import json
+import time
+
+from window_manager.deadlines import DeadlineHeap
+
+
+class BasePayloadStore(object):
+
+    def __init__(self, key_prefix, ttl):
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}("{self.key_prefix}", ttl={self.ttl})'
+
+    def get_payload_key(self, payload_id):
+        return f'{self.key_prefix}:{payload_id}'
+
+    def put_many(self, payloads):
+        raise NotImplementedError()
+
+    def get_many(self, payload_keys):
+        raise NotImplementedError()
+
+    def get_window(self, window_refs):
+        payload_keys = [self.get_payload_key(event_id) for event_id in window_refs['event_ids']]
+        return [json.loads(payload) for payload in self.get_many(payload_keys)]
+
+
+class RedisPayloadStore(BasePayloadStore):
+
+    def __init__(self, redis_db, key_prefix, ttl):
+        super(RedisPayloadStore, self).__init__(key_prefix, ttl)
+        self.redis_db = redis_db
+
+    def put_many(self, payloads):
+        pipeline = self.redis_db.pipeline(transaction=False)
+        for payload_key, payload in payloads.items():
+            pipeline.set(payload_key, payload, ex=self.ttl)
+        pipeline.execute()
+
+    def get_many(self, payload_keys):
+        return self.redis_db.mget(payload_keys)
+
+
+class InMemoryPayloadStore(BasePayloadStore):
+    # used when the stream factory has no redis connection, eg: mocked streams and offline runs
+
+    def __init__(self, key_prefix, ttl):
+        super(InMemoryPayloadStore, self).__init__(key_prefix, ttl)
+        self.payloads = {}
+        self.payload_deadlines = DeadlineHeap()
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def expire_payloads(self, now):
+        for payload_key in self.payload_deadlines.pop_expired(now):
+            self.payloads.pop(payload_key, None)
+
+    def put_many(self, payloads):
+        now = time.time()
+        self.expire_payloads(now)
+        for payload_key, payload in payloads.items():
+            self.payloads[payload_key] = payload
+            if self.ttl:
+                self.payload_deadlines.schedule(payload_key, now + self.ttl)
+
+    def get_many(self, payload_keys):
+        self.expire_payloads(time.time())
+        return [self.payloads.get(payload_key) for payload_key in payload_keys]
+
+
+def create_payload_store(stream_factory, key_prefix, ttl):
+    redis_db = getattr(stream_factory, 'redis_db', None)
+    if redis_db is not None:
+        return RedisPayloadStore(redis_db=redis_db, key_prefix=key_prefix, ttl=ttl)
+    return InMemoryPayloadStore(key_prefix=key_prefix, ttl=ttl)
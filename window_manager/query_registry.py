@@ -0,0 +1,24 @@
+class QueryRegistry(object):
+    # Snapshot of the registered queries and their window controllers. A published registry is never
+    # changed: the cmd thread copies it, changes the copy and replaces the service's reference to it, so the
+    # data thread can keep using a registry it already got (without any lock) while queries are added/removed.
+    __slots__ = ('query_windows', 'window_spec_controllers', 'query_window_spec_keys', 'window_controller_spec_keys')
+
+    def __init__(self, query_windows=None, window_spec_controllers=None,
+                 query_window_spec_keys=None, window_controller_spec_keys=None):
+        self.query_windows = query_windows or {}
+        self.window_spec_controllers = window_spec_controllers or {}
+        self.query_window_spec_keys = query_window_spec_keys or {}
+        self.window_controller_spec_keys = window_controller_spec_keys or {}
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}(queries={len(self.query_windows)}, controllers={len(self.window_spec_controllers)})'
+
+    def copy(self):
+        return QueryRegistry(
+            query_windows=dict(self.query_windows),
+            window_spec_controllers=dict(self.window_spec_controllers),
+            query_window_spec_keys=dict(self.query_window_spec_keys),
+            window_controller_spec_keys=dict(self.window_controller_spec_keys),
+        )
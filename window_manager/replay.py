@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+import argparse
+import collections
+import gzip
+import json
+import struct
+import sys
+import time
+
+from event_service_utils.streams.base import BasicStream, StreamFactory
+
+from window_manager.metrics import get_stream_event_id_time
+from window_manager.service import WindowManager
+
+REPLAY_SERVICE_STREAM_KEY = 'wm-data'
+REPLAY_MATCHER_STREAM_KEY = 'ma-data'
+CMD_EVENT_TYPES = ['QueryCreated', 'QueryRemoved']
+
+# binary logs are a sequence of records, each one a 4 bytes (big-endian) length followed by the record json
+BINARY_RECORD_HEADER = struct.Struct('>I')
+
+
+def open_log_file(path, mode='rt'):
+    if path == '-':
+        return sys.stdin.buffer if 'b' in mode else sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def read_jsonl_records(log_file):
+    for line in log_file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_binary_records(log_file):
+    while True:
+        header = log_file.read(BINARY_RECORD_HEADER.size)
+        if len(header) < BINARY_RECORD_HEADER.size:
+            return
+        record_size, = BINARY_RECORD_HEADER.unpack(header)
+        yield json.loads(log_file.read(record_size))
+
+
+def encode_binary_record(record):
+    record_json = json.dumps(record).encode('utf-8')
+    return BINARY_RECORD_HEADER.pack(len(record_json)) + record_json
+
+
+def read_log_records(path, log_format='auto'):
+    # records are read one at a time, so the log is never fully loaded in memory
+    if log_format == 'auto':
+        log_format = 'binary' if path.replace('.gz', '').endswith('.bin') else 'jsonl'
+    if log_format == 'binary':
+        with open_log_file(path, 'rb') as log_file:
+            yield from read_binary_records(log_file)
+    else:
+        with open_log_file(path, 'rt') as log_file:
+            yield from read_jsonl_records(log_file)
+
+
+def get_record_time(record):
+    # recorded time in seconds: the record `time`, or the time of its redis stream event id
+    if 'time' in record:
+        return float(record['time'])
+    if 'id' in record:
+        return get_stream_event_id_time(record['id'])
+    return None
+
+
+class ReplayInputStream(BasicStream):
+    # the data stream of the replayed service, fed by the replay loop
+
+    def __init__(self, key):
+        BasicStream.__init__(self, key)
+        self.pending_events = collections.deque()
+
+    def read_events(self, count=1):
+        event_list = []
+        while self.pending_events and len(event_list) < count:
+            event_list.append(self.pending_events.popleft())
+        return event_list
+
+    def read_stream_events_list(self, count=1):
+        return []
+
+    def write_events(self, *events):
+        pass
+
+    def ack(self, event_id):
+        pass
+
+
+class ReplayOutputStream(BasicStream):
+    # writes the event json of each msg as a line of the output file (if any)
+
+    def __init__(self, key, output_file=None):
+        BasicStream.__init__(self, key)
+        self.output_file = output_file
+        self.written_events_count = 0
+
+    def read_events(self, count=1):
+        return []
+
+    def write_events(self, *events):
+        self.written_events_count += len(events)
+        if self.output_file is None:
+            return
+        for event_msg in events:
+            event_json = event_msg.get('event') or event_msg.get(b'event')
+            if isinstance(event_json, bytes):
+                event_json = event_json.decode('utf-8')
+            self.output_file.write(f'{event_json}\n')
+
+
+class ReplayStreamFactory(StreamFactory):
+
+    def __init__(self, output_file=None):
+        self.output_file = output_file
+        self.streams = {}
+
+    def create(self, key, stype=None, cg_id=None):
+        if not isinstance(key, str):
+            key = ','.join(key)
+        if key not in self.streams:
+            if key == REPLAY_MATCHER_STREAM_KEY:
+                self.streams[key] = ReplayOutputStream(key, self.output_file)
+            else:
+                self.streams[key] = ReplayInputStream(key)
+        return self.streams[key]
+
+
+class WindowManagerReplay(object):
+    # Runs a WindowManager (without redis or jaeger) over the records of a recorded log. Each record has the
+    # `stream` it was read from (the cmd event type for QueryCreated/QueryRemoved, anything else for VEKG events),
+    # its `event` (as in the redis stream msgs, json or already decoded) and optionally its redis stream `id`
+    # or recorded `time`, used to replay it at the recorded speed (`speed` 1, or 0 for as fast as possible)
+
+    def __init__(self, output_file=None, speed=0, raw_passthrough=False, batch_size=1, logging_level='ERROR',
+                 service_kwargs=None):
+        self.speed = speed
+        self.stream_factory = ReplayStreamFactory(output_file)
+        self.service = WindowManager(
+            service_stream_key=REPLAY_SERVICE_STREAM_KEY,
+            service_cmd_key_list=CMD_EVENT_TYPES,
+            pub_event_list=[],
+            service_details=None,
+            matcher_stream_key=REPLAY_MATCHER_STREAM_KEY,
+            stream_factory=self.stream_factory,
+            logging_level=logging_level,
+            tracer_configs=None,
+            raw_passthrough=raw_passthrough,
+            batch_configs={'max_size': batch_size, 'max_linger_ms': 0},
+            **(service_kwargs or {})
+        )
+        self.batch_size = batch_size
+        self.input_stream = self.service.service_stream
+        self.matcher_stream = self.stream_factory.create(REPLAY_MATCHER_STREAM_KEY)
+        self.data_events_count = 0
+        self.cmd_events_count = 0
+        # windows of the queries removed during the replay (their metrics are removed with them)
+        self.removed_query_windows = collections.Counter()
+        self.first_record_time = None
+        self.last_record_time = None
+
+    def wait_recorded_time(self, record_time, start_time):
+        if self.first_record_time is None:
+            self.first_record_time = record_time
+        self.last_record_time = record_time
+        if not self.speed:
+            return
+        wait_time = (record_time - self.first_record_time) / self.speed - (time.perf_counter() - start_time)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def process_pending_data_events(self):
+        while self.input_stream.pending_events:
+            self.service.process_data()
+
+    def process_cmd_record(self, event_type, event_json):
+        self.process_pending_data_events()
+        event_data = self.service.default_event_deserializer({'event': event_json})
+        if event_type == 'QueryRemoved':
+            query_windows = self.service.metrics.windows_emitted.get_snapshot()
+            self.removed_query_windows[event_data['query_id']] += query_windows.get(event_data['query_id'], 0)
+        self.service.process_event_type(event_type, event_data, None)
+        self.cmd_events_count += 1
+
+    def replay(self, records):
+        start_time = time.perf_counter()
+        for record in records:
+            record_time = get_record_time(record)
+            if record_time is not None:
+                self.wait_recorded_time(record_time, start_time)
+            event_json = record['event']
+            if not isinstance(event_json, str):
+                event_json = json.dumps(event_json)
+            event_type = record.get('stream')
+            if event_type in CMD_EVENT_TYPES:
+                self.process_cmd_record(event_type, event_json)
+                continue
+            event_id = record.get('id', str(self.data_events_count))
+            self.input_stream.pending_events.append((event_id, {'event': event_json}))
+            self.data_events_count += 1
+            if self.speed or len(self.input_stream.pending_events) >= self.batch_size:
+                self.process_pending_data_events()
+        self.process_pending_data_events()
+        return self.get_summary(time.perf_counter() - start_time)
+
+    def get_summary(self, elapsed_secs):
+        query_windows = collections.Counter({query_id: 0 for query_id in self.service.query_windows})
+        query_windows.update(self.removed_query_windows)
+        query_windows.update(self.service.metrics.windows_emitted.get_snapshot())
+        recorded_secs = None
+        if self.first_record_time is not None:
+            recorded_secs = self.last_record_time - self.first_record_time
+        return {
+            'data_events': self.data_events_count,
+            'cmd_events': self.cmd_events_count,
+            'windows': self.matcher_stream.written_events_count,
+            'query_windows': dict(sorted(query_windows.items())),
+            'buffered_events': sum(
+                window_controller.buffered_events_count
+                for window_controller in self.service.window_spec_controllers.values()
+            ),
+            'elapsed_secs': elapsed_secs,
+            'recorded_secs': recorded_secs,
+            'events_per_sec': self.data_events_count / elapsed_secs if elapsed_secs else None,
+            'windows_per_sec': self.matcher_stream.written_events_count / elapsed_secs if elapsed_secs else None,
+        }
+
+
+def print_summary(summary):
+    print(f'Data events:     {summary["data_events"]}')
+    print(f'Cmd events:      {summary["cmd_events"]}')
+    print(f'Windows:         {summary["windows"]}')
+    print(f'Buffered events: {summary["buffered_events"]} (in windows still open at the end)')
+    print(f'Elapsed:         {summary["elapsed_secs"]:.3f}s')
+    if summary['recorded_secs'] and summary['elapsed_secs']:
+        speedup = summary['recorded_secs'] / summary['elapsed_secs']
+        print(f'Recorded:        {summary["recorded_secs"]:.3f}s ({speedup:.1f}x)')
+    if summary['events_per_sec'] is not None:
+        print(
+            f'Throughput:      {summary["events_per_sec"]:.0f} events/s, {summary["windows_per_sec"]:.0f} windows/s'
+        )
+    print('Windows per query:')
+    for query_id, windows_count in summary['query_windows'].items():
+        print(f'  {query_id}: {windows_count}')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replays a recorded log of VEKG and QueryCreated/QueryRemoved events through the WindowManager.'
+    )
+    parser.add_argument('log', help='JSONL (or binary, with --format) log file, optionally gzipped, "-" for stdin')
+    parser.add_argument('--format', choices=['auto', 'jsonl', 'binary'], default='auto',
+                        help='log format ("auto" uses binary for .bin files)')
+    parser.add_argument('--output', help='JSONL file where the windows sent to the matcher are written')
+    parser.add_argument('--summary', help='JSON file where the summary is written')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='replay speed relative to the recorded one (eg: 1 or 2), 0 is as fast as possible')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--raw-passthrough', action='store_true')
+    parser.add_argument('--logging-level', default='ERROR')
+    args = parser.parse_args()
+
+    output_file = open(args.output, 'w', encoding='utf-8') if args.output else None
+    try:
+        window_manager_replay = WindowManagerReplay(
+            output_file=output_file,
+            speed=args.speed,
+            raw_passthrough=args.raw_passthrough,
+            batch_size=args.batch_size,
+            logging_level=args.logging_level,
+        )
+        summary = window_manager_replay.replay(read_log_records(args.log, args.format))
+    finally:
+        if output_file is not None:
+            output_file.close()
+    print_summary(summary)
+    if args.summary:
+        with open(args.summary, 'w') as summary_file:
+            json.dump(summary, summary_file, indent=2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
@@ -13,7 +13,48 @@ from window_manager.conf import (
     LOGGING_LEVEL,
     TRACER_REPORTING_HOST,
     TRACER_REPORTING_PORT,
+    TRACER_REPORTER_BATCH_SIZE,
+    TRACER_REPORTER_FLUSH_INTERVAL,
+    TRACING_SAMPLE_RATIO,
+    TRACING_MAX_LINKED_FRAMES,
     SERVICE_DETAILS,
+    CLAIM_CHECK_ENABLED,
+    CLAIM_CHECK_PAYLOAD_TTL,
+    RAW_PASSTHROUGH_ENABLED,
+    DATA_BATCH_MAX_SIZE,
+    DATA_BATCH_MAX_LINGER_MS,
+    MAX_BUFFERED_EVENTS_PER_STREAM,
+    MAX_BUFFERED_EVENTS,
+    BUFFERSTREAM_IDLE_TIMEOUT,
+    CHECKPOINT_ENABLED,
+    CHECKPOINT_INTERVAL,
+    CHECKPOINT_MAX_DELTAS,
+    CHECKPOINT_PATH,
+    SHARD_ID,
+    SHARD_IDS,
+    SHARD_VIRTUAL_NODES,
+    SHARD_HANDOFF_TIMEOUT,
+    WINDOW_WORKERS,
+    WINDOW_WORKERS_QUEUE_SIZE,
+    RUN_MODE,
+    METRICS_PORT,
+    METRICS_DUMP_INTERVAL,
+    METRICS_REFRESH_INTERVAL,
+    METRICS_SAMPLE_EVERY,
+    LOAD_SHEDDING_POLICIES,
+    LOAD_SHEDDING_MAX_INPUT_LAG,
+    LOAD_SHEDDING_MAX_EVENT_PROCESSING_MS,
+    LOAD_SHEDDING_RECOVERY_RATIO,
+    LOAD_SHEDDING_CHECK_INTERVAL,
+    LOAD_SHEDDING_SAMPLE_EVERY,
+    LOAD_SHEDDING_COALESCE_SIMILARITY,
+    LOAD_SHEDDING_LOW_PRIORITY_QUERY_IDS,
+    OUTPUT_MAX_BACKLOG,
+    OUTPUT_BACKPRESSURE_ACTION,
+    OUTPUT_BACKPRESSURE_CHECK_INTERVAL,
+    OUTPUT_BACKPRESSURE_RESUME_RATIO,
+    OUTPUT_SPILL_DIR,
+    WINDOW_WIRE_FORMAT,
 )
 
 
@@ -21,6 +62,68 @@ def run_service():
     tracer_configs = {
         'reporting_host': TRACER_REPORTING_HOST,
         'reporting_port': TRACER_REPORTING_PORT,
+        'reporter_batch_size': TRACER_REPORTER_BATCH_SIZE,
+        'reporter_flush_interval': TRACER_REPORTER_FLUSH_INTERVAL,
+    }
+    tracing_configs = {
+        'sample_ratio': TRACING_SAMPLE_RATIO,
+        'max_linked_frames': TRACING_MAX_LINKED_FRAMES,
+    }
+    claim_check_configs = None
+    if CLAIM_CHECK_ENABLED:
+        claim_check_configs = {
+            'payload_ttl': CLAIM_CHECK_PAYLOAD_TTL,
+        }
+    batch_configs = {
+        'max_size': DATA_BATCH_MAX_SIZE,
+        'max_linger_ms': DATA_BATCH_MAX_LINGER_MS,
+    }
+    memory_configs = {
+        'max_buffered_events_per_stream': MAX_BUFFERED_EVENTS_PER_STREAM,
+        'max_buffered_events': MAX_BUFFERED_EVENTS,
+        'bufferstream_idle_timeout': BUFFERSTREAM_IDLE_TIMEOUT,
+    }
+    checkpoint_configs = None
+    if CHECKPOINT_ENABLED:
+        checkpoint_configs = {
+            'interval': CHECKPOINT_INTERVAL,
+            'max_deltas': CHECKPOINT_MAX_DELTAS,
+            'path': CHECKPOINT_PATH,
+        }
+    sharding_configs = None
+    if SHARD_ID:
+        sharding_configs = {
+            'shard_id': SHARD_ID,
+            'shard_ids': SHARD_IDS,
+            'virtual_nodes': SHARD_VIRTUAL_NODES,
+            'handoff_timeout': SHARD_HANDOFF_TIMEOUT,
+        }
+    worker_configs = {
+        'count': WINDOW_WORKERS,
+        'queue_size': WINDOW_WORKERS_QUEUE_SIZE,
+    }
+    metrics_configs = {
+        'port': METRICS_PORT,
+        'dump_interval': METRICS_DUMP_INTERVAL,
+        'refresh_interval': METRICS_REFRESH_INTERVAL,
+        'sample_every': METRICS_SAMPLE_EVERY,
+    }
+    load_shedding_configs = {
+        'policies': LOAD_SHEDDING_POLICIES,
+        'max_input_lag': LOAD_SHEDDING_MAX_INPUT_LAG,
+        'max_event_processing_ms': LOAD_SHEDDING_MAX_EVENT_PROCESSING_MS,
+        'recovery_ratio': LOAD_SHEDDING_RECOVERY_RATIO,
+        'check_interval': LOAD_SHEDDING_CHECK_INTERVAL,
+        'sample_every': LOAD_SHEDDING_SAMPLE_EVERY,
+        'coalesce_similarity': LOAD_SHEDDING_COALESCE_SIMILARITY,
+        'low_priority_query_ids': LOAD_SHEDDING_LOW_PRIORITY_QUERY_IDS,
+    }
+    backpressure_configs = {
+        'max_backlog': OUTPUT_MAX_BACKLOG,
+        'action': OUTPUT_BACKPRESSURE_ACTION,
+        'check_interval': OUTPUT_BACKPRESSURE_CHECK_INTERVAL,
+        'resume_ratio': OUTPUT_BACKPRESSURE_RESUME_RATIO,
+        'spill_dir': OUTPUT_SPILL_DIR,
     }
     stream_factory = RedisStreamFactory(host=REDIS_ADDRESS, port=REDIS_PORT)
     service = WindowManager(
@@ -31,7 +134,20 @@ def run_service():
         matcher_stream_key=MATCHER_STREAM_KEY,
         stream_factory=stream_factory,
         logging_level=LOGGING_LEVEL,
-        tracer_configs=tracer_configs
+        tracer_configs=tracer_configs,
+        claim_check_configs=claim_check_configs,
+        raw_passthrough=RAW_PASSTHROUGH_ENABLED,
+        batch_configs=batch_configs,
+        memory_configs=memory_configs,
+        checkpoint_configs=checkpoint_configs,
+        sharding_configs=sharding_configs,
+        worker_configs=worker_configs,
+        run_mode=RUN_MODE,
+        metrics_configs=metrics_configs,
+        load_shedding_configs=load_shedding_configs,
+        backpressure_configs=backpressure_configs,
+        window_wire_format=WINDOW_WIRE_FORMAT,
+        tracing_configs=tracing_configs,
     )
     service.run()
 
@@ -1,9 +1,49 @@
+import asyncio
+import collections
+import json
+import os
 import threading
+import time
 
-from event_service_utils.logging.decorators import timer_logger
 from event_service_utils.services.event_driven import BaseEventDrivenCMDService
-from event_service_utils.tracing.jaeger import init_tracer
-from window_manager.window_controllers import TumblingCountWindowController
+from opentracing import Tracer
+
+from window_manager.async_streams import (
+    AsyncConsumerGroupStream,
+    AsyncStreamWriter,
+    create_async_redis_client,
+)
+from window_manager.backpressure import BackpressureStream
+from window_manager.checkpoints import (
+    WindowStateCheckpointer,
+    create_checkpoint_storage,
+    decode_json_state,
+    encode_json_state,
+)
+from window_manager.deadlines import DeadlineHeap
+from window_manager.lazy_events import parse_routing_fields
+from window_manager.load_shedding import LoadShedder
+from window_manager.metrics import MetricsHTTPServer, WindowManagerMetrics, get_stream_event_id_time
+from window_manager.payload_stores import create_payload_store
+from window_manager.query_registry import QueryRegistry
+from window_manager.sharding import ConsistentHashRing
+from window_manager.stream_utils import (
+    ack_events, get_stream_event_id_key, read_events_with_block, read_pending_events, write_events_pipelined
+)
+from window_manager.tracing import WindowTraceSampler, init_tracer
+from window_manager.wire_formats import (
+    MSGPACK_DELTA_FORMAT, WIRE_FORMATS, encode_window_frames, encode_window_msg, get_msgpack
+)
+from window_manager.workers import PROCESSED_EVENTS_KEY, WORKER_METRICS_KEY, WindowWorkerPool
+from window_manager.window_controllers import (
+    Pane,
+    PanedWindow,
+    TumblingCountWindowController,
+    TumblingTimeWindowController,
+    HoppingTimeWindowController,
+    SlidingCountWindowController,
+    SessionWindowController,
+)
 
 
 class WindowManager(BaseEventDrivenCMDService):
@@ -13,10 +53,31 @@ class WindowManager(BaseEventDrivenCMDService):
                  matcher_stream_key,
                  stream_factory,
                  logging_level,
-                 tracer_configs):
-        tracer = init_tracer(self.__class__.__name__, **tracer_configs)
+                 tracer_configs,
+                 claim_check_configs=None,
+                 raw_passthrough=False,
+                 batch_configs=None,
+                 memory_configs=None,
+                 checkpoint_configs=None,
+                 sharding_configs=None,
+                 worker_configs=None,
+                 run_mode='threads',
+                 metrics_configs=None,
+                 load_shedding_configs=None,
+                 backpressure_configs=None,
+                 window_wire_format='json',
+                 tracing_configs=None):
+        name = self.__class__.__name__
+        if sharding_configs is not None:
+            # each shard has its own consumer groups, so every shard receives all the query commands
+            name = f'{name}-{sharding_configs["shard_id"]}'
+        if tracer_configs is not None:
+            tracer = init_tracer(name, **tracer_configs)
+        else:
+            # no tracing, eg: in offline replays
+            tracer = Tracer()
         super(WindowManager, self).__init__(
-            name=self.__class__.__name__,
+            name=name,
             service_stream_key=service_stream_key,
             service_cmd_key_list=service_cmd_key_list,
             pub_event_list=pub_event_list,
@@ -27,41 +88,1063 @@ class WindowManager(BaseEventDrivenCMDService):
         )
         self.cmd_validation_fields = ['id']
         self.data_validation_fields = ['id']
+        # windows traces sampling (the frames have no spans of their own, see WindowTraceSampler)
+        if tracing_configs is None:
+            tracing_configs = {}
+        self.trace_sampler = WindowTraceSampler(
+            sample_ratio=tracing_configs.get('sample_ratio', 1.0),
+            max_linked_frames=tracing_configs.get('max_linked_frames', 10),
+        )
         self.matcher_stream_key = matcher_stream_key
         self.matcher_stream = self.stream_factory.create(key=matcher_stream_key, stype='streamOnly')
 
+        # raw passthrough mode: data events only have their routing fields decoded,
+        # and their original json is spliced as is into the windows sent to the matcher
+        self.raw_passthrough = raw_passthrough
+        self.data_routing_fields = ['id', 'query_ids', 'buffer_stream_key', 'timestamp', 'tracer']
+
+        # wire format of the windows sent to the matcher: "json", or "msgpack-delta" (the frames are encoded
+        # with msgpack, each one as a delta from the previous one, see wire_formats.decode_window_msg)
+        if window_wire_format not in WIRE_FORMATS:
+            raise ValueError(f'Invalid window wire format "{window_wire_format}", should be one of: {WIRE_FORMATS}')
+        if window_wire_format == MSGPACK_DELTA_FORMAT:
+            get_msgpack()
+        self.window_wire_format = window_wire_format
+
+        # batch mode: reads up to `max_size` data events (waiting at most `max_linger_ms` to fill the batch)
+        # and the windows finished during the batch are written to the matcher in a single pipelined write
+        if batch_configs is None:
+            batch_configs = {}
+        self.batch_max_size = batch_configs.get('max_size', 1)
+        self.batch_max_linger_ms = batch_configs.get('max_linger_ms', 0)
+        self.pending_matcher_event_msgs = []
+        self.is_buffering_matcher_output = self.batch_max_size > 1
+
+        # run modes: "threads" (one thread blocked reading each stream) or "asyncio" (a single event loop
+        # reading the cmd and data streams with an async redis client, and running the periodic tasks)
+        self.run_mode = run_mode
+        # seconds to wait before retrying a failed async task
+        self.async_timers_interval = 0.1
+        # the timers task sleeps until the earliest deadline of the periodic work, and is woken up (by the
+        # data task) when a data batch schedules an earlier one (the event is created in the event loop)
+        self.async_timers_deadline = 0
+        self.async_timers_wakeup = None
+        if self.run_mode == 'asyncio':
+            if sharding_configs is not None or (worker_configs or {}).get('count', 0) > 1:
+                raise RuntimeError('The asyncio run mode can not be used with sharding or window workers.')
+            # windows are always written to the matcher asynchronously, after each data batch
+            self.is_buffering_matcher_output = True
+
+        # memory limits for the buffered events (0 means no limit), and eviction of idle buffer streams
+        if memory_configs is None:
+            memory_configs = {}
+        self.max_buffered_events_per_stream = memory_configs.get('max_buffered_events_per_stream', 0)
+        self.max_buffered_events = memory_configs.get('max_buffered_events', 0)
+        self.bufferstream_idle_timeout = memory_configs.get('bufferstream_idle_timeout', 0)
+        self.is_managing_buffers_memory = any([
+            self.max_buffered_events_per_stream, self.max_buffered_events, self.bufferstream_idle_timeout
+        ])
+        self.buffered_events_count = 0
+        # (window_controller, buffer_stream_key) -> last update time, from least to most recently updated
+        self.bufferstream_last_updates = collections.OrderedDict()
+        self.memory_counters = {
+            'dropped_events': 0,
+            'evicted_bufferstreams': 0,
+            'evicted_events': 0,
+            'flushed_bufferstreams': 0,
+            'flushed_events': 0,
+        }
+
+        # claim-check mode: VEKG payloads are stored once, and windows only carry their event ids
+        self.payload_store = None
+        if claim_check_configs is not None:
+            self.payload_ttl = claim_check_configs['payload_ttl']
+            self.payload_store = create_payload_store(
+                self.stream_factory, key_prefix=f'{matcher_stream_key}-payload', ttl=self.payload_ttl
+            )
+            # payloads already in the store, and when they should be written again to refresh their ttl
+            self.stored_payload_refresh_deadlines = DeadlineHeap()
+
+        # sharding: each shard owns a consistent-hash range of the buffer stream keys and ignores the other
+        # events. Rebalances are marker events in the data stream (with the new `shard_ids`), so all shards
+        # see them at the same point of the stream, and open windows that changed owner are handed off
+        self.shard_ring = None
+        if sharding_configs is not None:
+            self.setup_sharding(service_stream_key, sharding_configs)
+
+        # worker processes: the events are only routed by their buffer stream key in this process,
+        # while the windows are built (and the events decoded) by the worker owning the buffer stream
+        self.worker_pool = None
+        if worker_configs is not None and worker_configs.get('count', 0) > 1:
+            if any([claim_check_configs, checkpoint_configs, sharding_configs]):
+                raise RuntimeError('Window workers can not be used with claim-check, checkpoints or sharding.')
+            worker_service_configs = {
+                'service_stream_key': service_stream_key,
+                'service_cmd_key_list': service_cmd_key_list,
+                'pub_event_list': [],
+                'service_details': None,
+                'matcher_stream_key': matcher_stream_key,
+                'logging_level': logging_level,
+                'tracer_configs': tracer_configs,
+                'raw_passthrough': raw_passthrough,
+                'window_wire_format': window_wire_format,
+                'tracing_configs': tracing_configs,
+                # the windows finished by a worker in each batch are sent back together
+                'batch_configs': dict(batch_configs, max_size=max(2, self.batch_max_size)),
+                'memory_configs': memory_configs,
+            }
+            self.worker_pool = WindowWorkerPool(
+                worker_configs['count'], worker_service_configs, queue_size=worker_configs.get('queue_size', 100)
+            )
+            self.worker_routing_fields = ['buffer_stream_key']
+
+        # checkpoints: the query windows and their open buffer streams are periodically saved
+        # (a full checkpoint followed by deltas of the changed buffer streams) and restored on startup
+        self.last_processed_event_id = None
+        self.checkpointer = None
+        if checkpoint_configs is not None:
+            checkpoint_storage = create_checkpoint_storage(
+                self.stream_factory, key=f'{service_stream_key}-checkpoint', path=checkpoint_configs.get('path')
+            )
+            self.checkpointer = WindowStateCheckpointer(
+                checkpoint_storage, max_deltas=checkpoint_configs.get('max_deltas', 10)
+            )
+            self.checkpoint_interval = checkpoint_configs.get('interval', 10)
+            self.next_checkpoint_time = time.monotonic() + self.checkpoint_interval
+            # window_controller -> buffer stream keys changed since the last checkpoint
+            self.checkpoint_dirty_bufferstreams = {}
+            self.checkpoint_removed_window_spec_keys = set()
+            # the data events are only acked once they are in a checkpoint, so the ones processed after the last
+            # checkpoint are still pending after a crash, and processed again on restart
+            self.uncheckpointed_event_ids = []
+            self.checkpointed_event_ids = []
+
+        # metrics: counters and histograms updated on the hot path (timings only for a sample of the calls),
+        # and gauges refreshed periodically by the data thread. They are served by an http endpoint (`port`)
+        # and/or logged every `dump_interval` seconds
+        if metrics_configs is None:
+            metrics_configs = {}
+        self.metrics = WindowManagerMetrics(sample_every=metrics_configs.get('sample_every', 100))
+        self.metrics_port = metrics_configs.get('port', 0)
+        self.metrics_refresh_interval = metrics_configs.get('refresh_interval', 5)
+        self.metrics_dump_interval = metrics_configs.get('dump_interval', 0)
+        self.next_metrics_refresh_time = time.monotonic() + self.metrics_refresh_interval
+        self.next_metrics_dump_time = time.monotonic() + self.metrics_dump_interval
+        self.metrics_server = None
+
+        # load shedding: while the input lag or the event processing time are over their limits (checked every
+        # `check_interval` seconds), frames and windows are shed with the configured policies (see LoadShedder)
+        self.load_shedder = None
+        if load_shedding_configs is not None and load_shedding_configs.get('policies'):
+            if self.worker_pool is not None:
+                raise RuntimeError('Load shedding can not be used with window workers.')
+            self.load_shedder = LoadShedder(
+                load_shedding_configs['policies'],
+                max_input_lag=load_shedding_configs.get('max_input_lag', 5),
+                max_event_processing_secs=load_shedding_configs.get('max_event_processing_ms', 0) / 1000,
+                recovery_ratio=load_shedding_configs.get('recovery_ratio', 0.5),
+                sample_every=load_shedding_configs.get('sample_every', 2),
+                coalesce_similarity=load_shedding_configs.get('coalesce_similarity', 0.9),
+                low_priority_query_ids=load_shedding_configs.get('low_priority_query_ids', ()),
+            )
+            self.load_check_interval = load_shedding_configs.get('check_interval', 1)
+            self.next_load_check_time = time.monotonic() + self.load_check_interval
+            # event processing histogram totals at the last check, to get the average time since then
+            self.last_load_check_processing = (0, 0.0)
+
+        # output backpressure: the output streams backlog is checked every `check_interval` seconds, and while it's
+        # over `max_backlog` the intake is paused, the stream is trimmed or the writes are spilled to disk
+        self.backpressure_configs = backpressure_configs
+        self.backpressure_streams = []
+        if backpressure_configs is not None and backpressure_configs.get('max_backlog'):
+            self.matcher_stream = self.create_backpressure_stream(self.matcher_stream)
+
         self.window_controllers = {
             'TUMBLING_COUNT_WINDOW': TumblingCountWindowController,
+            'TUMBLING_TIME_WINDOW': TumblingTimeWindowController,
+            'HOPPING_TIME_WINDOW': HoppingTimeWindowController,
+            'SLIDING_COUNT_WINDOW': SlidingCountWindowController,
+            'SESSION_WINDOW': SessionWindowController,
         }
 
-        self.query_windows = {}
+        # queries with the same window spec share the same controller instance, and each of its windows is
+        # emitted to the queries that were routed all its events (so a query added later starts with the next
+        # window). The registry is only replaced (never changed) under its lock, see QueryRegistry
+        self.query_registry = QueryRegistry()
+        self.query_registry_lock = threading.Lock()
+        # controllers without queries, whose buffers are released by the data thread
+        self.removed_window_controllers = collections.deque()
+        # only the controllers that reported a finished window since the last emission
+        self.finished_window_controllers = {}
+        # controllers with partial windows closed on a processing time deadline (`max_open_secs` window option),
+        # scheduled by the controllers themselves at (or before) the earliest deadline of their windows
+        self.window_timeout_deadlines = DeadlineHeap()
+
+    def create_backpressure_stream(self, stream):
+        configs = self.backpressure_configs
+        spill_path = None
+        if configs.get('spill_dir'):
+            spill_path = os.path.join(configs['spill_dir'], f'{stream.key}-spill.jsonl')
+        backpressure_stream = BackpressureStream(
+            stream,
+            max_backlog=configs['max_backlog'],
+            action=configs.get('action', 'pause'),
+            check_interval=configs.get('check_interval', 1),
+            resume_ratio=configs.get('resume_ratio', 0.8),
+            spill_path=spill_path,
+            logger=self.logger,
+            metrics=self.metrics,
+        )
+        self.backpressure_streams.append(backpressure_stream)
+        return backpressure_stream
+
+    def check_output_backpressure(self):
+        for backpressure_stream in self.backpressure_streams:
+            backpressure_stream.check()
+
+    def is_intake_paused(self):
+        return any(backpressure_stream.is_intake_paused() for backpressure_stream in self.backpressure_streams)
+
+    @property
+    def query_windows(self):
+        return self.query_registry.query_windows
+
+    @query_windows.setter
+    def query_windows(self, query_windows):
+        with self.query_registry_lock:
+            query_registry = self.query_registry.copy()
+            query_registry.query_windows = query_windows
+            self.query_registry = query_registry
+
+    @property
+    def window_spec_controllers(self):
+        return self.query_registry.window_spec_controllers
+
+    @property
+    def query_window_spec_keys(self):
+        return self.query_registry.query_window_spec_keys
+
+    @property
+    def window_controller_spec_keys(self):
+        return self.query_registry.window_controller_spec_keys
 
     def add_event_to_query_windows(self, event_data):
-        for query_id in event_data['query_ids']:
-            self.query_windows[query_id].update_windows(event_data)
+        for window_controller in self.get_routed_window_controllers(event_data['query_ids']):
+            if not self.is_managing_buffers_memory:
+                finished_bufferstream_keys = window_controller.update_windows(event_data)
+            else:
+                previous_buffered_events_count = window_controller.buffered_events_count
+                finished_bufferstream_keys = window_controller.update_windows(event_data)
+                self.buffered_events_count += window_controller.buffered_events_count - previous_buffered_events_count
+                self.update_bufferstream_usage(window_controller, event_data['buffer_stream_key'])
+            if finished_bufferstream_keys:
+                self.finished_window_controllers[window_controller] = None
+            if self.checkpointer is not None:
+                dirty_bufferstreams = self.checkpoint_dirty_bufferstreams.setdefault(window_controller, set())
+                dirty_bufferstreams.add(event_data['buffer_stream_key'])
+                dirty_bufferstreams.update(finished_bufferstream_keys)
+        if self.is_managing_buffers_memory:
+            self.evict_bufferstreams()
+
+    def get_routed_window_controllers(self, query_ids):
+        # the controllers of the queries, each updated only once
+        query_windows = self.query_registry.query_windows
+        window_controllers = {}
+        for query_id in query_ids:
+            window_controller = query_windows.get(query_id)
+            if window_controller is not None:
+                window_controllers[window_controller] = None
+        return list(window_controllers.keys())
+
+    def get_window_timeouts_wait(self):
+        # seconds until the next window timeout, or None if there is none
+        next_deadline = self.window_timeout_deadlines.next_deadline()
+        if next_deadline is None:
+            return None
+        return max(0.0, next_deadline - time.monotonic())
+
+    def close_timed_out_windows(self):
+        now = time.monotonic()
+        window_controller_spec_keys = self.query_registry.window_controller_spec_keys
+        for window_controller in self.window_timeout_deadlines.pop_expired(now):
+            if window_controller not in window_controller_spec_keys:
+                # the controller was removed
+                continue
+            previous_buffered_events_count = window_controller.buffered_events_count
+            closed_bufferstream_keys = window_controller.close_timed_out_windows(now)
+            self.buffered_events_count += window_controller.buffered_events_count - previous_buffered_events_count
+            if closed_bufferstream_keys:
+                self.finished_window_controllers[window_controller] = None
+                if self.checkpointer is not None:
+                    dirty_bufferstreams = self.checkpoint_dirty_bufferstreams.setdefault(window_controller, set())
+                    dirty_bufferstreams.update(closed_bufferstream_keys)
+            next_deadline = window_controller.get_next_timeout_deadline()
+            if next_deadline is not None:
+                self.window_timeout_deadlines.schedule(window_controller, next_deadline)
+        self.send_finished_windows()
+
+    def update_bufferstream_usage(self, window_controller, buffer_stream_key):
+        usage_key = (window_controller, buffer_stream_key)
+        self.bufferstream_last_updates[usage_key] = time.monotonic()
+        self.bufferstream_last_updates.move_to_end(usage_key)
+        if not self.max_buffered_events_per_stream:
+            return
+        if window_controller.get_bufferstream_events_count(buffer_stream_key) > self.max_buffered_events_per_stream:
+            dropped_events_count = window_controller.trim_bufferstream(
+                buffer_stream_key, self.max_buffered_events_per_stream
+            )
+            self.buffered_events_count -= dropped_events_count
+            self.memory_counters['dropped_events'] += dropped_events_count
+
+    def remove_bufferstream(self, window_controller, buffer_stream_key):
+        self.bufferstream_last_updates.pop((window_controller, buffer_stream_key), None)
+        removed_events_count = window_controller.evict_bufferstream(buffer_stream_key)
+        self.buffered_events_count -= removed_events_count
+        if self.checkpointer is not None:
+            self.checkpoint_dirty_bufferstreams.setdefault(window_controller, set()).add(buffer_stream_key)
+        return removed_events_count
+
+    def set_bufferstream_state(self, window_controller, buffer_stream_key, state):
+        previous_buffered_events_count = window_controller.buffered_events_count
+        window_controller.set_bufferstream_state(buffer_stream_key, state)
+        self.buffered_events_count += window_controller.buffered_events_count - previous_buffered_events_count
+        if self.is_managing_buffers_memory:
+            self.bufferstream_last_updates[(window_controller, buffer_stream_key)] = time.monotonic()
+        if self.checkpointer is not None:
+            self.checkpoint_dirty_bufferstreams.setdefault(window_controller, set()).add(buffer_stream_key)
+
+    def evict_bufferstream(self, window_controller, buffer_stream_key):
+        evicted_events_count = self.remove_bufferstream(window_controller, buffer_stream_key)
+        self.memory_counters['evicted_bufferstreams'] += 1
+        self.memory_counters['evicted_events'] += evicted_events_count
+        self.metrics.evicted_bufferstreams.labels('memory').inc()
+        self.logger.debug(f'Evicted buffer stream "{buffer_stream_key}" from {window_controller}')
+
+    def flush_bufferstream(self, window_controller, buffer_stream_key):
+        # the open windows of an idle buffer stream are sent to the matcher as they are, instead of being lost
+        previous_buffered_events_count = window_controller.buffered_events_count
+        if window_controller.flush_bufferstream(buffer_stream_key):
+            self.finished_window_controllers[window_controller] = None
+        flushed_events_count = previous_buffered_events_count - window_controller.buffered_events_count
+        self.buffered_events_count -= flushed_events_count
+        self.remove_bufferstream(window_controller, buffer_stream_key)
+        self.memory_counters['flushed_bufferstreams'] += 1
+        self.memory_counters['flushed_events'] += flushed_events_count
+        self.metrics.evicted_bufferstreams.labels('idle').inc()
+        self.logger.info(
+            f'Flushed idle buffer stream "{buffer_stream_key}" from {window_controller} ({flushed_events_count} events)'
+        )
+
+    def evict_bufferstreams(self):
+        last_updates = self.bufferstream_last_updates
+        if self.bufferstream_idle_timeout:
+            idle_since = time.monotonic() - self.bufferstream_idle_timeout
+            while last_updates:
+                usage_key, last_update = next(iter(last_updates.items()))
+                if last_update > idle_since:
+                    break
+                self.flush_bufferstream(*usage_key)
+        if self.max_buffered_events:
+            while last_updates and self.buffered_events_count > self.max_buffered_events:
+                self.evict_bufferstream(*next(iter(last_updates)))
 
     def send_finished_windows(self):
-        for query_id, window_controler in self.query_windows.items():
-            finished_windows = window_controler.get_and_reset_finished_bufferstream_windows()
-            for window in finished_windows:
-                self.send_window_to_matcher(query_id, window)
+        finished_window_controllers = self.finished_window_controllers
+        self.finished_window_controllers = {}
+        for window_controler in finished_window_controllers.keys():
+            for query_ids, window in window_controler.get_and_reset_finished_query_windows():
+                if len(query_ids) > 1:
+                    window = self.get_shared_window(window)
+                if self.load_shedder is None:
+                    for query_id in query_ids:
+                        self.send_window_to_matcher(query_id, window)
+                else:
+                    self.send_shed_window_to_matcher(window_controler, query_ids, window)
+
+    def get_shared_window(self, window):
+        # a window sent to several queries is a single pane, so its frames are only encoded once
+        if type(window) is not list:
+            return window
+        return PanedWindow([Pane(window)])
+
+    def send_shed_window_to_matcher(self, window_controller, query_ids, window):
+        shed_frames = self.load_shedder.get_window_shed_frames(window_controller, window)
+        dropped_query_ids = self.load_shedder.get_dropped_query_ids(query_ids)
+        if dropped_query_ids:
+            self.metrics.shed_query_windows.inc(len(dropped_query_ids))
+            query_ids = [query_id for query_id in query_ids if query_id not in dropped_query_ids]
+        load_shedding = None
+        if shed_frames or dropped_query_ids:
+            load_shedding = {'shed_frames': shed_frames, 'dropped_query_ids': dropped_query_ids}
+        for query_id in query_ids:
+            self.send_window_to_matcher(query_id, window, load_shedding=load_shedding)
 
-    def send_window_to_matcher(self, query_id, window):
+    def update_window_metrics(self, query_id, window):
+        self.metrics.windows_emitted.labels(query_id).inc()
+        if not window:
+            return
+        first_timestamp = window[0].get('timestamp')
+        last_timestamp = window[-1].get('timestamp')
+        if first_timestamp is not None and last_timestamp is not None:
+            self.metrics.window_fill_seconds.observe(float(last_timestamp) - float(first_timestamp))
+
+    def send_window_to_matcher(self, query_id, window, load_shedding=None):
         new_event_data = {
             'id': self.service_based_random_event_id(),
-            'vekg_stream': window,
             'query_id': query_id,
         }
-        self.logger.debug(f'Sending window to Matcher: {new_event_data}')
-        self.write_event_with_trace(new_event_data, self.matcher_stream)
+        if load_shedding is not None:
+            new_event_data['load_shedding'] = load_shedding
+        window_field = getattr(window, 'window_field', None)
+        if window_field is not None:
+            # aggregated windows (merged graphs, columnar) are sent inline even in claim-check mode
+            new_event_data[window_field] = window.to_dict()
+        elif self.payload_store is not None:
+            new_event_data['vekg_stream_refs'] = self.store_window_payloads(window)
+        else:
+            new_event_data['vekg_stream'] = window
+        # lazily formatted, since formatting the whole window is expensive
+        self.logger.debug('Sending window to Matcher: %s', new_event_data)
+        if self.is_buffering_matcher_output:
+            self.write_window_event_with_trace(new_event_data, window)
+        else:
+            self.metrics.matcher_write_seconds.call_sampled(self.write_window_event_with_trace, new_event_data, window)
+        self.update_window_metrics(query_id, window)
+
+    def write_window_event_with_trace(self, event_data, window):
+        span, tracer_headers = self.trace_sampler.get_tracer_headers(
+            self.tracer, event_data, window, self.matcher_stream_key
+        )
+        event_data['tracer'] = {'headers': tracer_headers}
+        try:
+            event_msg = self.window_event_serializer(event_data)
+            if self.is_buffering_matcher_output:
+                self.pending_matcher_event_msgs.append(event_msg)
+            else:
+                self.matcher_stream.write_events(event_msg)
+        finally:
+            if span is not None:
+                span.finish()
+
+    def process_data_event_wrapper(self, event_data, json_msg):
+        # no span for each frame, they are linked from the spans of the (sampled) windows instead
+        self.process_data_event(event_data, json_msg)
+
+    def flush_matcher_output(self):
+        if not self.pending_matcher_event_msgs:
+            return
+        event_msgs = self.pending_matcher_event_msgs
+        self.pending_matcher_event_msgs = []
+        self.metrics.matcher_write_seconds.call_sampled(write_events_pipelined, self.matcher_stream, event_msgs)
+
+    def store_window_payloads(self, window):
+        now = time.time()
+        refresh_deadlines = self.stored_payload_refresh_deadlines
+        refresh_deadlines.pop_expired(now)
+        new_payloads = {}
+        event_ids = []
+        for event_data in window:
+            event_id = event_data['id']
+            event_ids.append(event_id)
+            payload_key = self.payload_store.get_payload_key(event_id)
+            if payload_key in refresh_deadlines or payload_key in new_payloads:
+                continue
+            new_payloads[payload_key] = self.encode_frame(event_data)
+            refresh_deadlines.schedule(payload_key, now + self.payload_ttl / 2)
+        if new_payloads:
+            self.payload_store.put_many(new_payloads)
+        return {
+            'key_prefix': self.payload_store.key_prefix,
+            'event_ids': event_ids,
+        }
+
+    def encode_frame(self, event_data):
+        raw_json = getattr(event_data, 'raw_json', None)
+        if raw_json is not None:
+            return raw_json
+        return json.dumps(event_data)
+
+    def window_event_serializer(self, event_data):
+        window = event_data.get('vekg_stream')
+        panes = getattr(window, 'panes', None)
+        if window is not None and self.window_wire_format == MSGPACK_DELTA_FORMAT:
+            if panes is None:
+                return encode_window_msg(event_data)
+            return encode_window_msg(event_data, window.get_encoded_delta_frames(encode_window_frames))
+        if panes is not None:
+            # splices the (cached) pane encodings instead of re-encoding every frame of the window
+            encoded_frames = ', '.join(pane.get_encoded_frames(self.encode_frame) for pane in panes if pane.frames)
+        elif window is not None and self.raw_passthrough:
+            encoded_frames = ', '.join(self.encode_frame(frame) for frame in window)
+        else:
+            return self.default_event_serializer(event_data)
+
+        envelope = {k: v for k, v in event_data.items() if k != 'vekg_stream'}
+        event_json = f'{json.dumps(envelope)[:-1]}, "vekg_stream": [{encoded_frames}]}}'
+        return {'event': event_json}
+
+    def data_event_deserializer(self, json_msg):
+        if not self.raw_passthrough:
+            return self.default_event_deserializer(json_msg)
+        event_key = b'event' if b'event' in json_msg else 'event'
+        event_json = json_msg.get(event_key, '{}')
+        return parse_routing_fields(event_json, self.data_routing_fields)
+
+    def get_data_read_block(self):
+        # reads don't block past the next window timeout (None keeps the stream default)
+        timeouts_wait = self.get_window_timeouts_wait()
+        if any(stream.spilled_events_count for stream in self.backpressure_streams):
+            # nor past the next backpressure check, so spilled events are written even without new events
+            check_interval = self.backpressure_configs.get('check_interval', 1)
+            timeouts_wait = check_interval if timeouts_wait is None else min(timeouts_wait, check_interval)
+        if timeouts_wait is None:
+            return None
+        return max(1, int(timeouts_wait * 1000))
+
+    def read_data_events_batch(self):
+        event_list = read_events_with_block(
+            self.service_stream, count=self.batch_max_size, block=self.get_data_read_block()
+        )
+        if not event_list or self.batch_max_linger_ms <= 0:
+            return event_list
+        linger_deadline = time.perf_counter() + self.batch_max_linger_ms / 1000
+        while len(event_list) < self.batch_max_size:
+            remaining_ms = int((linger_deadline - time.perf_counter()) * 1000)
+            if remaining_ms <= 0:
+                break
+            more_events = read_events_with_block(
+                self.service_stream, count=self.batch_max_size - len(event_list), block=remaining_ms
+            )
+            if not more_events:
+                break
+            event_list.extend(more_events)
+        return event_list
+
+    def setup_sharding(self, service_stream_key, sharding_configs):
+        self.shard_id = sharding_configs['shard_id']
+        self.shard_virtual_nodes = sharding_configs.get('virtual_nodes', 64)
+        self.shard_handoff_timeout = sharding_configs.get('handoff_timeout', 30)
+        self.shard_ring = ConsistentHashRing(sharding_configs['shard_ids'], self.shard_virtual_nodes)
+        self.shard_routing_fields = ['buffer_stream_key', 'shard_ids']
+        # buffer_stream_key -> owner shard id, cleared on every rebalance
+        self.bufferstream_shard_ids = {}
+        # every shard reads all the data events, so they are read without a consumer group and never acked
+        self.service_stream = self.stream_factory.create(service_stream_key, stype='streamOnly')
+        self.ack_data_stream_events = False
+        self.handoff_stream_key_prefix = f'{service_stream_key}-handoff'
+        self.handoff_stream = self.stream_factory.create(
+            self.get_handoff_stream_key(self.shard_id), stype='streamOnly'
+        )
+        if hasattr(self.handoff_stream, 'block'):
+            # handoffs are only polled in between data reads, so they never block
+            self.handoff_stream.block = None
+        self.handoff_streams = {}
+        self.finished_rebalance_ids = set()
+        # rebalance waiting for the handoffs of the previous owners, and the events held in the meantime
+        self.pending_rebalance_id = None
+        self.pending_handoff_shard_ids = set()
+        self.previous_shard_ring = None
+        self.rebalance_deadline = None
+        self.held_data_events = []
+        self.early_window_handoffs = []
+
+    def get_handoff_stream_key(self, shard_id):
+        return f'{self.handoff_stream_key_prefix}-{shard_id}'
+
+    def get_event_json(self, json_msg):
+        event_key = b'event' if b'event' in json_msg else 'event'
+        return json_msg.get(event_key, '{}')
+
+    def get_bufferstream_shard_id(self, buffer_stream_key):
+        shard_id = self.bufferstream_shard_ids.get(buffer_stream_key)
+        if shard_id is None:
+            shard_id = self.shard_ring.get_shard(buffer_stream_key)
+            self.bufferstream_shard_ids[buffer_stream_key] = shard_id
+        return shard_id
+
+    def route_sharded_data_event(self, event_id, json_msg):
+        # returns True if the event should be processed by this shard now
+        routing_event = parse_routing_fields(self.get_event_json(json_msg), self.shard_routing_fields)
+        shard_ids = routing_event.get('shard_ids')
+        if shard_ids is not None:
+            self.rebalance_shards(routing_event['id'], shard_ids)
+            return False
+        buffer_stream_key = routing_event.get('buffer_stream_key')
+        if buffer_stream_key is None:
+            return True
+        if self.get_bufferstream_shard_id(buffer_stream_key) != self.shard_id:
+            return False
+        if self.pending_rebalance_id is not None:
+            previous_shard_id = self.previous_shard_ring.get_shard(buffer_stream_key)
+            if previous_shard_id in self.pending_handoff_shard_ids:
+                # the windows of this buffer stream are still being handed off by its previous owner
+                self.held_data_events.append((event_id, json_msg))
+                return False
+        return True
+
+    def rebalance_shards(self, rebalance_id, shard_ids):
+        if rebalance_id in self.finished_rebalance_ids or rebalance_id == self.pending_rebalance_id:
+            return
+        if self.pending_rebalance_id is not None:
+            self.finish_rebalance()
+        self.logger.info(f'Rebalancing shards from {list(self.shard_ring.shard_ids)} to {shard_ids}')
+        previous_shard_ring = self.shard_ring
+        self.shard_ring = ConsistentHashRing(shard_ids, self.shard_virtual_nodes)
+        self.bufferstream_shard_ids = {}
+
+        # the windows are handed off by the window spec of their controllers
+        window_handoffs = {}
+        for window_spec_key, window_controller in self.window_spec_controllers.items():
+            for buffer_stream_key in window_controller.get_bufferstream_keys():
+                shard_id = self.get_bufferstream_shard_id(buffer_stream_key)
+                if shard_id == self.shard_id:
+                    continue
+                state = window_controller.get_bufferstream_state(buffer_stream_key)
+                self.remove_bufferstream(window_controller, buffer_stream_key)
+                if state is not None:
+                    window_states = window_handoffs.setdefault(shard_id, {}).setdefault(window_spec_key, {})
+                    window_states[buffer_stream_key] = state
+        # every new shard gets a handoff (even if empty), so it knows when all previous owners are done
+        for shard_id in shard_ids:
+            if shard_id != self.shard_id:
+                self.send_window_handoff(shard_id, rebalance_id, window_handoffs.get(shard_id, {}))
+
+        if self.shard_id not in shard_ids:
+            self.finished_rebalance_ids.add(rebalance_id)
+            return
+        self.pending_rebalance_id = rebalance_id
+        self.pending_handoff_shard_ids = set(previous_shard_ring.shard_ids) - {self.shard_id}
+        self.previous_shard_ring = previous_shard_ring
+        self.rebalance_deadline = time.monotonic() + self.shard_handoff_timeout
+        early_window_handoffs = self.early_window_handoffs
+        self.early_window_handoffs = []
+        for window_handoff in early_window_handoffs:
+            self.receive_window_handoff(*window_handoff)
+
+    def send_window_handoff(self, shard_id, rebalance_id, window_states):
+        handoff_stream = self.handoff_streams.get(shard_id)
+        if handoff_stream is None:
+            handoff_stream = self.stream_factory.create(self.get_handoff_stream_key(shard_id), stype='streamOnly')
+            self.handoff_streams[shard_id] = handoff_stream
+        event_data = {
+            'id': self.service_based_random_event_id(),
+            'rebalance_id': rebalance_id,
+            'shard_id': self.shard_id,
+        }
+        handoff_stream.write_events({
+            'event': json.dumps(event_data),
+            'window_states': encode_json_state(window_states),
+        })
+
+    def receive_window_handoff(self, rebalance_id, shard_id, window_states):
+        if rebalance_id in self.finished_rebalance_ids:
+            self.logger.warning(f'Ignoring late windows handoff from shard "{shard_id}" for "{rebalance_id}"')
+            return
+        if rebalance_id != self.pending_rebalance_id:
+            # the sender reached the rebalance marker before this shard
+            self.early_window_handoffs.append((rebalance_id, shard_id, window_states))
+            return
+        for window_spec_key, bufferstream_states in window_states.items():
+            window_controller = self.window_spec_controllers.get(window_spec_key)
+            if window_controller is None:
+                self.logger.warning(f'Ignoring windows handoff for unknown window spec: {window_spec_key}')
+                continue
+            for buffer_stream_key, state in bufferstream_states.items():
+                self.set_bufferstream_state(window_controller, buffer_stream_key, state)
+        self.pending_handoff_shard_ids.discard(shard_id)
+
+    def process_window_handoffs(self):
+        for event_id, json_msg in read_events_with_block(self.handoff_stream, count=100):
+            event_data = self.default_event_deserializer(json_msg)
+            states_key = b'window_states' if b'window_states' in json_msg else 'window_states'
+            try:
+                window_states = decode_json_state(json_msg[states_key])
+            except Exception as e:
+                # the shard is not waited for anymore, but its windows are lost
+                self.logger.error(f'Ignoring invalid windows handoff from shard "{event_data["shard_id"]}":')
+                self.logger.exception(e)
+                window_states = {}
+            self.receive_window_handoff(event_data['rebalance_id'], event_data['shard_id'], window_states)
+        if not self.pending_handoff_shard_ids:
+            self.finish_rebalance()
+        elif time.monotonic() >= self.rebalance_deadline:
+            self.logger.warning(
+                f'Timeout waiting for the windows handoff of shards: {sorted(self.pending_handoff_shard_ids)}'
+            )
+            self.finish_rebalance()
+
+    def finish_rebalance(self):
+        self.finished_rebalance_ids.add(self.pending_rebalance_id)
+        self.pending_rebalance_id = None
+        self.pending_handoff_shard_ids = set()
+        self.previous_shard_ring = None
+        held_data_events = self.held_data_events
+        self.held_data_events = []
+        self.process_data_events(held_data_events)
+
+    def send_data_events_to_workers(self, event_list):
+        worker_events = [[] for _ in range(self.worker_pool.worker_count)]
+        failed_event_ids = []
+        for event_tuple in event_list:
+            event_id, json_msg = event_tuple
+            try:
+                routing_event = parse_routing_fields(self.get_event_json(json_msg), self.worker_routing_fields)
+                worker_index = self.worker_pool.get_worker_index(routing_event.get('buffer_stream_key'))
+                worker_events[worker_index].append(event_tuple)
+            except Exception as e:
+                self.logger.error(f'Error routing {json_msg}:')
+                self.logger.exception(e)
+                failed_event_ids.append(event_id)
+        # blocks while the queue of a worker is full
+        self.worker_pool.send_data_events(worker_events)
+        if failed_event_ids and self.ack_data_stream_events:
+            ack_events(self.service_stream, failed_event_ids)
+
+    def process_worker_outputs(self, timeout=1):
+        processed_event_ids = []
+        for stream_key, event_msgs in self.worker_pool.get_outputs(timeout=timeout):
+            if stream_key == PROCESSED_EVENTS_KEY:
+                processed_event_ids.extend(event_msgs)
+            elif stream_key == WORKER_METRICS_KEY:
+                self.metrics.set_worker_state(*event_msgs)
+            elif stream_key == self.matcher_stream_key:
+                write_events_pipelined(self.matcher_stream, event_msgs)
+        # the windows of the processed events were output before their ids, so they were already written
+        if processed_event_ids and self.ack_data_stream_events:
+            ack_events(self.service_stream, processed_event_ids)
+
+    def process_data_events(self, event_list):
+        if self.worker_pool is not None:
+            return self.send_data_events_to_workers(event_list)
+        for event_tuple in event_list:
+            event_id, json_msg = event_tuple
+            try:
+                if self.shard_ring is not None and not self.route_sharded_data_event(event_id, json_msg):
+                    continue
+                event_data = self.data_event_deserializer(json_msg)
+                self.process_data_event_wrapper(event_data, json_msg)
+            except Exception as e:
+                self.logger.error(f'Error processing {json_msg}:')
+                self.logger.exception(e)
+
+    def start_data_batch(self):
+        if self.removed_window_controllers:
+            self.release_removed_window_controllers()
+        if self.shard_ring is not None and self.pending_rebalance_id is not None:
+            self.process_window_handoffs()
+
+    def finish_data_batch(self, event_list):
+        # called once the windows of the batch were written to the matcher
+        if event_list:
+            self.last_processed_event_id = event_list[-1][0]
+            if self.checkpointer is not None and self.ack_data_stream_events:
+                self.uncheckpointed_event_ids.extend(event_id for event_id, _ in event_list)
+        if self.checkpointer is not None and time.monotonic() >= self.next_checkpoint_time:
+            self.write_checkpoint()
+        if time.monotonic() >= self.next_metrics_refresh_time:
+            self.refresh_metrics()
+        if self.load_shedder is not None and time.monotonic() >= self.next_load_check_time:
+            self.check_load()
+        if self.backpressure_streams:
+            self.check_output_backpressure()
+
+    def process_data(self):
+        self.logger.debug('Processing DATA..')
+        if not self.service_stream:
+            return
+        if self.backpressure_streams and self.is_intake_paused():
+            pause_time = self.backpressure_configs.get('check_interval', 1)
+            time.sleep(pause_time)
+            self.metrics.intake_paused_seconds.inc(pause_time)
+            return
+        self.start_data_batch()
+        self.process_data_batch(self.read_data_events_batch())
+
+    def process_data_batch(self, event_list):
+        try:
+            self.process_data_events(event_list)
+            if self.window_timeout_deadlines:
+                self.close_timed_out_windows()
+            self.flush_matcher_output()
+            self.finish_data_batch(event_list)
+        finally:
+            if self.ack_data_stream_events:
+                # we are always ack the events, even if they fail (same as the base service)
+                ack_events(self.service_stream, self.get_event_ids_to_ack(event_list))
+
+    def get_event_ids_to_ack(self, event_list):
+        if self.worker_pool is not None:
+            # acked once the workers processed them (see process_worker_outputs)
+            return []
+        if self.checkpointer is None:
+            return [event_id for event_id, _ in event_list]
+        # only the events in the last checkpoint (a failed batch is left pending until a restart)
+        event_ids = self.checkpointed_event_ids
+        self.checkpointed_event_ids = []
+        return event_ids
+
+    def process_pending_data_events(self):
+        # events read but not acked before a restart: the ones already in the restored checkpoint are only acked
+        checkpoint_event_id = None
+        if self.last_processed_event_id is not None:
+            checkpoint_event_id = get_stream_event_id_key(self.last_processed_event_id)
+        pending_events_count = 0
+        last_event_id = '0'
+        while True:
+            event_list = read_pending_events(self.service_stream, self.batch_max_size, last_event_id=last_event_id)
+            if not event_list:
+                break
+            last_event_id = event_list[-1][0]
+            if checkpoint_event_id is not None:
+                checkpointed_event_ids = [
+                    event_id for event_id, _ in event_list
+                    if get_stream_event_id_key(event_id) <= checkpoint_event_id
+                ]
+                ack_events(self.service_stream, checkpointed_event_ids)
+                event_list = event_list[len(checkpointed_event_ids):]
+            pending_events_count += len(event_list)
+            self.start_data_batch()
+            self.process_data_batch(event_list)
+        if pending_events_count:
+            self.logger.info(f'Processed {pending_events_count} pending events')
+
+    async def read_data_events_batch_async(self, data_stream):
+        event_list = await data_stream.read_events(count=self.batch_max_size)
+        if not event_list or self.batch_max_linger_ms <= 0:
+            return event_list
+        linger_deadline = time.perf_counter() + self.batch_max_linger_ms / 1000
+        while len(event_list) < self.batch_max_size:
+            remaining_ms = int((linger_deadline - time.perf_counter()) * 1000)
+            if remaining_ms <= 0:
+                break
+            more_events = await data_stream.read_events(
+                count=self.batch_max_size - len(event_list), block=remaining_ms
+            )
+            if not more_events:
+                break
+            event_list.extend(more_events)
+        return event_list
+
+    async def flush_matcher_output_async(self, stream_writer):
+        if not self.pending_matcher_event_msgs:
+            return
+        event_msgs = self.pending_matcher_event_msgs
+        self.pending_matcher_event_msgs = []
+        if isinstance(self.matcher_stream, BackpressureStream):
+            event_msgs = self.matcher_stream.get_events_to_write(event_msgs)
+            if not event_msgs:
+                return
+        write_kwargs = getattr(self.matcher_stream, 'default_write_kwargs', {})
+        matcher_write_seconds = self.metrics.matcher_write_seconds
+        if not matcher_write_seconds.should_sample():
+            await stream_writer.write_events(self.matcher_stream_key, event_msgs, **write_kwargs)
+            return
+        start_time = time.perf_counter()
+        await stream_writer.write_events(self.matcher_stream_key, event_msgs, **write_kwargs)
+        matcher_write_seconds.observe(time.perf_counter() - start_time)
+
+    async def process_data_async(self, data_stream, stream_writer):
+        if self.backpressure_streams and self.is_intake_paused():
+            pause_time = self.backpressure_configs.get('check_interval', 1)
+            await asyncio.sleep(pause_time)
+            self.metrics.intake_paused_seconds.inc(pause_time)
+            return
+        self.start_data_batch()
+        event_list = await self.read_data_events_batch_async(data_stream)
+        try:
+            self.process_data_events(event_list)
+            if self.window_timeout_deadlines:
+                self.close_timed_out_windows()
+            await self.flush_matcher_output_async(stream_writer)
+            self.finish_data_batch(event_list)
+            self.wake_up_async_timers()
+        finally:
+            if self.ack_data_stream_events:
+                await data_stream.ack(*self.get_event_ids_to_ack(event_list))
+
+    async def process_cmd_async(self, cg_sub_group, cmd_stream):
+        for stream_key, event_list in await cmd_stream.read_stream_events_list(count=10):
+            event_type = stream_key.decode('utf-8') if isinstance(stream_key, bytes) else stream_key
+            for event_id, json_msg in event_list:
+                try:
+                    event_data = self.default_event_deserializer(json_msg)
+                    self.process_event_type_wrapper(cg_sub_group, event_type, event_data, json_msg)
+                    self.log_state()
+                except Exception as e:
+                    self.logger.error(f'Error processing {json_msg}:')
+                    self.logger.exception(e)
+        self.wake_up_async_timers()
+
+    def process_timers(self):
+        # periodic work that doesn't need new data events (only in asyncio mode)
+        if self.removed_window_controllers:
+            self.release_removed_window_controllers()
+        if self.is_managing_buffers_memory:
+            self.evict_bufferstreams()
+        if self.window_timeout_deadlines:
+            self.close_timed_out_windows()
+        if self.finished_window_controllers:
+            self.send_finished_windows()
+        if self.checkpointer is not None and time.monotonic() >= self.next_checkpoint_time:
+            self.write_checkpoint()
+        if time.monotonic() >= self.next_metrics_refresh_time:
+            self.refresh_metrics()
+        if self.load_shedder is not None and time.monotonic() >= self.next_load_check_time:
+            self.check_load()
+        if self.backpressure_streams:
+            self.check_output_backpressure()
+
+    def get_next_timers_deadline(self):
+        # earliest time (time.monotonic) when process_timers has something to do
+        if self.removed_window_controllers or self.finished_window_controllers:
+            return time.monotonic()
+        deadlines = [self.next_metrics_refresh_time]
+        next_window_timeout = self.window_timeout_deadlines.next_deadline()
+        if next_window_timeout is not None:
+            deadlines.append(next_window_timeout)
+        if self.bufferstream_idle_timeout and self.bufferstream_last_updates:
+            # the least recently updated buffer stream is the first one
+            deadlines.append(next(iter(self.bufferstream_last_updates.values())) + self.bufferstream_idle_timeout)
+        if self.checkpointer is not None:
+            deadlines.append(self.next_checkpoint_time)
+        if self.load_shedder is not None:
+            deadlines.append(self.next_load_check_time)
+        deadlines.extend(backpressure_stream.next_check_time for backpressure_stream in self.backpressure_streams)
+        return min(deadlines)
+
+    def wake_up_async_timers(self):
+        if self.async_timers_wakeup is not None and self.get_next_timers_deadline() < self.async_timers_deadline:
+            self.async_timers_wakeup.set()
+
+    async def process_timers_async(self, stream_writer):
+        self.async_timers_deadline = self.get_next_timers_deadline()
+        self.async_timers_wakeup.clear()
+        try:
+            await asyncio.wait_for(
+                self.async_timers_wakeup.wait(), timeout=max(0, self.async_timers_deadline - time.monotonic())
+            )
+        except asyncio.TimeoutError:
+            pass
+        self.process_timers()
+        await self.flush_matcher_output_async(stream_writer)
+
+    async def run_async_forever(self, coroutine_function, *args):
+        while True:
+            try:
+                await coroutine_function(*args)
+            except Exception as e:
+                self.logger.exception(e)
+                await asyncio.sleep(self.async_timers_interval)
+
+    def create_async_streams(self):
+        redis_client = create_async_redis_client(self.stream_factory.redis_db)
+        data_stream = AsyncConsumerGroupStream(
+            redis_client, [self.service_stream.key], group_name=f'cg-{self.service_stream.key}'
+        )
+        cmd_streams = {
+            cg_sub_group: AsyncConsumerGroupStream(
+                redis_client, cg_key_list, group_name=self._get_cg_sub_group_id(cg_sub_group)
+            )
+            for cg_sub_group, cg_key_list in self.service_cmd_cg_keys_map.items() if cg_key_list
+        }
+        return data_stream, cmd_streams, AsyncStreamWriter(redis_client)
+
+    async def run_async(self):
+        self.async_timers_wakeup = asyncio.Event()
+        data_stream, cmd_streams, stream_writer = self.create_async_streams()
+        for stream in [data_stream] + list(cmd_streams.values()):
+            await stream.create_group()
+        coroutines = [
+            self.run_async_forever(self.process_data_async, data_stream, stream_writer),
+            self.run_async_forever(self.process_timers_async, stream_writer),
+        ]
+        for cg_sub_group, cmd_stream in cmd_streams.items():
+            coroutines.append(self.run_async_forever(self.process_cmd_async, cg_sub_group, cmd_stream))
+        await asyncio.gather(*coroutines)
 
-    @timer_logger
     def process_data_event(self, event_data, json_msg):
-        if not super(WindowManager, self).process_data_event(event_data, json_msg):
+        # same as the base service, but the event is only formatted if it's logged
+        if not self.event_validation_fields(event_data, self.data_validation_fields):
+            self.logger.info('Ignoring bad event data: %s', event_data)
             return False
+        self.logger.debug('Processing new data event: %s', event_data)
+        self.metrics.events_processed.inc()
+        if self.load_shedder is not None and self.load_shedder.is_overloaded:
+            shedding_policy = self.load_shedder.get_frame_shedding_policy(event_data)
+            if shedding_policy is not None:
+                self.metrics.shed_frames.labels(shedding_policy).inc()
+                return
+        self.metrics.event_processing_seconds.call_sampled(self.update_and_send_windows, event_data)
+
+    def update_and_send_windows(self, event_data):
         self.add_event_to_query_windows(event_data)
         self.send_finished_windows()
 
+    def get_input_lag(self):
+        # time between the last processed event and the last event written to the data stream
+        redis_db = getattr(self.service_stream, 'redis_db', None)
+        if redis_db is None or self.last_processed_event_id is None:
+            return None
+        stream_info = redis_db.xinfo_stream(self.service_stream.key)
+        head_event_time = get_stream_event_id_time(stream_info['last-generated-id'])
+        return max(0.0, head_event_time - get_stream_event_id_time(self.last_processed_event_id))
+
+    def refresh_metrics(self):
+        now = time.monotonic()
+        self.next_metrics_refresh_time = now + self.metrics_refresh_interval
+        bufferstream_events = collections.Counter()
+        late_events = collections.Counter()
+        for window_controller in self.query_registry.window_spec_controllers.values():
+            for buffer_stream_key in window_controller.get_bufferstream_keys():
+                events_count = window_controller.get_bufferstream_events_count(buffer_stream_key)
+                if events_count:
+                    bufferstream_events[buffer_stream_key] += events_count
+            late_events.update(window_controller.get_and_reset_late_events())
+        self.metrics.buffered_events.replace(bufferstream_events)
+        if late_events:
+            for buffer_stream_key, late_events_count in late_events.items():
+                self.metrics.late_events.labels(buffer_stream_key).inc(late_events_count)
+            self.logger.warning(f'Ignored late events, per buffer stream: {dict(late_events)}')
+        if self.backpressure_streams:
+            self.metrics.output_backlog.replace({stream.key: stream.backlog for stream in self.backpressure_streams})
+        try:
+            input_lag = self.get_input_lag()
+        except Exception as e:
+            self.logger.warning(f'Could not get the data stream input lag: {e}')
+            input_lag = None
+        if input_lag is not None:
+            self.metrics.input_lag_seconds.set(input_lag)
+        if self.metrics_dump_interval and now >= self.next_metrics_dump_time:
+            self.next_metrics_dump_time = now + self.metrics_dump_interval
+            self.logger.info(f'Metrics: {json.dumps(self.metrics.get_snapshot())}')
+
+    def get_average_event_processing_time(self):
+        # average of the (sampled) event processing times since the last load check
+        histogram = self.metrics.event_processing_seconds
+        last_count, last_sum = self.last_load_check_processing
+        self.last_load_check_processing = (histogram.count, histogram.sum)
+        if histogram.count <= last_count:
+            return None
+        return (histogram.sum - last_sum) / (histogram.count - last_count)
+
+    def check_load(self):
+        self.next_load_check_time = time.monotonic() + self.load_check_interval
+        try:
+            input_lag = self.get_input_lag()
+        except Exception as e:
+            self.logger.warning(f'Could not get the data stream input lag: {e}')
+            input_lag = None
+        event_processing_time = self.get_average_event_processing_time()
+        if self.load_shedder.update(input_lag, event_processing_time):
+            if self.load_shedder.is_overloaded:
+                self.logger.warning(
+                    f'Overloaded (input lag: {input_lag}, event processing time: {event_processing_time}), '
+                    f'shedding load with policies: {sorted(self.load_shedder.policies)}'
+                )
+            else:
+                self.logger.info('Overload is over, stopped shedding load')
+        self.metrics.overloaded.set(int(self.load_shedder.is_overloaded))
+
     def add_query_window_action(self, query_id, window):
         window_type = window['window_type'].upper()
         if window_type not in self.window_controllers.keys():
@@ -73,18 +1156,161 @@ class WindowManager(BaseEventDrivenCMDService):
                 )
             )
             return
-        if query_id in self.query_windows.keys():
-            self.logger.error(
-                (
-                    f'Query ID already has a window controller attached to it.'
-                    f'Will ignore this as a dupplicated event for query id: "{query_id}".'
+        with self.query_registry_lock:
+            if query_id in self.query_registry.query_windows:
+                self.logger.error(
+                    (
+                        f'Query ID already has a window controller attached to it.'
+                        f'Will ignore this as a dupplicated event for query id: "{query_id}".'
+                    )
                 )
-            )
-            return
+                return
 
-        window_controller_class = self.window_controllers[window_type]
-        window_controller_args = window['args']
-        self.query_windows[query_id] = window_controller_class(query_id, *window_controller_args)
+            query_registry = self.query_registry.copy()
+            window_controller_args = window['args']
+            window_spec_key = self.get_window_spec_key(window_type, window_controller_args)
+            window_controller = query_registry.window_spec_controllers.get(window_spec_key)
+            if window_controller is not None:
+                # the query starts with the next window of each buffer stream of the shared controller
+                window_controller.add_query_id(query_id)
+            else:
+                window_controller_class = self.window_controllers[window_type]
+                try:
+                    window_controller = window_controller_class(
+                        query_id, *window_controller_args, controller_timeouts=self.window_timeout_deadlines
+                    )
+                except ValueError as e:
+                    self.logger.error(
+                        f'Invalid window "{window}": {e}. Will ignore this window for query id: "{query_id}".'
+                    )
+                    return
+            self.register_window_controller(query_registry, window_spec_key, window_controller, [query_id])
+            self.query_registry = query_registry
+
+    def register_window_controller(self, query_registry, window_spec_key, window_controller, query_ids):
+        query_registry.window_spec_controllers[window_spec_key] = window_controller
+        query_registry.window_controller_spec_keys[window_controller] = window_spec_key
+        for query_id in query_ids:
+            query_registry.query_windows[query_id] = window_controller
+            query_registry.query_window_spec_keys[query_id] = window_spec_key
+
+    def remove_query_window_action(self, query_id):
+        with self.query_registry_lock:
+            if query_id not in self.query_registry.query_windows:
+                self.logger.error(
+                    (
+                        f'Query ID has no window controller attached to it.'
+                        f'Will ignore this remove event for query id: "{query_id}".'
+                    )
+                )
+                return
+            query_registry = self.query_registry.copy()
+            window_controller = query_registry.query_windows.pop(query_id)
+            window_spec_key = query_registry.query_window_spec_keys.pop(query_id, None)
+            is_controller_removed = window_controller.remove_query_id(query_id) == 0
+            if is_controller_removed:
+                query_registry.window_spec_controllers.pop(window_spec_key, None)
+                query_registry.window_controller_spec_keys.pop(window_controller, None)
+            self.query_registry = query_registry
+        self.metrics.windows_emitted.remove(query_id)
+        if is_controller_removed:
+            # no other query shares this controller, so all its windows are freed (by the data thread)
+            self.removed_window_controllers.append((window_spec_key, window_controller))
+
+    def release_removed_window_controllers(self):
+        while self.removed_window_controllers:
+            window_spec_key, window_controller = self.removed_window_controllers.popleft()
+            self.finished_window_controllers.pop(window_controller, None)
+            self.window_timeout_deadlines.cancel(window_controller)
+            if self.load_shedder is not None:
+                self.load_shedder.release_window_controller(window_controller)
+            if self.checkpointer is not None:
+                self.checkpoint_dirty_bufferstreams.pop(window_controller, None)
+                self.checkpoint_removed_window_spec_keys.add(window_spec_key)
+            if self.is_managing_buffers_memory:
+                self.buffered_events_count -= window_controller.buffered_events_count
+                for usage_key in list(self.bufferstream_last_updates.keys()):
+                    if usage_key[0] is window_controller:
+                        del self.bufferstream_last_updates[usage_key]
+
+    def get_checkpoint(self, is_full):
+        query_registry = self.query_registry
+        if is_full:
+            changed_bufferstreams = {
+                window_controller: window_controller.get_bufferstream_keys()
+                for window_controller in query_registry.window_spec_controllers.values()
+            }
+        else:
+            changed_bufferstreams = self.checkpoint_dirty_bufferstreams
+        controller_states = {}
+        bufferstream_states = {}
+        for window_controller, buffer_stream_keys in changed_bufferstreams.items():
+            window_spec_key = query_registry.window_controller_spec_keys.get(window_controller)
+            if window_spec_key is None:
+                continue
+            controller_states[window_spec_key] = window_controller.get_state()
+            states = {
+                buffer_stream_key: window_controller.get_bufferstream_state(buffer_stream_key)
+                for buffer_stream_key in buffer_stream_keys
+            }
+            if is_full:
+                states = {buffer_stream_key: state for buffer_stream_key, state in states.items() if state is not None}
+            bufferstream_states[window_spec_key] = states
+        last_event_id = self.last_processed_event_id
+        if isinstance(last_event_id, bytes):
+            last_event_id = last_event_id.decode('utf-8')
+        return {
+            'last_event_id': last_event_id,
+            'queries': query_registry.query_window_spec_keys,
+            'removed_window_spec_keys': [] if is_full else list(self.checkpoint_removed_window_spec_keys),
+            'controller_states': controller_states,
+            'bufferstream_states': bufferstream_states,
+        }
+
+    def write_checkpoint(self):
+        self.release_removed_window_controllers()
+        is_full = self.checkpointer.needs_full_checkpoint()
+        checkpoint = self.get_checkpoint(is_full)
+        self.checkpoint_dirty_bufferstreams = {}
+        self.checkpoint_removed_window_spec_keys = set()
+        checkpoint_name = self.checkpointer.write(checkpoint, is_full=is_full)
+        self.checkpointed_event_ids.extend(self.uncheckpointed_event_ids)
+        self.uncheckpointed_event_ids = []
+        self.next_checkpoint_time = time.monotonic() + self.checkpoint_interval
+        self.logger.debug(f'Wrote checkpoint "{checkpoint_name}"')
+
+    def restore_checkpoint(self):
+        checkpoint = self.checkpointer.load()
+        if checkpoint is None:
+            return False
+        for query_id, window_spec_key in checkpoint['queries'].items():
+            window_type, window_args = json.loads(window_spec_key)[:2]
+            window = {'window_type': window_type, 'args': window_args}
+            self.add_query_window_action(query_id, window)
+
+        restored_at = time.monotonic()
+        for window_spec_key, window_controller in self.window_spec_controllers.items():
+            controller_state = checkpoint['controller_states'].get(window_spec_key)
+            if controller_state is not None:
+                window_controller.set_state(controller_state)
+            for buffer_stream_key, state in checkpoint['bufferstream_states'].get(window_spec_key, {}).items():
+                window_controller.set_bufferstream_state(buffer_stream_key, state)
+                if self.is_managing_buffers_memory:
+                    self.bufferstream_last_updates[(window_controller, buffer_stream_key)] = restored_at
+            self.buffered_events_count += window_controller.buffered_events_count
+
+        self.last_processed_event_id = checkpoint['last_event_id']
+        if self.last_processed_event_id is not None and hasattr(self.service_stream, 'last_msg_id'):
+            # streams read without a consumer group resume right after the last processed event
+            self.service_stream.last_msg_id = self.last_processed_event_id
+        self.logger.info(
+            f'Restored checkpoint with {len(self.query_windows)} queries and '
+            f'{self.buffered_events_count} buffered events, last event id: "{self.last_processed_event_id}"'
+        )
+        return True
+
+    def get_window_spec_key(self, window_type, window_args):
+        return json.dumps([window_type, window_args], sort_keys=True)
 
     def process_event_type(self, event_type, event_data, json_msg):
         if not super(WindowManager, self).process_event_type(event_type, event_data, json_msg):
@@ -94,16 +1320,61 @@ class WindowManager(BaseEventDrivenCMDService):
             query_id = event_data['query_id']
             window = parsed_query['window']
             self.add_query_window_action(query_id=query_id, window=window)
+        elif event_type == 'QueryRemoved':
+            query_id = event_data['query_id']
+            self.remove_query_window_action(query_id=query_id)
+        else:
+            return
+        if self.worker_pool is not None:
+            if event_type == 'QueryCreated':
+                self.worker_pool.broadcast('add_query', query_id, window)
+            else:
+                self.worker_pool.broadcast('remove_query', query_id)
 
     def log_state(self):
         super(WindowManager, self).log_state()
         self._log_dict('Query Windows', self.query_windows)
+        self._log_dict('Window Spec Controllers', self.window_spec_controllers)
+        if self.shard_ring is not None:
+            self._log_dict('Shards', {'shard_id': self.shard_id, 'shard_ids': list(self.shard_ring.shard_ids)})
+        if self.is_managing_buffers_memory:
+            self._log_dict('Buffers Memory', dict(self.memory_counters, buffered_events=self.buffered_events_count))
+        if self.backpressure_streams:
+            self._log_dict('Output Backpressure', {
+                stream.key: {
+                    'backlog': stream.backlog,
+                    'is_backpressured': stream.is_backpressured,
+                    'spilled_events': stream.spilled_events_count,
+                }
+                for stream in self.backpressure_streams
+            })
+        self._log_dict('Metrics', self.metrics.get_snapshot())
 
     def run(self):
         super(WindowManager, self).run()
+        if self.checkpointer is not None:
+            self.restore_checkpoint()
+            if self.ack_data_stream_events:
+                self.process_pending_data_events()
+        if self.metrics_port:
+            self.metrics_server = MetricsHTTPServer(self.metrics, self.metrics_port)
+            self.metrics_server.start()
+            self.logger.info(f'Serving metrics at port {self.metrics_server.port}')
+        if self.run_mode == 'asyncio':
+            # not asyncio.run, which needs python 3.7
+            asyncio.get_event_loop().run_until_complete(self.run_async())
+            return
+        threads = []
+        if self.worker_pool is not None:
+            self.worker_pool.start()
+            self.worker_output_thread = threading.Thread(
+                target=self.run_forever, args=(self.process_worker_outputs,)
+            )
+            threads.append(self.worker_output_thread)
         self.cmd_thread = threading.Thread(target=self.run_forever, args=(self.process_cmd,))
         self.data_thread = threading.Thread(target=self.run_forever, args=(self.process_data,))
-        self.cmd_thread.start()
-        self.data_thread.start()
-        self.cmd_thread.join()
-        self.data_thread.join()
+        threads.extend([self.cmd_thread, self.data_thread])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
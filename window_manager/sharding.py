@@ -0,0 +1,34 @@
+import bisect
+import hashlib
+
+
+class ConsistentHashRing(object):
+    # Each shard is placed in `virtual_nodes` points of the ring, and a key belongs to the shard
+    # of the first point after the key's hash. Adding or removing a shard only moves the keys
+    # of the ring ranges next to its points.
+
+    def __init__(self, shard_ids, virtual_nodes=64):
+        self.shard_ids = tuple(shard_ids)
+        self.virtual_nodes = virtual_nodes
+        points = sorted(
+            (self.get_hash(f'{shard_id}#{node_index}'), shard_id)
+            for shard_id in self.shard_ids
+            for node_index in range(self.virtual_nodes)
+        )
+        self.point_hashes = [point_hash for point_hash, _ in points]
+        self.point_shard_ids = [shard_id for _, shard_id in points]
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}({list(self.shard_ids)}, virtual_nodes={self.virtual_nodes})'
+
+    def get_hash(self, key):
+        return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+    def get_shard(self, key):
+        if not self.point_hashes:
+            return None
+        point_index = bisect.bisect(self.point_hashes, self.get_hash(key))
+        if point_index == len(self.point_hashes):
+            point_index = 0
+        return self.point_shard_ids[point_index]
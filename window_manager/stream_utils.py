@@ -0,0 +1,52 @@
+from walrus.containers import make_python_attr as walrus_normalized_cg_stream_key
+
+
+def read_events_with_block(stream, count, block=None):
+    # redis streams read with their own `block` (in ms), this temporarily overrides it for one read
+    if block is None or not hasattr(stream, 'block'):
+        return list(stream.read_events(count=count))
+    default_block = stream.block
+    stream.block = block
+    try:
+        return list(stream.read_events(count=count))
+    finally:
+        stream.block = default_block
+
+
+def write_events_pipelined(stream, event_msgs):
+    # writes all the events in a single round trip for redis streams (one XADD each in a pipeline)
+    redis_db = getattr(stream, 'redis_db', None)
+    if redis_db is None or len(event_msgs) < 2:
+        return stream.write_events(*event_msgs)
+    write_kwargs = getattr(stream, 'default_write_kwargs', {})
+    pipeline = redis_db.pipeline(transaction=False)
+    for event_msg in event_msgs:
+        pipeline.xadd(stream.key, event_msg, **write_kwargs)
+    return pipeline.execute()
+
+
+def ack_events(stream, event_ids):
+    consumer_group = getattr(stream, 'input_consumer_group', None)
+    if consumer_group is None or len(event_ids) < 2:
+        for event_id in event_ids:
+            stream.ack(event_id)
+        return
+    cg_stream = getattr(consumer_group, walrus_normalized_cg_stream_key(stream.key))
+    cg_stream.ack(*event_ids)
+
+
+def read_pending_events(stream, count, last_event_id='0'):
+    # events delivered to the stream consumer but not acked yet (e.g.: before a restart), after `last_event_id`
+    consumer_group = getattr(stream, 'input_consumer_group', None)
+    if consumer_group is None:
+        return []
+    cg_stream = getattr(consumer_group, walrus_normalized_cg_stream_key(stream.key))
+    return list(cg_stream.read(count=count, last_id=last_event_id))
+
+
+def get_stream_event_id_key(event_id):
+    # redis stream ids are "<milliseconds>-<sequence>", this is their sort key
+    if isinstance(event_id, bytes):
+        event_id = event_id.decode('utf-8')
+    milliseconds, _, sequence = event_id.partition('-')
+    return int(milliseconds), int(sequence or 0)
@@ -0,0 +1,92 @@
+import random
+
+from event_service_utils.services.tracer import EVENT_ID_TAG, tags
+from jaeger_client import Config, SpanContext
+from opentracing import follows_from
+from opentracing.propagation import Format
+
+WINDOW_FRAMES_TAG = 'window-frames'
+WINDOW_QUERY_ID_TAG = 'window-query-id'
+
+
+def init_tracer(service_name, reporting_host, reporting_port, reporter_batch_size=100, reporter_flush_interval=1):
+    # every span created is reported (the windows are sampled by WindowTraceSampler), in batches of
+    # `reporter_batch_size` spans or every `reporter_flush_interval` seconds, without logging each span
+    config = Config(
+        config={
+            'sampler': {
+                'type': 'const',
+                'param': 1,
+            },
+            'local_agent': {
+                'reporting_host': reporting_host,
+                'reporting_port': reporting_port,
+            },
+            'logging': False,
+            'reporter_batch_size': reporter_batch_size,
+            'reporter_flush_interval': reporter_flush_interval,
+        },
+        service_name=service_name,
+    )
+    # unlike initialize_tracer, it works more than once per process (eg: for each service in the tests)
+    return config.new_tracer()
+
+
+class WindowTraceSampler(object):
+    # Head-based sampling of the window traces: the frames have no spans of their own, and each window
+    # sent to the matcher is the head of a trace that is sampled with `sample_ratio`. Sampled windows get
+    # a span that follows from the traces of (up to `max_linked_frames` of) their frames, while unsampled
+    # windows carry a not-sampled trace context, so the matcher doesn't trace them either.
+
+    def __init__(self, sample_ratio=1.0, max_linked_frames=10):
+        self.sample_ratio = sample_ratio
+        self.max_linked_frames = max_linked_frames
+
+    def should_sample(self):
+        if self.sample_ratio >= 1:
+            return True
+        return self.sample_ratio > 0 and random.random() < self.sample_ratio
+
+    def get_linked_frames(self, window):
+        # evenly spread over the window
+        frames_step = -(-len(window) // self.max_linked_frames) if self.max_linked_frames else 0
+        if not frames_step:
+            return []
+        return window[::frames_step]
+
+    def get_frame_references(self, tracer, window):
+        references = []
+        for frame in self.get_linked_frames(window):
+            tracer_headers = (frame.get('tracer') or {}).get('headers')
+            if not tracer_headers:
+                continue
+            try:
+                span_context = tracer.extract(Format.HTTP_HEADERS, tracer_headers)
+            except Exception:
+                # frames with corrupted trace headers are just not linked
+                continue
+            if span_context is not None:
+                references.append(follows_from(span_context))
+        return references
+
+    def get_tracer_headers(self, tracer, event_data, window, destination_stream_key):
+        # returns the span of the window if it's sampled (to be finished once the window is written),
+        # and the headers of its trace context
+        tracer_headers = {}
+        if not self.should_sample():
+            trace_id = random.getrandbits(64)
+            tracer.inject(SpanContext(trace_id, trace_id, None, 0), Format.HTTP_HEADERS, tracer_headers)
+            return None, tracer_headers
+        span = tracer.start_span(
+            'send_window_to_matcher',
+            references=self.get_frame_references(tracer, window),
+            tags={
+                tags.SPAN_KIND: tags.SPAN_KIND_PRODUCER,
+                tags.MESSAGE_BUS_DESTINATION: destination_stream_key,
+                EVENT_ID_TAG: event_data['id'],
+                WINDOW_FRAMES_TAG: len(window),
+                WINDOW_QUERY_ID_TAG: event_data['query_id'],
+            }
+        )
+        tracer.inject(span.context, Format.HTTP_HEADERS, tracer_headers)
+        return span, tracer_headers
@@ -1,27 +1,891 @@
+import collections
+import functools
+import math
+import time
 
-class TumblingCountWindowController(object):
+from window_manager.columnar import ColumnarWindow, get_numpy
+from window_manager.deadlines import DeadlineHeap
+from window_manager.merged_graphs import MergedGraphWindow
 
-    def __init__(self, query_id, *args):
+
+class Pane(object):
+    __slots__ = ('frames', 'query_ids', 'encoded_frames')
+
+    def __init__(self, frames, query_ids=None):
+        self.frames = tuple(frames)
+        # queries that were routed all the frames of the pane (see BaseWindowController.get_window_query_ids)
+        self.query_ids = query_ids
+        self.encoded_frames = None
+
+    def get_encoded_frames(self, encoder):
+        # a pane is shared by every window that overlaps it, so it is only encoded once
+        if self.encoded_frames is None:
+            self.encoded_frames = ', '.join(encoder(frame) for frame in self.frames)
+        return self.encoded_frames
+
+
+class PanedWindow(list):
+    # list of references to the frames in `panes` (the frames themselves are never copied)
+
+    def __init__(self, panes):
+        self.panes = tuple(panes)
+        self.encoded_delta_frames = None
+        super(PanedWindow, self).__init__(frame for pane in self.panes for frame in pane.frames)
+
+    def get_encoded_delta_frames(self, encoder):
+        # the window is sent to every query it was finished for, so its delta frames are only encoded once
+        if self.encoded_delta_frames is None:
+            self.encoded_delta_frames = encoder(self)
+        return self.encoded_delta_frames
+
+
+class PaneRingBuffer(object):
+    __slots__ = ('panes', 'open_pane', 'open_pane_query_ids', 'closed_panes_count')
+
+    def __init__(self, max_panes):
+        self.panes = collections.deque(maxlen=max_panes)
+        self.open_pane = []
+        self.open_pane_query_ids = None
+        self.closed_panes_count = 0
+
+
+class BaseWindowController(object):
+    # window options accepted by the controller, given as a dict after the window args, eg: [10, {"max_open_secs": 5}]
+    supported_options = ()
+    # values of the `aggregation` option, for the controllers that support it
+    supported_aggregations = ('merged_graph',)
+    timestamp_field = 'timestamp'
+
+    def __init__(self, query_id, *args, controller_timeouts=None):
         self.query_id = query_id
+        # every query sharing this controller (same window spec), in registration order
+        self.query_ids = (query_id,)
+        # finished windows and the queries they are emitted to, since the last emission
+        self.finished_windows = []
+        self.finished_windows_query_ids = []
         self.args = args
-        self.num_frames = self.args[0]
-        self.bufferstream_to_window_map = {}
-        self.finished_bufferstream_to_window_map = {}
+        # total of events currently buffered by this controller, in all its buffer streams
+        self.buffered_events_count = 0
+        # events ignored for being late (only in the event-time windows), in total and per buffer stream since
+        # they were last reported (see get_and_reset_late_events)
+        self.late_events_count = 0
+        self.unreported_late_events = collections.Counter()
+        options = {}
+        if args and isinstance(args[-1], dict):
+            options = dict(args[-1])
+        unsupported_options = set(options.keys()) - set(self.supported_options)
+        if unsupported_options:
+            raise ValueError(f'Unsupported options for {self.__class__.__name__}: {sorted(unsupported_options)}')
+        self.setup_aggregation(options.pop('aggregation', None), options.pop('columns', None))
+        # seconds an event-time window is kept open after the watermark passed its end, for late events
+        self.allowed_lateness = float(options.pop('allowed_lateness', 0))
+        if self.allowed_lateness < 0:
+            raise ValueError(f'Invalid allowed_lateness {self.allowed_lateness}, should not be negative')
+        self.setup_window_timeouts(**options)
+        # shared index of the controllers with processing time deadlines (given by the service), so that
+        # the expired windows are found without checking every controller
+        self.controller_timeouts = controller_timeouts
 
     def __repr__(self):
         class_name = self.__class__.__name__
         text = f'{class_name}("{self.query_id}", *{self.args})'
         return text
 
+    def add_query_id(self, query_id):
+        if query_id not in self.query_ids:
+            self.query_ids = self.query_ids + (query_id,)
+
+    def remove_query_id(self, query_id):
+        self.query_ids = tuple(q_id for q_id in self.query_ids if q_id != query_id)
+        return len(self.query_ids)
+
+    def get_routed_query_ids(self, event_data):
+        # the queries of this controller that the event was routed to
+        query_ids = self.query_ids
+        if len(query_ids) == 1:
+            return query_ids
+        event_query_ids = event_data['query_ids']
+        return tuple(query_id for query_id in query_ids if query_id in event_query_ids)
+
+    def get_window_query_ids(self, window_query_ids, event_data):
+        # A window is only emitted to the queries that were routed all its events (`window_query_ids` are the
+        # ones of its previous events, or None for its first event), so a query added to a controller with open
+        # windows starts with its next window, and the queries sharing it never get events routed to others
+        routed_query_ids = self.get_routed_query_ids(event_data)
+        if window_query_ids is None or window_query_ids is routed_query_ids:
+            return routed_query_ids
+        return tuple(query_id for query_id in window_query_ids if query_id in routed_query_ids)
+
+    def update_windows(self, event_data):
+        # returns the buffer stream keys that had their window finished by this event
+        raise NotImplementedError()
+
+    def finish_window(self, window, query_ids):
+        self.finished_windows.append(window)
+        self.finished_windows_query_ids.append(query_ids)
+
+    def get_and_reset_finished_bufferstream_windows(self):
+        windows = self.finished_windows
+        self.finished_windows = []
+        self.finished_windows_query_ids = []
+        return windows
+
+    def get_and_reset_finished_query_windows(self):
+        # (query ids, window) of the finished windows, without the queries removed in the meantime
+        windows_query_ids = self.finished_windows_query_ids
+        windows = self.get_and_reset_finished_bufferstream_windows()
+        return self.get_query_windows(windows_query_ids, windows)
+
+    def get_query_windows(self, windows_query_ids, windows):
+        controller_query_ids = self.query_ids
+        query_windows = []
+        for query_ids, window in zip(windows_query_ids, windows):
+            if query_ids is not controller_query_ids:
+                query_ids = tuple(query_id for query_id in query_ids if query_id in controller_query_ids)
+            if query_ids:
+                query_windows.append((query_ids, window))
+        return query_windows
+
+    def get_bufferstream_events_count(self, buffer_stream_key):
+        raise NotImplementedError()
+
+    def evict_bufferstream(self, buffer_stream_key):
+        # drops everything buffered for the buffer stream, returning the number of dropped events
+        raise NotImplementedError()
+
+    def trim_bufferstream(self, buffer_stream_key, max_events):
+        # drops buffered events until the buffer stream has at most `max_events`,
+        # returning the number of dropped events
+        raise NotImplementedError()
+
+    def get_state(self):
+        # controller level state (not specific to a buffer stream), used on checkpoints
+        return None
+
+    def set_state(self, state):
+        pass
+
+    def get_bufferstream_keys(self):
+        raise NotImplementedError()
+
+    def get_bufferstream_state(self, buffer_stream_key):
+        # json friendly state of the open window(s) of the buffer stream (besides the lazy events, see
+        # checkpoints.to_json_state), or None if nothing is buffered
+        raise NotImplementedError()
+
+    def set_bufferstream_state(self, buffer_stream_key, state):
+        raise NotImplementedError()
+
+    def get_query_ids_state(self, query_ids):
+        return None if query_ids is None else list(query_ids)
+
+    def set_query_ids_state(self, state):
+        # states without the queries of the window (eg: from older checkpoints) are emitted to all the queries
+        if state is None:
+            return self.query_ids
+        return tuple(state)
+
+    def get_event_timestamp(self, event_data):
+        return float(event_data[self.timestamp_field])
+
+    def count_late_event(self, buffer_stream_key):
+        self.late_events_count += 1
+        self.unreported_late_events[buffer_stream_key] += 1
+
+    def get_and_reset_late_events(self):
+        # buffer_stream_key -> events ignored for being late since the last call
+        late_events = self.unreported_late_events
+        self.unreported_late_events = collections.Counter()
+        return late_events
+
+    def setup_aggregation(self, aggregation, columns=None):
+        # "merged_graph" windows keep a single graph merged from the frames VEKGs, instead of the frames.
+        # "columnar" windows keep the numeric node attributes in `columns` as numpy arrays (see ColumnarWindow)
+        if aggregation is not None and aggregation not in self.supported_aggregations:
+            raise ValueError(f'Invalid aggregation "{aggregation}", should be one of: {self.supported_aggregations}')
+        if (aggregation == 'columnar') != bool(columns):
+            raise ValueError('The "columns" option is required by (and only used with) the "columnar" aggregation')
+        self.aggregation = aggregation
+        self.columns = tuple(columns or ())
+        if aggregation == 'merged_graph':
+            self.new_window = MergedGraphWindow
+        elif aggregation == 'columnar':
+            get_numpy()
+            self.new_window = functools.partial(
+                ColumnarWindow, self.columns, frames_capacity=self.get_window_frames_capacity()
+            )
+        else:
+            self.new_window = list
+
+    def get_window_state(self, window):
+        if self.aggregation is None:
+            return list(window)
+        return window.get_state()
+
+    def new_window_from_state(self, state):
+        window = self.new_window()
+        if self.aggregation is None:
+            window.extend(state)
+        else:
+            window.set_state(state)
+        return window
+
+    def get_window_frames_capacity(self):
+        # expected number of frames in each window, used to preallocate the columnar windows
+        return 1
+
+    def setup_window_timeouts(self, max_open_secs=None, max_event_secs=None, on_timeout='emit'):
+        # Partial windows can be closed before they are complete, either `max_open_secs` (processing time)
+        # after their first event, or once the watermark (highest event timestamp seen by this controller,
+        # in any buffer stream) is `max_event_secs` after the timestamp of their first event.
+        # Depending on `on_timeout`, the partial windows are emitted or discarded.
+        if on_timeout not in ('emit', 'discard'):
+            raise ValueError(f'Invalid on_timeout "{on_timeout}", should be "emit" or "discard"')
+        self.max_open_secs = max_open_secs
+        self.max_event_secs = max_event_secs
+        self.on_timeout = on_timeout
+        self.has_window_timeouts = max_open_secs is not None or max_event_secs is not None
+        self.watermark = None
+        # buffer stream key -> deadline of its open window, in processing time (time.monotonic) and event time
+        self.window_timeouts = DeadlineHeap()
+        self.window_event_deadlines = DeadlineHeap()
+
+    def start_window_timeouts(self, buffer_stream_key, event_data):
+        # called with the first event of a window
+        if self.max_open_secs is not None:
+            deadline = time.monotonic() + self.max_open_secs
+            self.window_timeouts.schedule(buffer_stream_key, deadline)
+            # a controller already in the index is never late, since its new deadlines are after the earliest one
+            if self.controller_timeouts is not None and self not in self.controller_timeouts:
+                self.controller_timeouts.schedule(self, deadline)
+        if self.max_event_secs is not None:
+            self.window_event_deadlines.schedule(
+                buffer_stream_key, self.get_event_timestamp(event_data) + self.max_event_secs
+            )
+
+    def is_window_timeouts_started(self, buffer_stream_key):
+        return buffer_stream_key in self.window_timeouts or buffer_stream_key in self.window_event_deadlines
+
+    def cancel_window_timeouts(self, buffer_stream_key):
+        self.window_timeouts.cancel(buffer_stream_key)
+        self.window_event_deadlines.cancel(buffer_stream_key)
+
+    def restore_window_timeouts(self, buffer_stream_key, window_events):
+        # the processing time deadline restarts, since it can't be carried over between processes
+        if not self.has_window_timeouts or not window_events:
+            return
+        if self.max_event_secs is not None:
+            latest_timestamp = max(self.get_event_timestamp(event_data) for event_data in window_events)
+            if self.watermark is None or latest_timestamp > self.watermark:
+                self.watermark = latest_timestamp
+        self.start_window_timeouts(buffer_stream_key, window_events[0])
+
+    def get_next_timeout_deadline(self):
+        return self.window_timeouts.next_deadline()
+
+    def close_timed_out_windows(self, now):
+        # returns the buffer stream keys that had their partial window closed
+        return [
+            buffer_stream_key for buffer_stream_key in self.window_timeouts.pop_expired(now)
+            if self.close_partial_window(buffer_stream_key)
+        ]
+
+    def advance_watermark(self, event_data):
+        # returns the buffer stream keys that had a window closed by the new watermark
+        timestamp = self.get_event_timestamp(event_data)
+        if self.watermark is not None and timestamp <= self.watermark:
+            return []
+        self.watermark = timestamp
+        finished_bufferstream_keys = self.close_expired_windows(timestamp)
+        if self.max_event_secs is not None:
+            finished_bufferstream_keys.extend(
+                buffer_stream_key for buffer_stream_key in self.window_event_deadlines.pop_expired(timestamp)
+                if self.close_partial_window(buffer_stream_key)
+            )
+        return finished_bufferstream_keys
+
+    def close_expired_windows(self, watermark):
+        # closes the event-time windows that ended before the watermark, returning their buffer stream keys
+        return []
+
+    def close_partial_window(self, buffer_stream_key):
+        # emits or discards (see on_timeout) the open window of the buffer stream, returning False if there was none
+        return self.close_open_windows(buffer_stream_key, is_emitted=self.on_timeout == 'emit')
+
+    def flush_bufferstream(self, buffer_stream_key):
+        # emits the open window of the buffer stream as it is, returning False if there was none
+        return self.close_open_windows(buffer_stream_key, is_emitted=True)
+
+    def close_open_windows(self, buffer_stream_key, is_emitted):
+        raise NotImplementedError()
+
+
+class TumblingCountWindowController(BaseWindowController):
+    supported_options = ('max_open_secs', 'max_event_secs', 'on_timeout', 'aggregation', 'columns')
+    supported_aggregations = ('merged_graph', 'columnar')
+
+    def __init__(self, query_id, *args, **kwargs):
+        super(TumblingCountWindowController, self).__init__(query_id, *args, **kwargs)
+        self.num_frames = self.args[0]
+        self.bufferstream_to_window_map = {}
+        self.bufferstream_window_query_ids = {}
+        self.finished_bufferstream_to_window_map = {}
+        self.finished_bufferstream_query_ids = {}
+
+    def get_window_frames_capacity(self):
+        return int(self.args[0])
+
     def update_windows(self, event_data):
         buffer_stream_key = event_data['buffer_stream_key']
-        window_list = self.bufferstream_to_window_map.setdefault(buffer_stream_key, [])
+        finished_bufferstream_keys = []
+        if self.max_event_secs is not None:
+            finished_bufferstream_keys = self.advance_watermark(event_data)
+        window_list = self.bufferstream_to_window_map.get(buffer_stream_key)
+        if window_list is None:
+            window_list = self.bufferstream_to_window_map[buffer_stream_key] = self.new_window()
         window_list.append(event_data)
+        window_query_ids = self.bufferstream_window_query_ids
+        window_query_ids[buffer_stream_key] = self.get_window_query_ids(
+            window_query_ids.get(buffer_stream_key), event_data
+        )
+        self.buffered_events_count += 1
         if len(window_list) >= self.num_frames:
             self.finished_bufferstream_to_window_map[buffer_stream_key] = window_list
-            self.bufferstream_to_window_map[buffer_stream_key] = []
+            self.finished_bufferstream_query_ids[buffer_stream_key] = window_query_ids.pop(buffer_stream_key)
+            self.bufferstream_to_window_map[buffer_stream_key] = self.new_window()
+            self.buffered_events_count -= len(window_list)
+            if self.has_window_timeouts:
+                self.cancel_window_timeouts(buffer_stream_key)
+            finished_bufferstream_keys.append(buffer_stream_key)
+        elif len(window_list) == 1 and self.has_window_timeouts:
+            self.start_window_timeouts(buffer_stream_key, event_data)
+        return finished_bufferstream_keys
+
+    def close_open_windows(self, buffer_stream_key, is_emitted):
+        self.cancel_window_timeouts(buffer_stream_key)
+        window_list = self.bufferstream_to_window_map.pop(buffer_stream_key, None)
+        query_ids = self.bufferstream_window_query_ids.pop(buffer_stream_key, None)
+        if not window_list:
+            return False
+        self.buffered_events_count -= len(window_list)
+        if is_emitted:
+            self.finished_bufferstream_to_window_map[buffer_stream_key] = window_list
+            self.finished_bufferstream_query_ids[buffer_stream_key] = query_ids
+        return True
 
     def get_and_reset_finished_bufferstream_windows(self):
         windows = self.finished_bufferstream_to_window_map.values()
         self.finished_bufferstream_to_window_map = {}
+        self.finished_bufferstream_query_ids = {}
         return windows
+
+    def get_and_reset_finished_query_windows(self):
+        windows_query_ids = self.finished_bufferstream_query_ids.values()
+        windows = self.get_and_reset_finished_bufferstream_windows()
+        return self.get_query_windows(windows_query_ids, windows)
+
+    def get_bufferstream_events_count(self, buffer_stream_key):
+        return len(self.bufferstream_to_window_map.get(buffer_stream_key, ()))
+
+    def evict_bufferstream(self, buffer_stream_key):
+        window_list = self.bufferstream_to_window_map.pop(buffer_stream_key, [])
+        self.bufferstream_window_query_ids.pop(buffer_stream_key, None)
+        self.buffered_events_count -= len(window_list)
+        if self.has_window_timeouts:
+            self.cancel_window_timeouts(buffer_stream_key)
+        return len(window_list)
+
+    def trim_bufferstream(self, buffer_stream_key, max_events):
+        # a partial count window can't lose frames without changing its size, so it is discarded
+        if self.get_bufferstream_events_count(buffer_stream_key) <= max_events:
+            return 0
+        return self.evict_bufferstream(buffer_stream_key)
+
+    def get_bufferstream_keys(self):
+        return list(self.bufferstream_to_window_map.keys())
+
+    def get_bufferstream_state(self, buffer_stream_key):
+        window_list = self.bufferstream_to_window_map.get(buffer_stream_key)
+        if not window_list:
+            return None
+        return {
+            'window': self.get_window_state(window_list),
+            'query_ids': self.get_query_ids_state(self.bufferstream_window_query_ids.get(buffer_stream_key)),
+        }
+
+    def set_bufferstream_state(self, buffer_stream_key, state):
+        self.evict_bufferstream(buffer_stream_key)
+        window_list = self.bufferstream_to_window_map[buffer_stream_key] = self.new_window_from_state(state['window'])
+        self.bufferstream_window_query_ids[buffer_stream_key] = self.set_query_ids_state(state['query_ids'])
+        self.buffered_events_count += len(window_list)
+        self.restore_window_timeouts(buffer_stream_key, window_list)
+
+
+class HoppingTimeWindowController(BaseWindowController):
+    # Event-time windows of `window_size` seconds, starting every `hop_size` seconds.
+    # The watermark is the highest event timestamp seen by this controller (in any buffer stream), and the open
+    # windows of all the buffer streams are kept in a single DeadlineHeap, so each window is closed in O(log n)
+    # once the watermark is `allowed_lateness` seconds after its end, even if its buffer stream stopped sending
+    # events. Events that only belong to already closed windows are counted as late and ignored, so the allowed
+    # lateness should cover how far behind the other publishers the slowest one can be.
+    supported_options = ('max_open_secs', 'max_event_secs', 'on_timeout', 'allowed_lateness')
+
+    def __init__(self, query_id, *args, hop_size=None, **kwargs):
+        super(HoppingTimeWindowController, self).__init__(query_id, *args, **kwargs)
+        self.window_size = float(self.args[0])
+        self.hop_size = float(self.args[1] if hop_size is None else hop_size)
+        # (buffer_stream_key, window_index) of every open window -> its end plus the allowed lateness
+        self.window_deadlines = DeadlineHeap()
+        # (buffer_stream_key, window_index) of every open window -> its queries
+        self.window_query_ids = {}
+        # each event is stored once per buffer stream, even if it belongs to overlapping windows
+        self.bufferstream_to_events_map = {}
+
+    def get_window_indexes(self, timestamp):
+        first_index = math.floor((timestamp - self.window_size) / self.hop_size) + 1
+        last_index = math.floor(timestamp / self.hop_size)
+        return range(first_index, last_index + 1)
+
+    def get_window_deadline(self, window_index):
+        return window_index * self.hop_size + self.window_size + self.allowed_lateness
+
+    def get_open_window_indexes(self, timestamp):
+        return [
+            window_index for window_index in self.get_window_indexes(timestamp)
+            if self.get_window_deadline(window_index) > self.watermark
+        ]
+
+    def get_bufferstream_window_indexes(self, buffer_stream_key):
+        # indexes of the open windows of the buffer stream, in order
+        return sorted({
+            window_index
+            for event_data in self.bufferstream_to_events_map.get(buffer_stream_key, ())
+            for window_index in self.get_window_indexes(self.get_event_timestamp(event_data))
+            if (buffer_stream_key, window_index) in self.window_deadlines
+        })
+
+    def schedule_windows(self, buffer_stream_key, window_indexes):
+        for window_index in window_indexes:
+            window_key = (buffer_stream_key, window_index)
+            if window_key not in self.window_deadlines:
+                self.window_deadlines.schedule(window_key, self.get_window_deadline(window_index))
+
+    def cancel_windows(self, buffer_stream_key):
+        # returns the indexes and queries of the cancelled open windows of the buffer stream
+        windows = []
+        for window_index in self.get_bufferstream_window_indexes(buffer_stream_key):
+            window_key = (buffer_stream_key, window_index)
+            self.window_deadlines.cancel(window_key)
+            windows.append((window_index, self.window_query_ids.pop(window_key, None)))
+        return windows
+
+    def close_window(self, buffer_stream_key, window_index, query_ids):
+        window_start = window_index * self.hop_size
+        window_end = window_start + self.window_size
+        next_window_start = window_start + self.hop_size
+        events = self.bufferstream_to_events_map.get(buffer_stream_key, [])
+        window = []
+        remaining_events = []
+        for event_data in events:
+            timestamp = self.get_event_timestamp(event_data)
+            if window_start <= timestamp < window_end:
+                window.append(event_data)
+            if timestamp >= next_window_start:
+                remaining_events.append(event_data)
+        if remaining_events:
+            self.bufferstream_to_events_map[buffer_stream_key] = remaining_events
+        else:
+            self.bufferstream_to_events_map.pop(buffer_stream_key, None)
+        self.buffered_events_count -= len(events) - len(remaining_events)
+        if window:
+            self.finish_window(window, query_ids)
+
+    def close_expired_windows(self, watermark):
+        finished_bufferstream_keys = []
+        for window_key in self.window_deadlines.pop_expired(watermark):
+            buffer_stream_key, window_index = window_key
+            self.close_window(buffer_stream_key, window_index, self.window_query_ids.pop(window_key))
+            finished_bufferstream_keys.append(buffer_stream_key)
+            if self.has_window_timeouts:
+                # the timeouts start over with the events left in the next windows
+                self.cancel_window_timeouts(buffer_stream_key)
+                events = self.bufferstream_to_events_map.get(buffer_stream_key)
+                if events:
+                    self.start_window_timeouts(buffer_stream_key, events[0])
+        return finished_bufferstream_keys
+
+    def update_windows(self, event_data):
+        buffer_stream_key = event_data['buffer_stream_key']
+        timestamp = self.get_event_timestamp(event_data)
+        finished_bufferstream_keys = self.advance_watermark(event_data)
+        window_indexes = self.get_open_window_indexes(timestamp)
+        if not window_indexes:
+            self.count_late_event(buffer_stream_key)
+            return finished_bufferstream_keys
+        self.schedule_windows(buffer_stream_key, window_indexes)
+        window_query_ids = self.window_query_ids
+        for window_index in window_indexes:
+            window_key = (buffer_stream_key, window_index)
+            window_query_ids[window_key] = self.get_window_query_ids(window_query_ids.get(window_key), event_data)
+        self.bufferstream_to_events_map.setdefault(buffer_stream_key, []).append(event_data)
+        self.buffered_events_count += 1
+        if self.has_window_timeouts and not self.is_window_timeouts_started(buffer_stream_key):
+            self.start_window_timeouts(buffer_stream_key, event_data)
+        return finished_bufferstream_keys
+
+    def close_open_windows(self, buffer_stream_key, is_emitted):
+        # closes all the open windows of the buffer stream
+        self.cancel_window_timeouts(buffer_stream_key)
+        windows = self.cancel_windows(buffer_stream_key)
+        if not windows:
+            return False
+        if is_emitted:
+            for window_index, query_ids in windows:
+                self.close_window(buffer_stream_key, window_index, query_ids)
+        events = self.bufferstream_to_events_map.pop(buffer_stream_key, [])
+        self.buffered_events_count -= len(events)
+        return True
+
+    def get_bufferstream_events_count(self, buffer_stream_key):
+        return len(self.bufferstream_to_events_map.get(buffer_stream_key, ()))
+
+    def evict_bufferstream(self, buffer_stream_key):
+        self.cancel_windows(buffer_stream_key)
+        events = self.bufferstream_to_events_map.pop(buffer_stream_key, [])
+        self.buffered_events_count -= len(events)
+        if self.has_window_timeouts:
+            self.cancel_window_timeouts(buffer_stream_key)
+        return len(events)
+
+    def trim_bufferstream(self, buffer_stream_key, max_events):
+        events = self.bufferstream_to_events_map.get(buffer_stream_key, [])
+        dropped_events_count = len(events) - max_events
+        if dropped_events_count <= 0:
+            return 0
+        del events[:dropped_events_count]
+        self.buffered_events_count -= dropped_events_count
+        return dropped_events_count
+
+    def get_state(self):
+        return {
+            'watermark': self.watermark,
+            'late_events_count': self.late_events_count,
+        }
+
+    def set_state(self, state):
+        self.watermark = state['watermark']
+        self.late_events_count = state['late_events_count']
+
+    def get_bufferstream_keys(self):
+        return list(self.bufferstream_to_events_map.keys())
+
+    def get_bufferstream_state(self, buffer_stream_key):
+        events = self.bufferstream_to_events_map.get(buffer_stream_key)
+        if not events:
+            return None
+        return {
+            'events': list(events),
+            'windows': [
+                [window_index, self.get_query_ids_state(self.window_query_ids.get((buffer_stream_key, window_index)))]
+                for window_index in self.get_bufferstream_window_indexes(buffer_stream_key)
+            ],
+        }
+
+    def set_bufferstream_state(self, buffer_stream_key, state):
+        # the state can also be moved to another controller with the same window spec (eg: when handing off
+        # a buffer stream), whose watermark may be ahead: its windows that already ended are closed by its
+        # next event
+        self.evict_bufferstream(buffer_stream_key)
+        if not state:
+            return
+        events = list(state['events'])
+        for window_index, query_ids_state in state['windows']:
+            self.schedule_windows(buffer_stream_key, [window_index])
+            self.window_query_ids[(buffer_stream_key, window_index)] = self.set_query_ids_state(query_ids_state)
+        self.bufferstream_to_events_map[buffer_stream_key] = events
+        self.buffered_events_count += len(events)
+        self.restore_window_timeouts(buffer_stream_key, events)
+
+
+class TumblingTimeWindowController(HoppingTimeWindowController):
+
+    def __init__(self, query_id, *args, **kwargs):
+        super(TumblingTimeWindowController, self).__init__(query_id, *args, hop_size=args[0], **kwargs)
+
+
+class SlidingCountWindowController(BaseWindowController):
+    # Windows of `window_size` frames emitted every `slide_size` frames for each buffer stream.
+    # Frames are grouped in panes of gcd(window_size, slide_size) frames, kept in a ring buffer
+    # bounded by the window size, and overlapping windows are built from the same panes.
+    # The timeouts of a partial window start with the first frame after the last emitted window.
+    supported_options = ('max_open_secs', 'max_event_secs', 'on_timeout')
+
+    def __init__(self, query_id, *args, **kwargs):
+        super(SlidingCountWindowController, self).__init__(query_id, *args, **kwargs)
+        self.window_size = int(self.args[0])
+        self.slide_size = int(self.args[1])
+        if self.window_size <= 0 or self.slide_size <= 0:
+            raise ValueError(
+                f'Invalid sliding window [{self.window_size}, {self.slide_size}], sizes should be positive'
+            )
+        if self.slide_size > self.window_size:
+            raise ValueError(
+                f'Invalid sliding window [{self.window_size}, {self.slide_size}], '
+                'the slide size should not be greater than the window size'
+            )
+        self.pane_size = math.gcd(self.window_size, self.slide_size)
+        self.panes_per_window = self.window_size // self.pane_size
+        self.panes_per_slide = self.slide_size // self.pane_size
+        self.bufferstream_to_ring_buffer_map = {}
+
+    def update_windows(self, event_data):
+        if not self.has_window_timeouts:
+            return self.add_event_to_ring_buffer(event_data)
+        buffer_stream_key = event_data['buffer_stream_key']
+        finished_bufferstream_keys = []
+        if self.max_event_secs is not None:
+            finished_bufferstream_keys = self.advance_watermark(event_data)
+        if not self.is_window_timeouts_started(buffer_stream_key):
+            self.start_window_timeouts(buffer_stream_key, event_data)
+        if self.add_event_to_ring_buffer(event_data):
+            self.cancel_window_timeouts(buffer_stream_key)
+            finished_bufferstream_keys.append(buffer_stream_key)
+        return finished_bufferstream_keys
+
+    def add_event_to_ring_buffer(self, event_data):
+        buffer_stream_key = event_data['buffer_stream_key']
+        ring_buffer = self.bufferstream_to_ring_buffer_map.get(buffer_stream_key)
+        if ring_buffer is None:
+            ring_buffer = PaneRingBuffer(max_panes=self.panes_per_window)
+            self.bufferstream_to_ring_buffer_map[buffer_stream_key] = ring_buffer
+
+        ring_buffer.open_pane.append(event_data)
+        ring_buffer.open_pane_query_ids = self.get_window_query_ids(ring_buffer.open_pane_query_ids, event_data)
+        self.buffered_events_count += 1
+        if len(ring_buffer.open_pane) < self.pane_size:
+            return []
+        if len(ring_buffer.panes) == self.panes_per_window:
+            # the ring buffer drops its oldest pane
+            self.buffered_events_count -= self.pane_size
+        ring_buffer.panes.append(Pane(ring_buffer.open_pane, ring_buffer.open_pane_query_ids))
+        ring_buffer.open_pane = []
+        ring_buffer.open_pane_query_ids = None
+        ring_buffer.closed_panes_count += 1
+
+        panes_after_first_window = ring_buffer.closed_panes_count - self.panes_per_window
+        if panes_after_first_window < 0 or panes_after_first_window % self.panes_per_slide != 0:
+            return []
+        self.finish_window(PanedWindow(ring_buffer.panes), self.get_panes_query_ids(ring_buffer.panes))
+        return [buffer_stream_key]
+
+    def get_panes_query_ids(self, panes, open_pane_query_ids=None):
+        # the queries of a window are the ones of all its panes
+        query_ids = open_pane_query_ids
+        for pane in panes:
+            if query_ids is None or query_ids is pane.query_ids:
+                query_ids = pane.query_ids
+            else:
+                query_ids = tuple(query_id for query_id in query_ids if query_id in pane.query_ids)
+        return query_ids
+
+    def get_unemitted_events(self, ring_buffer):
+        # events received after the last emitted window
+        if ring_buffer.closed_panes_count < self.panes_per_window:
+            unemitted_panes_count = ring_buffer.closed_panes_count
+        else:
+            unemitted_panes_count = (ring_buffer.closed_panes_count - self.panes_per_window) % self.panes_per_slide
+        panes = list(ring_buffer.panes)[len(ring_buffer.panes) - unemitted_panes_count:]
+        return [frame for pane in panes for frame in pane.frames] + ring_buffer.open_pane
+
+    def close_open_windows(self, buffer_stream_key, is_emitted):
+        # the partial window has the last `window_size` frames, and the buffer stream starts over after it
+        self.cancel_window_timeouts(buffer_stream_key)
+        ring_buffer = self.bufferstream_to_ring_buffer_map.get(buffer_stream_key)
+        if ring_buffer is None:
+            return False
+        frames = [frame for pane in ring_buffer.panes for frame in pane.frames] + ring_buffer.open_pane
+        query_ids = self.get_panes_query_ids(ring_buffer.panes, ring_buffer.open_pane_query_ids)
+        self.evict_bufferstream(buffer_stream_key)
+        if is_emitted and frames:
+            self.finish_window(frames[-self.window_size:], query_ids)
+        return True
+
+    def get_bufferstream_events_count(self, buffer_stream_key):
+        ring_buffer = self.bufferstream_to_ring_buffer_map.get(buffer_stream_key)
+        if ring_buffer is None:
+            return 0
+        return len(ring_buffer.panes) * self.pane_size + len(ring_buffer.open_pane)
+
+    def evict_bufferstream(self, buffer_stream_key):
+        events_count = self.get_bufferstream_events_count(buffer_stream_key)
+        self.bufferstream_to_ring_buffer_map.pop(buffer_stream_key, None)
+        self.buffered_events_count -= events_count
+        if self.has_window_timeouts:
+            self.cancel_window_timeouts(buffer_stream_key)
+        return events_count
+
+    def trim_bufferstream(self, buffer_stream_key, max_events):
+        # the ring buffer is already bounded by the window size, so it is only discarded if over the limit
+        if self.get_bufferstream_events_count(buffer_stream_key) <= max_events:
+            return 0
+        return self.evict_bufferstream(buffer_stream_key)
+
+    def get_bufferstream_keys(self):
+        return list(self.bufferstream_to_ring_buffer_map.keys())
+
+    def get_bufferstream_state(self, buffer_stream_key):
+        # only the frames are kept, the cached pane encodings are rebuilt on demand
+        ring_buffer = self.bufferstream_to_ring_buffer_map.get(buffer_stream_key)
+        if ring_buffer is None:
+            return None
+        return {
+            'panes': [list(pane.frames) for pane in ring_buffer.panes],
+            'panes_query_ids': [self.get_query_ids_state(pane.query_ids) for pane in ring_buffer.panes],
+            'open_pane': list(ring_buffer.open_pane),
+            'open_pane_query_ids': self.get_query_ids_state(ring_buffer.open_pane_query_ids),
+            'closed_panes_count': ring_buffer.closed_panes_count,
+        }
+
+    def set_bufferstream_state(self, buffer_stream_key, state):
+        self.evict_bufferstream(buffer_stream_key)
+        ring_buffer = PaneRingBuffer(max_panes=self.panes_per_window)
+        ring_buffer.panes.extend(
+            Pane(frames, self.set_query_ids_state(query_ids_state))
+            for frames, query_ids_state in zip(state['panes'], state['panes_query_ids'])
+        )
+        ring_buffer.open_pane = list(state['open_pane'])
+        if ring_buffer.open_pane:
+            ring_buffer.open_pane_query_ids = self.set_query_ids_state(state['open_pane_query_ids'])
+        ring_buffer.closed_panes_count = state['closed_panes_count']
+        self.bufferstream_to_ring_buffer_map[buffer_stream_key] = ring_buffer
+        self.buffered_events_count += self.get_bufferstream_events_count(buffer_stream_key)
+        self.restore_window_timeouts(buffer_stream_key, self.get_unemitted_events(ring_buffer))
+
+
+class SessionWindowController(BaseWindowController):
+    # Event-time sessions of each buffer stream, closed after a gap of `gap` seconds without events of
+    # that buffer stream, ie: once the watermark (the highest timestamp seen by this controller, in any buffer
+    # stream) reaches the timestamp of the session's last event plus the gap and the `allowed_lateness`.
+    # The open sessions are kept in a DeadlineHeap, so the sessions of stalled buffer streams are also closed
+    # in O(log n) as the watermark advances. Sessions are also closed once they have `max_length` events
+    # (the next events start a new session), so the buffered events are bounded.
+    supported_options = ('max_open_secs', 'max_event_secs', 'on_timeout', 'aggregation', 'allowed_lateness')
+
+    def __init__(self, query_id, *args, **kwargs):
+        super(SessionWindowController, self).__init__(query_id, *args, **kwargs)
+        self.gap = float(self.args[0])
+        self.max_length = int(self.args[1])
+        self.bufferstream_to_session_map = {}
+        self.bufferstream_session_query_ids = {}
+        # buffer stream key -> timestamp of the last event of its session plus the gap and allowed lateness
+        self.session_deadlines = DeadlineHeap()
+
+    def get_session_deadline(self, timestamp):
+        return timestamp + self.gap + self.allowed_lateness
+
+    def close_session(self, buffer_stream_key, is_emitted=True):
+        self.session_deadlines.cancel(buffer_stream_key)
+        if self.has_window_timeouts:
+            self.cancel_window_timeouts(buffer_stream_key)
+        session = self.bufferstream_to_session_map.pop(buffer_stream_key, None)
+        query_ids = self.bufferstream_session_query_ids.pop(buffer_stream_key, None)
+        if not session:
+            return False
+        self.buffered_events_count -= len(session)
+        if is_emitted:
+            self.finish_window(session, query_ids)
+        return True
+
+    def update_windows(self, event_data):
+        buffer_stream_key = event_data['buffer_stream_key']
+        timestamp = self.get_event_timestamp(event_data)
+        finished_bufferstream_keys = self.advance_watermark(event_data)
+        session = self.bufferstream_to_session_map.get(buffer_stream_key)
+        session_deadline = self.get_session_deadline(timestamp)
+        if session is None:
+            if session_deadline <= self.watermark:
+                # the session of this event would already be closed
+                self.count_late_event(buffer_stream_key)
+                return finished_bufferstream_keys
+            session = self.bufferstream_to_session_map[buffer_stream_key] = self.new_window()
+            if self.has_window_timeouts:
+                self.start_window_timeouts(buffer_stream_key, event_data)
+        else:
+            # out of order events don't move the session deadline back
+            session_deadline = max(session_deadline, self.session_deadlines.get_deadline(buffer_stream_key))
+        session.append(event_data)
+        session_query_ids = self.bufferstream_session_query_ids
+        session_query_ids[buffer_stream_key] = self.get_window_query_ids(
+            session_query_ids.get(buffer_stream_key), event_data
+        )
+        self.buffered_events_count += 1
+        if len(session) >= self.max_length:
+            self.close_session(buffer_stream_key)
+            finished_bufferstream_keys.append(buffer_stream_key)
+        else:
+            self.session_deadlines.schedule(buffer_stream_key, session_deadline)
+        return finished_bufferstream_keys
+
+    def close_expired_windows(self, watermark):
+        finished_bufferstream_keys = self.session_deadlines.pop_expired(watermark)
+        for buffer_stream_key in finished_bufferstream_keys:
+            self.close_session(buffer_stream_key)
+        return finished_bufferstream_keys
+
+    def close_open_windows(self, buffer_stream_key, is_emitted):
+        return self.close_session(buffer_stream_key, is_emitted=is_emitted)
+
+    def get_bufferstream_events_count(self, buffer_stream_key):
+        return len(self.bufferstream_to_session_map.get(buffer_stream_key, ()))
+
+    def evict_bufferstream(self, buffer_stream_key):
+        events_count = self.get_bufferstream_events_count(buffer_stream_key)
+        self.close_session(buffer_stream_key, is_emitted=False)
+        return events_count
+
+    def trim_bufferstream(self, buffer_stream_key, max_events):
+        session = self.bufferstream_to_session_map.get(buffer_stream_key, [])
+        if self.aggregation is not None and len(session) > max_events:
+            # frames can't be removed from a merged graph, so the whole session is discarded
+            return self.evict_bufferstream(buffer_stream_key)
+        dropped_events_count = len(session) - max_events
+        if dropped_events_count <= 0:
+            return 0
+        del session[:dropped_events_count]
+        self.buffered_events_count -= dropped_events_count
+        return dropped_events_count
+
+    def get_state(self):
+        return {
+            'watermark': self.watermark,
+            'late_events_count': self.late_events_count,
+        }
+
+    def set_state(self, state):
+        self.watermark = state['watermark']
+        self.late_events_count = state['late_events_count']
+
+    def get_bufferstream_keys(self):
+        return list(self.bufferstream_to_session_map.keys())
+
+    def get_bufferstream_state(self, buffer_stream_key):
+        session = self.bufferstream_to_session_map.get(buffer_stream_key)
+        if not session:
+            return None
+        return {
+            'window': self.get_window_state(session),
+            'query_ids': self.get_query_ids_state(self.bufferstream_session_query_ids.get(buffer_stream_key)),
+        }
+
+    def set_bufferstream_state(self, buffer_stream_key, state):
+        # the session deadline is rebuilt from the events, so the state can also be moved to another
+        # controller, whose watermark may be ahead: the session is then closed by its next event
+        self.evict_bufferstream(buffer_stream_key)
+        if not state:
+            return
+        session = self.bufferstream_to_session_map[buffer_stream_key] = self.new_window_from_state(state['window'])
+        self.bufferstream_session_query_ids[buffer_stream_key] = self.set_query_ids_state(state['query_ids'])
+        latest_timestamp = max(self.get_event_timestamp(event_data) for event_data in session)
+        self.session_deadlines.schedule(buffer_stream_key, self.get_session_deadline(latest_timestamp))
+        self.buffered_events_count += len(session)
+        self.restore_window_timeouts(buffer_stream_key, session)
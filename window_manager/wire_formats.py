@@ -0,0 +1,187 @@
+import json
+
+from window_manager.lazy_events import LazyVEKGEvent
+
+MSGPACK_DELTA_FORMAT = 'msgpack-delta'
+MSGPACK_DELTA_VERSION = 1
+WIRE_FORMATS = ('json', MSGPACK_DELTA_FORMAT)
+CONTAINER_TYPES = (dict, list, tuple)
+
+
+def get_msgpack():
+    # optional dependency, only needed for the "msgpack-delta" wire format
+    import msgpack
+    return msgpack
+
+
+class KeyTable(object):
+    # interns the dict keys of a window, so each key is encoded once and referenced by its index
+
+    def __init__(self, keys=None):
+        self.keys = list(keys or [])
+        self.key_ids = {key: key_id for key_id, key in enumerate(self.keys)}
+
+    def get_key_id(self, key):
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            key_id = self.key_ids[key] = len(self.keys)
+            self.keys.append(key)
+        return key_id
+
+    # scalars are returned as they are without a call per value, since they are most of the frame values
+    def intern(self, value):
+        value_type = type(value)
+        if value_type is dict:
+            return {
+                self.get_key_id(key): self.intern(item) if type(item) in CONTAINER_TYPES else item
+                for key, item in value.items()
+            }
+        if value_type in CONTAINER_TYPES:
+            return [self.intern(item) if type(item) in CONTAINER_TYPES else item for item in value]
+        return value
+
+    def unintern(self, value):
+        value_type = type(value)
+        if value_type is dict:
+            keys = self.keys
+            return {
+                keys[key_id]: self.unintern(item) if type(item) in CONTAINER_TYPES else item
+                for key_id, item in value.items()
+            }
+        if value_type is list:
+            return [self.unintern(item) if type(item) in CONTAINER_TYPES else item for item in value]
+        return value
+
+    # path elements are the (interned) dict keys, or -(index + 1) for list indexes
+    def get_path_element(self, key_or_index, is_list_index):
+        return -(key_or_index + 1) if is_list_index else self.get_key_id(key_or_index)
+
+    def get_path_key(self, path_element):
+        return -path_element - 1 if path_element < 0 else self.keys[path_element]
+
+
+def add_delta_ops(previous, current, path, ops, key_table):
+    # ops turning `previous` into `current`: [path, value] sets the value at the path, and [path] deletes it.
+    # Only containers are compared recursively, so each value is compared once
+    value_type = type(current)
+    if value_type is not type(previous) or value_type not in CONTAINER_TYPES:
+        if previous != current:
+            ops.append([path, key_table.intern(current)])
+        return
+    if value_type is dict:
+        for key, value in current.items():
+            if key not in previous:
+                ops.append([path + [key_table.get_path_element(key, False)], key_table.intern(value)])
+                continue
+            previous_value = previous[key]
+            if previous_value is value or (type(value) not in CONTAINER_TYPES and previous_value == value):
+                continue
+            add_delta_ops(previous_value, value, path + [key_table.get_path_element(key, False)], ops, key_table)
+        for key in previous:
+            if key not in current:
+                ops.append([path + [key_table.get_path_element(key, False)]])
+        return
+    if len(previous) == len(current) and path:
+        list_ops = []
+        changed_items_count = 0
+        for index, (previous_item, item) in enumerate(zip(previous, current)):
+            if previous_item is item:
+                continue
+            ops_count = len(list_ops)
+            item_path = path + [key_table.get_path_element(index, True)]
+            add_delta_ops(previous_item, item, item_path, list_ops, key_table)
+            if len(list_ops) > ops_count:
+                changed_items_count += 1
+        # eg: when the objects shifted positions, replacing the whole list is smaller
+        if changed_items_count * 2 <= len(current):
+            ops.extend(list_ops)
+            return
+    elif previous == current:
+        return
+    ops.append([path, key_table.intern(current)])
+
+
+def apply_delta_ops(previous, ops, key_table):
+    # containers are only copied along the changed paths, the rest is shared with the previous frame
+    frame = dict(previous)
+    copied_ids = {id(frame)}
+    for op in ops:
+        path = op[0]
+        container = frame
+        for path_element in path[:-1]:
+            key = key_table.get_path_key(path_element)
+            child = container[key]
+            if id(child) not in copied_ids:
+                child = container[key] = child.copy()
+                copied_ids.add(id(child))
+            container = child
+        key = key_table.get_path_key(path[-1])
+        if len(op) == 1:
+            del container[key]
+        else:
+            container[key] = key_table.unintern(op[1])
+    return frame
+
+
+def get_frame_dict(frame):
+    # plain dict, since the values are compared and interned by their exact type
+    if isinstance(frame, LazyVEKGEvent):
+        frame.decode()
+        return dict(frame)
+    return frame
+
+
+def encode_window_frames(frames):
+    # the first frame is encoded in full, and every other frame as the delta from its previous frame
+    key_table = KeyTable()
+    frames = [get_frame_dict(frame) for frame in frames]
+    first_frame = key_table.intern(frames[0]) if frames else None
+    frame_deltas = []
+    for previous, frame in zip(frames, frames[1:]):
+        ops = []
+        add_delta_ops(previous, frame, [], ops, key_table)
+        frame_deltas.append(ops)
+    payload = [MSGPACK_DELTA_VERSION, key_table.keys, first_frame, frame_deltas]
+    return get_msgpack().packb(payload, use_bin_type=True)
+
+
+def decode_window_frames(data):
+    version, keys, first_frame, frame_deltas = get_msgpack().unpackb(data, raw=False, strict_map_key=False)
+    if version != MSGPACK_DELTA_VERSION:
+        raise ValueError(f'Unsupported {MSGPACK_DELTA_FORMAT} version: {version}')
+    if first_frame is None:
+        return []
+    key_table = KeyTable(keys)
+    frame = key_table.unintern(first_frame)
+    frames = [frame]
+    for ops in frame_deltas:
+        frame = apply_delta_ops(frame, ops, key_table)
+        frames.append(frame)
+    return frames
+
+
+def encode_window_msg(event_data, encoded_frames=None):
+    # the window event json (readable by any service, eg: for tracing) without its frames,
+    # which are in the binary `vekg_stream` field (given when already encoded for another query)
+    envelope = {k: v for k, v in event_data.items() if k != 'vekg_stream'}
+    envelope['vekg_stream_format'] = MSGPACK_DELTA_FORMAT
+    if encoded_frames is None:
+        encoded_frames = encode_window_frames(event_data['vekg_stream'])
+    return {
+        'event': json.dumps(envelope),
+        'vekg_stream': encoded_frames,
+    }
+
+
+def decode_window_msg(json_msg):
+    # decodes the window msgs of any wire format, eg: in the matcher
+    event_key = b'event' if b'event' in json_msg else 'event'
+    event_data = json.loads(json_msg[event_key])
+    wire_format = event_data.pop('vekg_stream_format', None)
+    if wire_format is None:
+        return event_data
+    if wire_format != MSGPACK_DELTA_FORMAT:
+        raise ValueError(f'Unknown window wire format: {wire_format}')
+    frames_key = b'vekg_stream' if b'vekg_stream' in json_msg else 'vekg_stream'
+    event_data['vekg_stream'] = decode_window_frames(json_msg[frames_key])
+    return event_data
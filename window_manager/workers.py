@@ -0,0 +1,148 @@
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+
+from event_service_utils.streams.base import BasicStream, StreamFactory
+
+# key of the worker outputs with the ids of the events processed by a worker (no stream has it), sent after
+# the windows of those events, so they can be acked once the windows are written
+PROCESSED_EVENTS_KEY = None
+# key of the worker outputs with the (worker index, metrics state) of a worker, merged into the service metrics
+WORKER_METRICS_KEY = ('metrics',)
+
+
+class QueueStream(BasicStream):
+    # write-only stream of a worker process: the written events are sent back to the main process
+
+    def __init__(self, key, output_queue):
+        BasicStream.__init__(self, key)
+        self.output_queue = output_queue
+
+    def read_events(self, count=1):
+        return iter(())
+
+    def read_stream_events_list(self, count=1):
+        return []
+
+    def write_events(self, *events):
+        self.output_queue.put((self.key, list(events)))
+
+
+class QueueStreamFactory(StreamFactory):
+
+    def __init__(self, output_queue):
+        self.output_queue = output_queue
+
+    def create(self, key, stype=None, cg_id=None):
+        return QueueStream(key=key, output_queue=self.output_queue)
+
+
+def run_window_worker(worker_index, worker_service_configs, event_queue, output_queue):
+    # imported here, since the worker process only needs the service when it starts
+    from window_manager.service import WindowManager
+
+    service = WindowManager(stream_factory=QueueStreamFactory(output_queue), **worker_service_configs)
+    while True:
+        try:
+            # wakes up for the window timeouts even if no tasks arrive
+            worker_tasks = event_queue.get(timeout=service.get_window_timeouts_wait())
+        except queue.Empty:
+            worker_tasks = []
+        if worker_tasks is None:
+            break
+        service.start_data_batch()
+        processed_event_ids = []
+        for task_type, task_args in worker_tasks:
+            if task_type == 'data':
+                service.process_data_events(task_args)
+                processed_event_ids.extend(event_id for event_id, _ in task_args)
+            elif task_type == 'add_query':
+                service.add_query_window_action(*task_args)
+            elif task_type == 'remove_query':
+                service.remove_query_window_action(*task_args)
+        if service.window_timeout_deadlines:
+            service.close_timed_out_windows()
+        service.flush_matcher_output()
+        if processed_event_ids:
+            output_queue.put((PROCESSED_EVENTS_KEY, processed_event_ids))
+        if time.monotonic() >= service.next_metrics_refresh_time:
+            service.refresh_metrics()
+            output_queue.put((WORKER_METRICS_KEY, (worker_index, service.metrics.get_state())))
+
+
+class WindowWorkerPool(object):
+    # Each worker process runs its own window manager (without any real stream), owning the windows of the
+    # buffer streams hashed to it. Every worker has a single input queue, so the events of a buffer stream
+    # are processed in order, and the windows it finishes are sent back through a shared output queue.
+    # The queues are bounded (`queue_size` batches for each worker), so the puts block when the workers fall behind.
+    # The tasks broadcast to all the workers (eg: query changes) are sent along with the next data events, by
+    # the same thread, so the workers get both in the order they were handled by the service.
+
+    def __init__(self, worker_count, worker_service_configs, queue_size=100):
+        self.worker_count = worker_count
+        self.worker_service_configs = worker_service_configs
+        # workers are always spawned, since forking a process with a tracer (and its threads) isn't safe
+        self.mp_context = multiprocessing.get_context('spawn')
+        self.event_queues = [self.mp_context.Queue(maxsize=queue_size) for _ in range(worker_count)]
+        self.output_queue = self.mp_context.Queue(maxsize=queue_size * worker_count)
+        self.processes = []
+        self.pending_broadcast_tasks = []
+        self.pending_broadcast_tasks_lock = threading.Lock()
+
+    def __repr__(self):
+        class_name = self.__class__.__name__
+        return f'{class_name}(worker_count={self.worker_count})'
+
+    def start(self):
+        for worker_index, event_queue in enumerate(self.event_queues):
+            process = self.mp_context.Process(
+                target=run_window_worker,
+                args=(worker_index, self.worker_service_configs, event_queue, self.output_queue),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    def stop(self, timeout=None):
+        for event_queue in self.event_queues:
+            event_queue.put(None)
+        for process in self.processes:
+            process.join(timeout)
+        self.processes = []
+
+    def get_worker_index(self, buffer_stream_key):
+        if buffer_stream_key is None:
+            return 0
+        return zlib.crc32(buffer_stream_key.encode('utf-8')) % self.worker_count
+
+    def send_data_events(self, worker_events):
+        # worker_events: one list of (event_id, json_msg) per worker, each sent in a single queue put, after the
+        # tasks broadcast since the last call
+        with self.pending_broadcast_tasks_lock:
+            broadcast_tasks = self.pending_broadcast_tasks
+            self.pending_broadcast_tasks = []
+        for event_queue, event_list in zip(self.event_queues, worker_events):
+            worker_tasks = list(broadcast_tasks)
+            if event_list:
+                worker_tasks.append(('data', event_list))
+            if worker_tasks:
+                event_queue.put(worker_tasks)
+
+    def broadcast(self, task_type, *task_args):
+        # sent to the workers by the next send_data_events
+        with self.pending_broadcast_tasks_lock:
+            self.pending_broadcast_tasks.append((task_type, task_args))
+
+    def get_outputs(self, timeout):
+        # returns the (stream_key, event_msgs) written by the workers (and the (PROCESSED_EVENTS_KEY, event_ids)
+        # of their batches), waiting at most `timeout` for the first
+        outputs = []
+        try:
+            outputs.append(self.output_queue.get(timeout=timeout))
+            while True:
+                outputs.append(self.output_queue.get_nowait())
+        except queue.Empty:
+            pass
+        return outputs